@@ -0,0 +1,93 @@
+"""
+Ro'yxat endpointlari uchun seriyalash narxi: eski yo'l va yangi yo'l (bitta qator uchun).
+
+- eski: created_at fromisoformat + pydantic List[Model] validatsiyasi + json.dumps
+- yangi: model_rows (validatsiyasiz) + FastJSONResponse (orjson)
+
+Ishlatish:
+    cd backend && python bench_serialization.py [--rows 1000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench")
+
+from pydantic import TypeAdapter  # noqa: E402
+
+from server import Booking, FastJSONResponse, Guest, Room, model_rows, orjson  # noqa: E402
+
+
+def make_rows(count: int):
+    now = datetime.now(timezone.utc)
+    rooms, guests, bookings = [], [], []
+    for i in range(count):
+        created_at = now - timedelta(minutes=i)
+        rooms.append({
+            "id": str(uuid.uuid4()), "room_number": str(100 + i), "room_type": "2 kishilik", "capacity": 2,
+            "price_per_night": 250000.0, "status": "Available", "description": "Ikki kishilik xona",
+            "created_at": created_at,
+        })
+        guests.append({
+            "id": str(uuid.uuid4()), "full_name": f"Mehmon {i}", "phone": f"+99890{i:07d}",
+            "passport_id": f"AB{i:07d}", "id_type": "passport", "id_number": None, "birth_date": "1990-01-01",
+            "nation": "O'zbek", "region": "Surxondaryo", "street": "Mustaqillik 1", "created_at": created_at,
+        })
+        bookings.append({
+            "id": str(uuid.uuid4()), "guest_ids": [guests[-1]["id"]], "room_id": rooms[-1]["id"],
+            "check_in_date": "2025-01-10", "check_out_date": "2025-01-12", "total_price": 500000.0,
+            "status": "Checked Out", "checked_in_at": "2025-01-10", "checked_out_at": "2025-01-12",
+            "guest_names": [guests[-1]["full_name"]], "room_number": rooms[-1]["room_number"],
+            "nights": 2, "created_at": created_at,
+        })
+    return {"rooms": (Room, rooms), "guests": (Guest, guests), "bookings": (Booking, bookings)}
+
+
+ADAPTERS = {model: TypeAdapter(List[model]) for model in (Room, Guest, Booking)}
+
+
+def old_path(model, docs):
+    # docs: eski saqlash formati (created_at - ISO satr)
+    rows = [dict(doc) for doc in docs]
+    for row in rows:
+        if isinstance(row.get("created_at"), str):
+            row["created_at"] = datetime.fromisoformat(row["created_at"])
+    adapter = ADAPTERS[model]
+    content = adapter.dump_python(adapter.validate_python(rows), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def new_path(model, docs):
+    return FastJSONResponse(model_rows(model, docs)).body
+
+
+def measure(fn, model, docs, repeat: int) -> float:
+    fn(model, docs)  # isitish
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(model, docs)
+    return (time.perf_counter() - start) / repeat / len(docs) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if orjson is not None else 'no (stdlib json fallback)'}; rows={args.rows}")
+    print(f"{'endpoint':<10} {'old us/row':>12} {'new us/row':>12} {'speedup':>8}")
+    for name, (model, docs) in make_rows(args.rows).items():
+        legacy_docs = [dict(doc, created_at=doc["created_at"].isoformat()) for doc in docs]
+        old = measure(old_path, model, legacy_docs, args.repeat)
+        new = measure(new_path, model, docs, args.repeat)
+        print(f"{name:<10} {old:>12.2f} {new:>12.2f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
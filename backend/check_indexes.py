@@ -0,0 +1,151 @@
+"""
+Indekslarni tekshirish: har bir endpoint so'rov shakli uchun explain() ishlatiladi.
+Agar biror so'rov COLLSCAN ga tushsa, skript 1 kodi bilan tugaydi.
+
+Ishlatish:
+    cd backend && python check_indexes.py
+"""
+import asyncio
+import sys
+from datetime import datetime, timezone
+
+from server import client, db, ensure_indexes, month_range
+
+TODAY = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+MONTH = TODAY[:7]
+
+# (nom, kolleksiya, filter, sort)
+QUERY_SHAPES = [
+    ("auth: user by username", "users", {"username": "admin"}, None),
+    ("users: by id", "users", {"id": "x"}, None),
+    ("rooms: by id", "rooms", {"id": "x"}, None),
+    ("rooms: by room_number", "rooms", {"room_number": "101"}, None),
+    ("rooms: by status", "rooms", {"status": "Available"}, None),
+    ("guests: by id", "guests", {"id": "x"}, None),
+    ("guests: list", "guests", {}, [("created_at", -1), ("id", -1)]),
+    ("guests: sort by full_name", "guests", {}, [("full_name", 1), ("id", 1)]),
+    ("guests: search exact keys", "guests", {"search_keys": {"$all": ["=alisher", "=karimov"]}}, None),
+    (
+        "guests: search prefix keys",
+        "guests",
+        {"search_keys": {"$all": ["alisher", "kar"]}, "id": {"$nin": ["x"]}},
+        None,
+    ),
+    ("guests: search keys backfill", "guests", {"search_keys_v": {"$ne": 0}}, None),
+    ("bookings: by id", "bookings", {"id": "x"}, None),
+    ("bookings: list", "bookings", {}, [("created_at", -1), ("id", -1)]),
+    ("bookings: list by status", "bookings", {"status": "Confirmed"}, [("created_at", -1), ("id", -1)]),
+    ("bookings: sort by check_in_date", "bookings", {}, [("check_in_date", -1), ("id", -1)]),
+    (
+        "bookings: keyset after cursor",
+        "bookings",
+        {"$or": [{"created_at": {"$lt": TODAY}}, {"created_at": TODAY, "id": {"$lt": "x"}}]},
+        [("created_at", -1), ("id", -1)],
+    ),
+    (
+        "bookings: keyset after datetime cursor",
+        "bookings",
+        {
+            "$or": [
+                {"created_at": {"$lt": datetime.now(timezone.utc)}},
+                {"created_at": datetime.now(timezone.utc), "id": {"$lt": "x"}},
+                {"created_at": {"$type": "string"}},
+                {"created_at": None},
+            ]
+        },
+        [("created_at", -1), ("id", -1)],
+    ),
+    ("bookings: archive by guest", "bookings", {"guest_ids": "x"}, [("check_in_date", -1), ("id", -1)]),
+    (
+        "bookings: archive by status and dates",
+        "bookings",
+        {"status": "Checked Out", "check_in_date": {"$gte": "2025-01-01", "$lte": TODAY}},
+        [("check_in_date", -1), ("id", -1)],
+    ),
+    (
+        "bookings: room conflicts",
+        "bookings",
+        {
+            "room_id": "x",
+            "status": {"$in": ["Confirmed", "Checked In"]},
+            "check_out_date": {"$gt": TODAY},
+            "check_in_date": {"$lt": "2100-01-01"},
+        },
+        None,
+    ),
+    (
+        "calendar: stay window",
+        "bookings",
+        {"check_out_date": {"$gt": f"{MONTH}-01"}, "check_in_date": {"$lt": TODAY}, "status": {"$ne": "Cancelled"}},
+        [("check_in_date", 1)],
+    ),
+    ("dashboard: today checkins", "bookings", {"checked_in_at": TODAY}, None),
+    (
+        "dashboard: legacy checkins",
+        "bookings",
+        {
+            "check_in_date": TODAY,
+            "status": "Checked In",
+            "$or": [{"checked_in_at": None}, {"checked_in_at": {"$exists": False}}],
+        },
+        None,
+    ),
+    (
+        "dashboard: today income",
+        "bookings",
+        {"$or": [{"checked_in_at": TODAY}, {"check_in_date": TODAY, "status": "Checked In", "checked_in_at": None}]},
+        None,
+    ),
+    ("dashboard: upcoming", "bookings", {"status": "Confirmed"}, None),
+    ("reports: daily checkouts", "bookings", {"checked_out_at": TODAY}, None),
+    ("reports: monthly checkins", "bookings", {"checked_in_at": month_range(MONTH)}, None),
+    ("expenses: by id", "expenses", {"id": "x"}, None),
+    ("expenses: list", "expenses", {}, [("date", -1)]),
+    (
+        "expenses: by category and dates",
+        "expenses",
+        {"category": "Kommunal", "date": {"$gte": "2025-01-01", "$lte": TODAY}},
+        [("date", -1)],
+    ),
+    ("expenses: monthly", "expenses", {"date": month_range(MONTH)}, None),
+]
+
+
+def find_stages(plan: dict, stage: str) -> bool:
+    if not isinstance(plan, dict):
+        return False
+    if plan.get("stage") == stage:
+        return True
+    children = []
+    if "inputStage" in plan:
+        children.append(plan["inputStage"])
+    children.extend(plan.get("inputStages", []))
+    return any(find_stages(child, stage) for child in children)
+
+
+async def check_query_shapes() -> int:
+    failures = 0
+    for name, collection_name, query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(query, {"_id": 0})
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if find_stages(winning_plan, "COLLSCAN"):
+            failures += 1
+            print(f"❌ {name} - COLLSCAN on {collection_name}: {query}")
+        else:
+            print(f"✅ {name}")
+    return failures
+
+
+async def main() -> int:
+    await ensure_indexes()
+    failures = await check_query_shapes()
+    client.close()
+    print(f"\n{len(QUERY_SHAPES) - failures}/{len(QUERY_SHAPES)} query shapes use an index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
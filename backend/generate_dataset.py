@@ -0,0 +1,419 @@
+"""
+Masshtab testlari uchun sintetik ma'lumotlar (deterministik: bir xil --seed va --today -> bir xil baza).
+
+- rooms: barcha room_type lar bo'yicha, faol bronlar stays ro'yxatida
+- guests: search_keys bilan, doimiy mijozlar ko'proq qaytadi
+- bookings: har bir xona uchun vaqt chizig'i (kesishmaydi), mavsumiy bandlik,
+  Checked Out / Checked In / Confirmed / Cancelled aralashmasi, checked_in_at / checked_out_at
+- expenses: har bir kategoriya bo'yicha yillar davomidagi chiqimlar
+- oxirida indekslar va rollups qayta quriladi
+
+Hujjatlar bevosita insert_many bilan yoziladi, shakli server.py dagi modellar bilan tekshiriladi.
+Users kolleksiyasiga tegilmaydi. Generatsiyadan keyin serverni qayta ishga tushiring
+(dashboard snapshot va ETag versiyalari jarayon xotirasida).
+
+Ishlatish:
+    cd backend && python generate_dataset.py --preset medium --drop [--seed 42] [--today 2025-06-01]
+    cd backend && python generate_dataset.py --preset small --rooms 120 --drop
+"""
+import argparse
+import asyncio
+import math
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+from server import (
+    Booking,
+    Expense,
+    Guest,
+    Room,
+    VERSIONED_COLLECTIONS,
+    bump_stored_versions,
+    client,
+    db,
+    ensure_indexes,
+    guest_search_fields,
+    rebuild_rollups,
+    room_stay,
+)
+
+# preset -> (xonalar, mehmonlar, yillar)
+PRESETS = {
+    "small": (60, 5_000, 2),
+    "medium": (300, 100_000, 5),
+    "large": (900, 400_000, 10),
+}
+GENERATED_COLLECTIONS = ["rooms", "guests", "bookings", "expenses", "rollups"]
+FUTURE_DAYS = 120
+# API kabi username saqlanadi; demo admin (initialize_demo_data) - bazadan qat'i nazar bir xil natija
+EXPENSE_CREATED_BY = "admin"
+
+# room_type -> (ulush, sig'im, narx bir kecha uchun, tavsif)
+ROOM_TYPES = {
+    "1 kishilik": (20, 1, 150_000, "Bir kishilik xona"),
+    "2 kishilik": (35, 2, 250_000, "Ikki kishilik xona"),
+    "3 kishilik": (18, 3, 350_000, "Uch kishilik xona"),
+    "4 kishilik": (10, 4, 450_000, "To'rt kishilik xona"),
+    "5 kishilik": (5, 5, 550_000, "Besh kishilik xona"),
+    "VIP": (7, 2, 750_000, "VIP xona"),
+    "Lux": (5, 3, 1_000_000, "Lux xona"),
+}
+ROOMS_PER_FLOOR = 30
+STAY_NIGHTS = ([1, 2, 3, 4, 5, 7, 14], [45, 25, 12, 7, 5, 4, 2])
+BASE_OCCUPANCY = 0.72
+CANCEL_RATE = 0.12
+EARLY_CHECKOUT_RATE = 0.03
+
+FIRST_NAMES = [
+    "Alisher", "Bobur", "Jasur", "Sardor", "Otabek", "Sherzod", "Dilshod", "Akmal", "Rustam", "Farrux",
+    "Jahongir", "Ulug'bek", "Sanjar", "Temur", "Aziz", "Malika", "Dilnoza", "Nodira", "Gulnora", "Shahnoza",
+    "Madina", "Zarina", "Feruza", "Kamola", "Nilufar", "Sevara", "Mohira", "Dildora", "Yulduz", "Barno",
+]
+FEMALE_NAMES = set(FIRST_NAMES[15:])
+LAST_NAMES = [
+    "Karimov", "Rahimov", "Toshmatov", "Yusupov", "Aliyev", "Xolmatov", "Ergashev", "Nazarov", "Qodirov",
+    "Sultonov", "Mirzayev", "Abdullayev", "Hasanov", "Ismoilov", "Tursunov", "Umarov", "Saidov", "Jo'rayev",
+    "Normatov", "Boboyev", "Murodov", "Sobirov", "Rasulov", "Xudoyberdiyev", "Eshonqulov",
+]
+NATIONS = (["O'zbek", "Tojik", "Qozoq", "Rus", "Turkman", "Qirg'iz"], [80, 7, 4, 4, 3, 2])
+REGIONS = [
+    "Surxondaryo", "Qashqadaryo", "Toshkent", "Samarqand", "Buxoro", "Farg'ona", "Andijon", "Namangan",
+    "Jizzax", "Sirdaryo", "Navoiy", "Xorazm", "Qoraqalpog'iston",
+]
+STREETS = ["Mustaqillik", "Amir Temur", "Navoiy", "Bobur", "Alpomish", "Istiqlol", "Do'stlik", "Guliston"]
+
+# kategoriya -> [(nom, kun yoki ehtimol, minimal summa, maksimal summa)]
+# kun (int) - har oyning shu kunida; ehtimol (float) - har kuni shu ehtimol bilan
+EXPENSE_PLAN = {
+    "Maosh": [("Maosh - qabulxona", 5, 6_000, 9_000), ("Maosh - tozalash", 5, 4_000, 6_000),
+              ("Maosh - oshxona", 5, 5_000, 7_000)],
+    "Kommunal": [("Elektr energiyasi", 10, 1_500, 3_000), ("Gaz", 10, 800, 2_000),
+                 ("Suv", 10, 400, 900), ("Internet", 10, 100, 150)],
+    "Oziq-ovqat": [("Nonushta mahsulotlari", 0.6, 300, 1_200)],
+    "Ta'mirlash": [("Ta'mirlash ishlari", 0.08, 500, 6_000)],
+    "Boshqa": [("Xo'jalik mollari", 0.15, 100, 800)],
+}
+
+
+def make_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def at_time(day: date, rng: random.Random) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(86400))
+
+
+def check_shape(model, doc: dict, extra_fields: frozenset = frozenset()):
+    """
+    Generatsiya qilingan hujjat model bilan bir xil maydonlarga ega va validatsiyadan o'tadi
+    """
+    fields = set(model.model_fields)
+    missing, unknown = fields - set(doc), set(doc) - fields - extra_fields
+    if missing or unknown:
+        raise SystemExit(f"{model.__name__} shape mismatch: missing={sorted(missing)} unknown={sorted(unknown)}")
+    model.model_validate(doc)
+
+
+class BatchWriter:
+    """
+    insert_many partiyalari: keyingi partiya generatsiya qilinayotganda oldingisi yoziladi
+    """
+
+    def __init__(self, collection, batch_size: int, dry_run: bool):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.buffer = []
+        self.pending = None
+        self.count = 0
+
+    async def add(self, doc: dict):
+        self.buffer.append(doc)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        if self.pending is not None:
+            await self.pending
+            self.pending = None
+        if self.buffer:
+            self.count += len(self.buffer)
+            if not self.dry_run:
+                self.pending = asyncio.create_task(self.collection.insert_many(self.buffer, ordered=False))
+            self.buffer = []
+
+    async def close(self):
+        await self.flush()
+        if self.pending is not None:
+            await self.pending
+            self.pending = None
+
+
+class DatasetGenerator:
+    def __init__(self, rooms: int, guests: int, years: int, seed: int, today: date, batch_size: int, dry_run: bool):
+        self.room_count = rooms
+        self.guest_count = guests
+        self.seed = seed
+        self.today = today
+        self.start = today - timedelta(days=round(years * 365.25))
+        self.end = today + timedelta(days=FUTURE_DAYS)
+        self.history_days = (today - self.start).days
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.guest_ids = []
+        self.status_counts = {}
+
+    def rng(self, stream: str) -> random.Random:
+        # Har bir kolleksiya o'z oqimida - --rooms o'zgarsa ham mehmonlar bir xil qoladi
+        return random.Random(f"{self.seed}:{stream}")
+
+    def writer(self, collection_name: str) -> BatchWriter:
+        return BatchWriter(db[collection_name], self.batch_size, self.dry_run)
+
+    def occupancy(self, day: date) -> float:
+        # Yozda cho'qqi, qishda past; kelajakdagi kunlar hali to'liq bron qilinmagan
+        seasonal = BASE_OCCUPANCY + 0.15 * math.sin((day.timetuple().tm_yday - 100) / 365.25 * 2 * math.pi)
+        ahead = (day - self.today).days
+        if ahead > 0:
+            seasonal *= max(0.0, 1 - ahead / FUTURE_DAYS)
+        return min(max(seasonal, 0.02), 0.97)
+
+    async def generate_guests(self):
+        rng = self.rng("guests")
+        writer = self.writer("guests")
+        for i in range(self.guest_count):
+            first_name = rng.choice(FIRST_NAMES)
+            last_name = rng.choice(LAST_NAMES)
+            if first_name in FEMALE_NAMES:
+                last_name += "a"
+            id_type = "passport" if rng.random() < 0.85 else "id_card"
+            document_number = f"{rng.choice('ABCFKN')}{rng.choice('ABDEKNT')}{i * 7919 % 10_000_000:07d}"
+            # Mehmonlar bazaga vaqt bo'yicha tekis qo'shilgan
+            created_day = self.start + timedelta(days=i * self.history_days // self.guest_count)
+            doc = {
+                "id": make_uuid(rng),
+                "full_name": f"{first_name} {last_name}",
+                "phone": f"+998{rng.choice(['90', '91', '93', '94', '97', '99'])}{i * 104729 % 10_000_000:07d}",
+                "passport_id": document_number if id_type == "passport" else None,
+                "id_type": id_type,
+                "id_number": document_number if id_type == "id_card" else None,
+                "birth_date": (date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55))).isoformat(),
+                "nation": rng.choices(*NATIONS)[0],
+                "region": rng.choice(REGIONS),
+                "street": f"{rng.choice(STREETS)} ko'chasi, {rng.randint(1, 120)}-uy",
+                "created_at": at_time(created_day, rng),
+            }
+            doc.update(guest_search_fields(doc))
+            if i == 0:
+                check_shape(Guest, doc, frozenset({"search_keys", "search_keys_v"}))
+            self.guest_ids.append(doc["id"])
+            await writer.add(doc)
+        await writer.close()
+        return writer.count
+
+    def pick_guests(self, rng: random.Random, day: date, count: int) -> list:
+        # Faqat shu kungacha qo'shilgan mehmonlar; kichik indekslar (doimiy mijozlar) tez-tez qaytadi
+        progress = ((day - self.start).days + 1) / self.history_days
+        limit = max(1, min(self.guest_count, int(self.guest_count * progress)))
+        picked = {self.guest_ids[int(limit * rng.random() ** 1.5)] for _ in range(count)}
+        return list(picked)
+
+    def booking_doc(self, rng: random.Random, room: dict, check_in: date, nights: int, status: str) -> dict:
+        check_out = check_in + timedelta(days=nights)
+        checked_in_at = checked_out_at = None
+        if status in ("Checked In", "Checked Out"):
+            checked_in_at = check_in.isoformat()
+        if status == "Checked Out":
+            early = nights > 1 and rng.random() < EARLY_CHECKOUT_RATE
+            checked_out_at = (check_out - timedelta(days=rng.randint(1, nights - 1)) if early else check_out).isoformat()
+        guest_count = min(room["capacity"], rng.choices([1, 2, 3, 4, 5], [50, 35, 9, 4, 2])[0])
+        created_day = min(check_in - timedelta(days=int(rng.expovariate(1 / 10))), self.today)
+        return {
+            "id": make_uuid(rng),
+            "guest_ids": self.pick_guests(rng, check_in, guest_count),
+            "room_id": room["id"],
+            "check_in_date": check_in.isoformat(),
+            "check_out_date": check_out.isoformat(),
+            "total_price": room["price_per_night"] * nights,
+            "status": status,
+            "checked_in_at": checked_in_at,
+            "checked_out_at": checked_out_at,
+            # create_booking kabi: ismlar va xona raqami o'qishda enrich_bookings orqali qo'shiladi
+            "guest_names": [],
+            "room_number": None,
+            "nights": None,
+            "created_at": at_time(max(created_day, self.start), rng),
+        }
+
+    def booking_status(self, check_in: date, check_out: date) -> str:
+        if check_out <= self.today:
+            return "Checked Out"
+        if check_in <= self.today:
+            return "Checked In"
+        return "Confirmed"
+
+    def room_status(self, room_bookings: list) -> str:
+        today = self.today.isoformat()
+        for booking in room_bookings:
+            if booking["status"] == "Checked In":
+                return "Occupied"
+        for booking in room_bookings:
+            if booking["status"] == "Checked Out" and booking["checked_out_at"] == today:
+                return "Cleaning"
+            if booking["status"] == "Confirmed" and booking["check_in_date"] == today:
+                return "Reserved"
+        return "Available"
+
+    async def generate_rooms_and_bookings(self):
+        rng = self.rng("rooms")
+        room_writer, booking_writer = self.writer("rooms"), self.writer("bookings")
+        type_names = list(ROOM_TYPES)
+        type_weights = [ROOM_TYPES[name][0] for name in type_names]
+        for i in range(self.room_count):
+            # Har bir turdan kamida bitta xona bo'lsin
+            room_type = type_names[i] if i < len(type_names) else rng.choices(type_names, type_weights)[0]
+            _, capacity, price, description = ROOM_TYPES[room_type]
+            room = {
+                "id": make_uuid(rng),
+                "room_number": f"{i // ROOMS_PER_FLOOR + 1}{i % ROOMS_PER_FLOOR + 1:02d}",
+                "room_type": room_type,
+                "capacity": capacity,
+                "price_per_night": float(price + rng.choice([0, 0, 0, 25_000, 50_000])),
+                "status": "Available",
+                "description": description,
+                "created_at": at_time(self.start - timedelta(days=rng.randint(1, 30)), rng),
+            }
+
+            # Xona vaqt chizig'i: bandlik bo'yicha oraliq, keyin bron (bronlar kesishmaydi)
+            booking_rng = self.rng(f"bookings:{i}")
+            room_bookings = []
+            day = self.start
+            while True:
+                occupancy = self.occupancy(day)
+                nights = booking_rng.choices(*STAY_NIGHTS)[0]
+                day += timedelta(days=int(booking_rng.expovariate(occupancy / (nights * (1 - occupancy)))))
+                if day >= self.end:
+                    break
+                status = self.booking_status(day, day + timedelta(days=nights))
+                room_bookings.append(self.booking_doc(booking_rng, room, day, nights, status))
+                if booking_rng.random() < CANCEL_RATE:
+                    # Bekor qilingan bron - vaqt chizig'ini band qilmaydi
+                    cancelled = day + timedelta(days=booking_rng.randint(-20, 20))
+                    room_bookings.append(self.booking_doc(booking_rng, room, cancelled, nights, "Cancelled"))
+                day += timedelta(days=nights)
+
+            room["status"] = self.room_status(room_bookings)
+            room["stays"] = [
+                room_stay(booking["id"], booking["check_in_date"], booking["check_out_date"])
+                for booking in room_bookings
+                if booking["status"] in ("Confirmed", "Checked In")
+            ]
+            if i == 0:
+                check_shape(Room, room, frozenset({"stays"}))
+                check_shape(Booking, room_bookings[0])
+            for booking in room_bookings:
+                self.status_counts[booking["status"]] = self.status_counts.get(booking["status"], 0) + 1
+                await booking_writer.add(booking)
+            await room_writer.add(room)
+        await room_writer.close()
+        await booking_writer.close()
+        return room_writer.count, booking_writer.count
+
+    async def generate_expenses(self):
+        rng = self.rng("expenses")
+        writer = self.writer("expenses")
+        # Summalar xonalar soniga proporsional (ming so'mda)
+        scale = max(self.room_count / 50, 0.2)
+        first = True
+        day = self.start
+        while day <= self.today:
+            for category, items in EXPENSE_PLAN.items():
+                for title, when, low, high in items:
+                    due = day.day == when if isinstance(when, int) else rng.random() < when
+                    if not due:
+                        continue
+                    doc = {
+                        "id": make_uuid(rng),
+                        "title": title,
+                        "category": category,
+                        "amount": float(round(rng.uniform(low, high) * scale) * 1000),
+                        "description": "",
+                        "date": day.isoformat(),
+                        "created_by": EXPENSE_CREATED_BY,
+                        "created_at": at_time(day, rng),
+                    }
+                    if first:
+                        check_shape(Expense, doc)
+                        first = False
+                    await writer.add(doc)
+            day += timedelta(days=1)
+        await writer.close()
+        return writer.count
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic dataset for scale testing")
+    parser.add_argument("--preset", choices=list(PRESETS), default="small")
+    parser.add_argument("--rooms", type=int, help="override preset room count")
+    parser.add_argument("--guests", type=int, help="override preset guest count")
+    parser.add_argument("--years", type=int, help="override preset years of history")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--today", type=date.fromisoformat, default=None, help="anchor date (default: today, UTC)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--drop", action="store_true", help=f"drop {', '.join(GENERATED_COLLECTIONS)} first")
+    parser.add_argument("--dry-run", action="store_true", help="generate and validate without writing")
+    args = parser.parse_args()
+
+    rooms, guests, years = PRESETS[args.preset]
+    generator = DatasetGenerator(
+        rooms=args.rooms or rooms,
+        guests=args.guests or guests,
+        years=args.years or years,
+        seed=args.seed,
+        today=args.today or datetime.now(timezone.utc).date(),
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+
+    if not args.dry_run:
+        if args.drop:
+            for name in GENERATED_COLLECTIONS:
+                await db[name].drop()
+        else:
+            non_empty = [name for name in GENERATED_COLLECTIONS if await db[name].find_one({}, {"_id": 1})]
+            if non_empty:
+                print(f"Collections not empty: {', '.join(non_empty)}. Use --drop to replace them.")
+                client.close()
+                return 1
+
+    started = time.perf_counter()
+    step = time.perf_counter()
+    guest_count = await generator.generate_guests()
+    print(f"guests:   {guest_count:>10,} in {time.perf_counter() - step:.1f}s")
+    step = time.perf_counter()
+    room_count, booking_count = await generator.generate_rooms_and_bookings()
+    print(f"rooms:    {room_count:>10,}")
+    print(f"bookings: {booking_count:>10,} in {time.perf_counter() - step:.1f}s  {generator.status_counts}")
+    step = time.perf_counter()
+    expense_count = await generator.generate_expenses()
+    print(f"expenses: {expense_count:>10,} in {time.perf_counter() - step:.1f}s")
+
+    if not args.dry_run:
+        # Indekslar ma'lumotdan keyin - bo'sh kolleksiyaga yozish tezroq
+        step = time.perf_counter()
+        await ensure_indexes()
+        print(f"indexes built in {time.perf_counter() - step:.1f}s")
+        step = time.perf_counter()
+        rollup_count = await rebuild_rollups()
+        print(f"rollups:  {rollup_count:>10,} in {time.perf_counter() - step:.1f}s")
+        await bump_stored_versions(*VERSIONED_COLLECTIONS)
+    client.close()
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,80 @@
+"""
+Mehmonlarni fayldan import qilish (oldingi PMS dan ko'chirish uchun).
+
+- Format: csv (sarlavha qatori GuestCreate maydonlari), json (massiv) yoki ndjson
+- Dublikatlar (passport_id / id_number / telefon) bazadagi va fayldagi mehmonlar bilan tekshiriladi
+- Rad etilgan qatorlar hisoboti --report fayliga (JSON) yoziladi
+- Importdan oldin indekslar va mavjud mehmonlarning search_keys lari tayyorlanadi -
+  aks holda eski mehmonlar dublikat sifatida topilmaydi
+
+Ishlatish:
+    cd backend && python import_guests.py guests.csv [--format csv] [--batch-size 1000] [--dry-run] [--report errors.json]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from server import (
+    GUEST_IMPORT_BATCH_SIZE,
+    GUEST_IMPORT_CHUNK_SIZE,
+    GUEST_IMPORT_FORMATS,
+    GuestImporter,
+    backfill_guest_search_keys,
+    bump_stored_versions,
+    client,
+    ensure_indexes,
+    iter_import_rows,
+)
+
+
+async def read_chunks(path: Path):
+    with path.open("rb") as f:
+        while chunk := f.read(GUEST_IMPORT_CHUNK_SIZE):
+            yield chunk
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Bulk import guests from CSV / JSON / NDJSON")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=["csv", "json", "ndjson"])
+    parser.add_argument("--batch-size", type=int, default=GUEST_IMPORT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--report", type=Path, help="write rejected rows as JSON to this file")
+    args = parser.parse_args()
+
+    fmt = args.format or {".jsonl": "ndjson"}.get(args.path.suffix.lower(), args.path.suffix.lower().lstrip("."))
+    if fmt not in GUEST_IMPORT_FORMATS:
+        parser.error(f"cannot infer format from {args.path.name}, pass --format")
+    await ensure_indexes()
+    updated = await backfill_guest_search_keys()
+    if updated:
+        print(f"Search keys built for {updated} existing guests")
+    importer = GuestImporter(batch_size=args.batch_size, dry_run=args.dry_run)
+    start = time.perf_counter()
+    report = await importer.run(iter_import_rows(read_chunks(args.path), fmt))
+    elapsed = time.perf_counter() - start
+    if report["inserted"] and not args.dry_run:
+        # Ishlayotgan server ETag lari eskirishi uchun
+        await bump_stored_versions("guests")
+    client.close()
+
+    print(
+        f"{report['rows']} rows: {report['inserted']} {'valid' if args.dry_run else 'inserted'}, "
+        f"{report['rejected']} rejected in {elapsed:.1f}s ({report['rows'] / max(elapsed, 1e-9):.0f} rows/s)"
+    )
+    if args.report:
+        args.report.write_text(json.dumps(report["errors"], ensure_ascii=False, indent=2))
+        print(f"Rejected rows written to {args.report}")
+    else:
+        for error in report["errors"][:20]:
+            print(f"  row {error['row']}: {error['reason']} - {error['detail']}")
+        if report["rejected"] > 20:
+            print(f"  ... {report['rejected'] - 20} more (use --report)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,112 @@
+"""
+Sana maydonlarini migratsiya qilish (server ishlayotgan paytda ham xavfsiz):
+
+- created_at (users, rooms, guests, bookings, expenses): ISO satr -> BSON date.
+  Server ikkala ko'rinishni ham o'qiy oladi, shuning uchun migratsiya bosqichma-bosqich o'tadi.
+- Kunlik sanalar (bookings.check_in_date/check_out_date/checked_in_at/checked_out_at,
+  expenses.date): kanonik "YYYY-MM-DD" satrga keltiriladi. Bu format sana tartibida
+  saralanadi, shuning uchun barcha filtrlar indeks bo'yicha $gte/$lt oraliq so'rovlari bo'ladi.
+
+Har bir yangilash eski qiymat bilan shartli (filter), ya'ni parallel yozuvlar ustiga yozilmaydi.
+Skriptni qayta ishga tushirish xavfsiz - allaqachon migratsiya qilingan hujjatlar o'tkazib yuboriladi.
+
+Ishlatish:
+    cd backend && python migrate_dates.py [--batch-size 1000] [--dry-run]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from server import bump_stored_versions, client, db, normalize_iso_day
+
+CREATED_AT_COLLECTIONS = ["users", "rooms", "guests", "bookings", "expenses"]
+DAY_FIELDS = {
+    "bookings": ["check_in_date", "check_out_date", "checked_in_at", "checked_out_at"],
+    "expenses": ["date"],
+}
+CANONICAL_DAY_REGEX = r"^\d{4}-\d{2}-\d{2}$"
+
+
+def parse_timestamp(value: str):
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def migrate_field(collection_name: str, field: str, selector: dict, convert, batch_size: int, dry_run: bool):
+    collection = db[collection_name]
+    converted = skipped = 0
+    last_id = None
+    while True:
+        query = dict(selector)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = await collection.find(query, {"_id": 1, field: 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+
+        ops = []
+        for doc in docs:
+            value = doc.get(field)
+            new_value = convert(value)
+            if new_value is None:
+                skipped += 1
+                continue
+            ops.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: new_value}}))
+        if ops and not dry_run:
+            await collection.bulk_write(ops, ordered=False)
+        converted += len(ops)
+
+    print(f"{collection_name}.{field}: {converted} converted, {skipped} unparseable")
+    return converted
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Migrate date fields to typed/canonical storage")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    changed = set()
+    for collection_name in CREATED_AT_COLLECTIONS:
+        if await migrate_field(
+            collection_name,
+            "created_at",
+            {"created_at": {"$type": "string"}},
+            parse_timestamp,
+            args.batch_size,
+            args.dry_run,
+        ):
+            changed.add(collection_name)
+
+    for collection_name, fields in DAY_FIELDS.items():
+        for field in fields:
+            if await migrate_field(
+                collection_name,
+                field,
+                {"$or": [
+                    {field: {"$type": "date"}},
+                    {field: {"$type": "string", "$not": {"$regex": CANONICAL_DAY_REGEX}}},
+                ]},
+                normalize_iso_day,
+                args.batch_size,
+                args.dry_run,
+            ):
+                changed.add(collection_name)
+
+    if changed and not args.dry_run:
+        await bump_stored_versions(*sorted(changed))
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,27 @@
+"""
+Rollup (kunlik/oylik yig'ma) hujjatlarini bookings va expenses tarixidan qayta qurish.
+Yozuvlar to'xtatilgan paytda ishga tushirish tavsiya etiladi.
+
+Ishlatish:
+    cd backend && python rebuild_rollups.py
+"""
+import asyncio
+import sys
+import time
+
+from server import bump_stored_versions, client, ensure_indexes, rebuild_rollups
+
+
+async def main() -> int:
+    await ensure_indexes()
+    start = time.perf_counter()
+    count = await rebuild_rollups()
+    # Rollup dan o'qiladigan hisobotlar bookings/expenses ETag lari bilan keshlanadi
+    await bump_stored_versions("bookings", "expenses")
+    client.close()
+    print(f"Rebuilt {count} rollup documents in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,36 +1,593 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, Query, Request, UploadFile, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 from dotenv import load_dotenv
+from starlette.datastructures import MutableHeaders
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+import asyncio
+import base64
+import codecs
+import csv
+import hmac
+import io
+import json
+import math
 import os
+import re
+import time
+import unicodedata
 import logging
+import threading
+from bisect import bisect_left
+from collections import Counter, deque
+from contextvars import ContextVar
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from passlib.context import CryptContext
+import bcrypt
 import jwt
-from bson import ObjectId
+from bson import ObjectId, encode as bson_encode
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ============== Metrikalar: route bo'yicha kechikish, status va Mongo so'rovlari ==============
+#
+# Har bir so'rov MetricsRoute orqali o'lchanadi (route shabloni bo'yicha, masalan
+# /api/bookings/{booking_id}). Mongo buyruqlari CommandListener da hisoblanadi va
+# contextvar orqali joriy so'rovga yoziladi - Motor executor ga kontekstni nusxalab beradi.
+# Natija Prometheus matn formatida: GET /api/metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_MONGO_OPS_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 500)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # oxirgisi - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class RequestStats:
+    __slots__ = ("route", "mongo_ops")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.mongo_ops = 0
+
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.latency = {}
+        self.mongo_ops = {}
+        self.responses = Counter()
+        self.in_flight = Counter()
+        # mongo_commands va RequestStats.mongo_ops Motor executor thread laridan yoziladi
+        self.lock = threading.Lock()
+        self.mongo_commands = Counter()
+
+    def observe(self, key: tuple, status_code: int, seconds: float, mongo_ops: int):
+        latency = self.latency.get(key)
+        if latency is None:
+            latency = self.latency[key] = Histogram(METRICS_LATENCY_BUCKETS)
+            self.mongo_ops[key] = Histogram(METRICS_MONGO_OPS_BUCKETS)
+        latency.observe(seconds)
+        self.mongo_ops[key].observe(mongo_ops)
+        self.responses[key + (status_code,)] += 1
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_total HTTP responses by route template and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status_code), count in sorted(self.responses.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status_code}"}} {count}')
+        lines += [
+            "# HELP http_requests_in_flight Requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+        ]
+        for (method, route), count in sorted(self.in_flight.items()):
+            lines.append(f'http_requests_in_flight{{method="{method}",route="{route}"}} {count}')
+        lines += [
+            "# HELP http_request_duration_seconds Request latency by route template.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            lines += histogram.render("http_request_duration_seconds", f'method="{method}",route="{route}"')
+        lines += [
+            "# HELP http_request_mongo_operations Mongo commands issued per request.",
+            "# TYPE http_request_mongo_operations histogram",
+        ]
+        for (method, route), histogram in sorted(self.mongo_ops.items()):
+            lines += histogram.render("http_request_mongo_operations", f'method="{method}",route="{route}"')
+        lines += [
+            "# HELP mongo_commands_total Mongo commands by command name.",
+            "# TYPE mongo_commands_total counter",
+        ]
+        with self.lock:
+            mongo_commands = sorted(self.mongo_commands.items())
+        for command, count in mongo_commands:
+            lines.append(f'mongo_commands_total{{command="{command}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MongoOpsListener(monitoring.CommandListener):
+    """
+    Har bir Mongo buyrug'ini joriy so'rov hisoblagichiga yozish (executor thread ida chaqiriladi)
+    """
+
+    def started(self, event):
+        stats = current_request_stats.get()
+        with metrics.lock:
+            metrics.mongo_commands[event.command_name] += 1
+            if stats is not None:
+                stats.mongo_ops += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class MetricsRoute(APIRoute):
+    """
+    Route handler ni o'lchash: kechikish, status, bir vaqtdagi so'rovlar va Mongo buyruqlari soni
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path_format
+
+        async def metered_handler(request: Request) -> Response:
+            key = (request.method, route)
+            stats = RequestStats(f"{request.method} {route}")
+            token = current_request_stats.set(stats)
+            metrics.in_flight[key] += 1
+            start = time.perf_counter()
+            status_code = 500
+            try:
+                response = await handler(request)
+                status_code = response.status_code
+                if not isinstance(response, StreamingResponse):
+                    response.headers["X-Mongo-Ops"] = str(stats.mongo_ops)
+                return response
+            except HTTPException as exc:
+                status_code = exc.status_code
+                raise
+            except RequestValidationError:
+                status_code = 422
+                raise
+            except NotModified:
+                status_code = 304
+                raise
+            finally:
+                metrics.in_flight[key] -= 1
+                metrics.observe(key, status_code, time.perf_counter() - start, stats.mongo_ops)
+                current_request_stats.reset(token)
+
+        return metered_handler
+
+
+# ============== Mongo profiler: so'rov shakllari bo'yicha yig'ma va sekin so'rovlar logi ==============
+#
+# Har bir buyruq shaklga keltiriladi: kolleksiya, filter kalitlari (qiymatlar "?" bo'ladi),
+# sort va projection. getMore o'z kursorini ochgan find/aggregate shakliga yoziladi, shuning
+# uchun to_list(N) ning barcha partiyalari bitta qatorda jamlanadi.
+# Yig'ma: GET /api/admin/mongo-profile (faqat admin). Standart holatda o'chiq (MONGO_PROFILER=true). MONGO_SLOW_MS dan sekin buyruqlar
+# "mongo.slow" loggeriga JSON qator bo'lib yoziladi.
+MONGO_PROFILER = os.environ.get('MONGO_PROFILER', 'false').strip().lower() in {'1', 'true', 'yes'}
+MONGO_SLOW_MS = float(os.environ.get('MONGO_SLOW_MS', '100'))
+MONGO_PROFILE_MAX_SHAPES = int(os.environ.get('MONGO_PROFILE_MAX_SHAPES', '500'))
+MONGO_PROFILE_MAX_CURSORS = 10000
+MONGO_PROFILE_SORT_FIELDS = ("total_ms", "avg_ms", "max_ms", "count", "errors", "docs", "bytes")
+MONGO_PROFILE_IGNORED = {"hello", "isMaster", "ismaster", "ping", "buildInfo", "endSessions", "saslStart", "saslContinue"}
+
+slow_query_logger = logging.getLogger("mongo.slow")
+
+
+def query_shape(value) -> str:
+    """
+    Filter shakli: kalitlar va operatorlar qoladi, qiymatlar "?" bo'ladi
+    """
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{key}:{query_shape(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        # $or / $and / $nor shartlari
+        return "[" + ",".join(query_shape(item) for item in value) + "]"
+    return "?"
+
+
+def spec_shape(value) -> str:
+    """
+    sort / projection: kalitlar ham, qiymatlar ham shaklning bir qismi
+    """
+    if not isinstance(value, dict):
+        return "?"
+    return "{" + ",".join(f"{key}:{item if isinstance(item, (int, float, str)) else '?'}" for key, item in value.items()) + "}"
+
+
+def update_shape(update) -> str:
+    if isinstance(update, dict):
+        return ",".join(update.keys())
+    return "pipeline"
+
+
+def pipeline_shape(pipeline) -> str:
+    stages = []
+    for stage in pipeline or []:
+        name, body = next(iter(stage.items()))
+        if name == "$match":
+            stages.append(f"$match{query_shape(body)}")
+        elif name == "$sort":
+            stages.append(f"$sort{spec_shape(body)}")
+        elif name == "$unionWith":
+            stages.append(f"$unionWith({body.get('coll') if isinstance(body, dict) else body})")
+        elif name == "$lookup":
+            stages.append(f"$lookup({body.get('from')})")
+        else:
+            stages.append(name)
+    return "[" + ",".join(stages) + "]"
+
+
+def command_shape(name: str, command) -> Optional[tuple]:
+    """
+    (kolleksiya, shakl) - bir xil shakldagi buyruqlar bitta qatorga yig'iladi
+    """
+    collection = command.get(name)
+    if not isinstance(collection, str):
+        collection = str(collection)
+    parts = [name, collection]
+    if name == "find":
+        parts.append(f"filter={query_shape(command.get('filter', {}))}")
+        if command.get("sort"):
+            parts.append(f"sort={spec_shape(command['sort'])}")
+        if command.get("projection"):
+            parts.append(f"projection={spec_shape(command['projection'])}")
+    elif name == "aggregate":
+        parts.append(pipeline_shape(command.get("pipeline")))
+    elif name == "findAndModify":
+        parts.append(f"filter={query_shape(command.get('query', {}))}")
+        if command.get("sort"):
+            parts.append(f"sort={spec_shape(command['sort'])}")
+        parts.append("remove" if command.get("remove") else f"update={update_shape(command.get('update'))}")
+    elif name == "update":
+        shapes = {f"{query_shape(item.get('q', {}))} {update_shape(item.get('u'))}" for item in command.get("updates", [])}
+        parts.append(" | ".join(sorted(shapes)))
+    elif name == "delete":
+        parts.append(" | ".join(sorted({query_shape(item.get("q", {})) for item in command.get("deletes", [])})))
+    elif name in ("count", "distinct"):
+        if name == "distinct":
+            parts.append(f"key={command.get('key')}")
+        parts.append(f"filter={query_shape(command.get('query', {}))}")
+    return collection, " ".join(parts)
+
+
+def reply_size(reply, docs: int) -> int:
+    """
+    Javob hajmi (BSON bayt) taxmini: kursor javobida faqat birinchi hujjat kodlanadi va
+    hujjatlar soniga ko'paytiriladi - katta to_list javoblari ikkinchi marta kodlanmaydi
+    """
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch") or cursor.get("nextBatch")
+        return len(bson_encode(batch[0])) * docs if batch else 0
+    if isinstance(reply.get("value"), dict):
+        return len(bson_encode(reply["value"]))
+    return 0
+
+
+def reply_docs(reply) -> int:
+    """
+    Javobda qaytgan (yoki yozilgan) hujjatlar soni
+    """
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+    if "value" in reply:
+        return 0 if reply["value"] is None else 1
+    if "values" in reply:
+        return len(reply["values"])
+    return int(reply.get("n", 0))
+
+
+class ShapeStats:
+    __slots__ = ("collection", "shape", "count", "errors", "total_ms", "max_ms", "docs", "bytes", "routes")
+
+    def __init__(self, collection: str, shape: str):
+        self.collection = collection
+        self.shape = shape
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.docs = 0
+        self.bytes = 0
+        self.routes = Counter()
+
+    def add(self, duration_ms: float, docs: int, size: int, failed: bool, route: Optional[str]):
+        self.count += 1
+        self.errors += failed
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.docs += docs
+        self.bytes += size
+        self.routes[route or "background"] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "collection": self.collection,
+            "shape": self.shape,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3),
+            "max_ms": round(self.max_ms, 3),
+            "docs": self.docs,
+            "avg_docs": round(self.docs / self.count, 1),
+            "bytes": self.bytes,
+            "avg_bytes": round(self.bytes / self.count),
+            "routes": [{"route": route, "count": count} for route, count in self.routes.most_common(3)],
+        }
+
+
+class MongoProfiler(monitoring.CommandListener):
+    """
+    Buyruqlarni shakl bo'yicha yig'ish. Listener executor thread larida chaqiriladi -
+    yig'ma lock ostida yangilanadi.
+    """
+
+    def __init__(self, slow_ms: float, max_shapes: int):
+        self.slow_ms = slow_ms
+        self.max_shapes = max_shapes
+        self.lock = threading.Lock()
+        self.pending = {}   # (connection_id, request_id) -> (shape, route, getMore cursor_id)
+        self.cursors = {}   # ochiq kursor id -> uni ochgan buyruq shakli
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.shapes = {}
+            self.dropped = 0
+            self.since = datetime.now(timezone.utc)
+
+    def started(self, event):
+        name = event.command_name
+        if name in MONGO_PROFILE_IGNORED:
+            return
+        command = event.command
+        cursor_id = None
+        if name == "killCursors":
+            with self.lock:
+                for killed in command.get("cursors", []):
+                    self.cursors.pop(killed, None)
+            return
+        if name == "getMore":
+            cursor_id = command.get("getMore")
+            with self.lock:
+                shape = self.cursors.get(cursor_id)
+            shape = shape or (command.get("collection"), f"getMore {command.get('collection')}")
+        else:
+            shape = command_shape(name, command)
+        stats = current_request_stats.get()
+        with self.lock:
+            self.pending[(event.connection_id, event.request_id)] = (shape, stats.route if stats else None, cursor_id)
+
+    def succeeded(self, event):
+        reply = event.reply
+        cursor = reply.get("cursor")
+        with self.lock:
+            entry = self.pending.pop((event.connection_id, event.request_id), None)
+            if entry is None:
+                return
+            shape, route, cursor_id = entry
+            if isinstance(cursor, dict):
+                if cursor.get("id"):
+                    if len(self.cursors) >= MONGO_PROFILE_MAX_CURSORS:
+                        self.cursors.clear()  # server timeout bilan yopilgan kursorlar to'planib qolmasin
+                    self.cursors[cursor["id"]] = shape
+                elif cursor_id is not None:
+                    self.cursors.pop(cursor_id, None)
+        docs = reply_docs(reply)
+        self.record(shape, route, event.duration_micros / 1000, docs, reply_size(reply, docs), False)
+
+    def failed(self, event):
+        with self.lock:
+            entry = self.pending.pop((event.connection_id, event.request_id), None)
+            if entry is None:
+                return
+            shape, route, cursor_id = entry
+            if cursor_id is not None:
+                self.cursors.pop(cursor_id, None)
+        self.record(shape, route, event.duration_micros / 1000, 0, 0, True)
+
+    def record(self, shape: tuple, route: Optional[str], duration_ms: float, docs: int, size: int, failed: bool):
+        collection, key = shape
+        with self.lock:
+            stats = self.shapes.get(key)
+            if stats is None:
+                if len(self.shapes) < self.max_shapes:
+                    stats = self.shapes[key] = ShapeStats(collection, key)
+                else:
+                    self.dropped += 1
+            if stats is not None:
+                stats.add(duration_ms, docs, size, failed, route)
+        if self.slow_ms > 0 and duration_ms >= self.slow_ms:
+            slow_query_logger.warning(json.dumps({
+                "event": "mongo_slow_command",
+                "collection": collection,
+                "shape": key,
+                "duration_ms": round(duration_ms, 3),
+                "docs": docs,
+                "bytes": size,
+                "failed": failed,
+                "route": route,
+            }, ensure_ascii=False))
+
+    def report(self, limit: int, sort_by: str) -> dict:
+        if sort_by not in MONGO_PROFILE_SORT_FIELDS:
+            sort_by = "total_ms"
+        with self.lock:
+            rows = [stats.as_dict() for stats in self.shapes.values()]
+            dropped, since = self.dropped, self.since
+        rows.sort(key=lambda row: row[sort_by], reverse=True)
+        return {
+            "enabled": MONGO_PROFILER,
+            "since": since,
+            "slow_ms": self.slow_ms,
+            "sort_by": sort_by,
+            "shape_count": len(rows),
+            "dropped": dropped,
+            "commands": sum(row["count"] for row in rows),
+            "total_ms": round(sum(row["total_ms"] for row in rows), 3),
+            "top": rows[:limit],
+        }
+
+
+mongo_profiler = MongoProfiler(MONGO_SLOW_MS, MONGO_PROFILE_MAX_SHAPES)
+
+
+# ============== O'qish/yozish marshrutlash: primary va analytics pool lari ==============
+#
+# Ikkita client, har biri o'z pool i bilan:
+# - client/db: barcha yozuvlar, bron va sana kesishish tekshiruvlari, qabulxona o'qishlari - primary
+# - analytics_client: hisobotlar, arxiv va eksport (AnalyticsRoute) - ANALYTICS_READ_PREFERENCE,
+#   secondary bo'lsa ANALYTICS_MAX_STALENESS_SECONDS dan eski bo'lmagan a'zo tanlanadi (kamida 90)
+# Yordamchi funksiyalar read_db() orqali o'qiydi - route sinfi qaysi client ekanini belgilaydi.
+# Replica set bo'lmasa (bitta mongod) ikkala pool ham shu serverga boradi.
+# Mahalliy sinov: mongod --replSet rs0 (+ ikkinchi a'zo), rs.initiate(),
+#   MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+ANALYTICS_MONGO_URL = os.environ.get('ANALYTICS_MONGO_URL', '') or mongo_url
+ANALYTICS_READ_PREFERENCE = os.environ.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred').strip()
+ANALYTICS_MAX_STALENESS_SECONDS = int(os.environ.get('ANALYTICS_MAX_STALENESS_SECONDS', '120'))
+ANALYTICS_MAX_POOL_SIZE = int(os.environ.get('ANALYTICS_MAX_POOL_SIZE', '20'))
+
+analytics_options = {"readPreference": ANALYTICS_READ_PREFERENCE, "maxPoolSize": ANALYTICS_MAX_POOL_SIZE}
+if ANALYTICS_READ_PREFERENCE != "primary" and ANALYTICS_MAX_STALENESS_SECONDS > 0:
+    analytics_options["maxStalenessSeconds"] = ANALYTICS_MAX_STALENESS_SECONDS
+# Yozuvdan keyin analytics javobi qancha vaqt eski bo'lishi mumkin (ETag shu oynada berilmaydi).
+# maxStaleness cheklanmagan bo'lsa ham secondary odatda shu oraliqda yetib oladi.
+ANALYTICS_STALENESS_BOUND = (
+    0 if ANALYTICS_READ_PREFERENCE == "primary"
+    else (ANALYTICS_MAX_STALENESS_SECONDS if ANALYTICS_MAX_STALENESS_SECONDS > 0 else 120)
+)
+
+# tz_aware: created_at BSON date sifatida saqlanadi va UTC datetime bo'lib qaytadi
+mongo_listeners = [MongoOpsListener()] + ([mongo_profiler] if MONGO_PROFILER else [])
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, maxPoolSize=MONGO_MAX_POOL_SIZE, event_listeners=mongo_listeners)
 db = client[os.environ['DB_NAME']]
+analytics_client = AsyncIOMotorClient(
+    ANALYTICS_MONGO_URL, tz_aware=True, event_listeners=mongo_listeners, **analytics_options
+)
+analytics_db = analytics_client[os.environ['DB_NAME']]
+
+current_read_db: ContextVar = ContextVar("current_read_db", default=db)
+
+
+def read_db():
+    """
+    Joriy route sinfining o'qish bazasi (route tashqarisida - primary)
+    """
+    return current_read_db.get()
+
+
+class AnalyticsRoute(MetricsRoute):
+    """
+    Hisobot/arxiv route lari: read_db() analytics pool ga (odatda secondary) yo'naltiriladi
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def analytics_handler(request: Request) -> Response:
+            token = current_read_db.set(analytics_db)
+            try:
+                return await handler(request)
+            finally:
+                current_read_db.reset(token)
+
+        return analytics_handler
+
+try:
+    import orjson
+except ImportError:  # orjson ixtiyoriy - bo'lmasa standart json ishlatiladi
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    orjson bilan JSON javob (datetime ni o'zi seriyalaydi, o'rnatilmagan bo'lsa - standart json)
+    """
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        return super().render(jsonable_encoder(content))
+
+
+app = FastAPI(default_response_class=FastJSONResponse)
+api_router = APIRouter(prefix="/api", route_class=MetricsRoute)
+analytics_router = APIRouter(prefix="/api", route_class=AnalyticsRoute)
 
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
+# Parol hash - event loop ni to'xtatmaslik uchun alohida thread pool da
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', '4'))
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', '0'))  # 0 - avtomatik sozlash o'chirilgan
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="bcrypt")
+bcrypt_rounds = BCRYPT_ROUNDS
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'dangara-hotel-secret-key-2025')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
 
+# Stateless rejim: token ichidagi role/permissions ishlatiladi, users kolleksiyasi faqat
+# login va token versiyasi o'zgarganda o'qiladi
+AUTH_STATELESS = os.environ.get('AUTH_STATELESS', 'false').strip().lower() in {'1', 'true', 'yes'}
+TOKEN_VERSION_REFRESH_SECONDS = float(os.environ.get('TOKEN_VERSION_REFRESH_SECONDS', '30'))
+
 PAGE_KEYS = ["dashboard", "rooms", "guests", "bookings", "calendar", "reports", "users"]
 
 
@@ -174,6 +731,12 @@ class BookingUpdate(BaseModel):
     check_in_date: Optional[str] = None
     check_out_date: Optional[str] = None
 
+# Guruh bronlari: bitta so'rovdagi maksimal elementlar
+BULK_BOOKING_MAX_ITEMS = 200
+
+class BulkBookingCreate(BaseModel):
+    bookings: List[BookingCreate] = Field(..., min_length=1, max_length=BULK_BOOKING_MAX_ITEMS)
+
 class DashboardStats(BaseModel):
     total_rooms: int
     available_rooms: int
@@ -196,6 +759,17 @@ class MonthlyReport(BaseModel):
     total_income: float
     most_used_room_type: str
 
+class ReportQuery(BaseModel):
+    measures: List[str]                      # REPORT_MEASURES kalitlari
+    dimensions: List[str] = []               # REPORT_DIMENSIONS kalitlari
+    date_from: Optional[str] = None          # "YYYY-MM-DD", oraliqqa kiradi
+    date_to: Optional[str] = None            # "YYYY-MM-DD", oraliqqa kiradi
+    filters: Dict[str, List[str]] = {}       # kesim -> ruxsat etilgan qiymatlar
+    sort_by: Optional[str] = None            # kesim yoki o'lchov nomi
+    sort_dir: str = "asc"
+    limit: Optional[int] = Field(default=None, ge=1, le=10000)
+    use_rollups: bool = True
+
 # ============== YANGI: Chiqimlar (Expenses) Models ==============
 
 class Expense(BaseModel):
@@ -252,15 +826,50 @@ def normalize_booking_status(status_value: Optional[str]) -> Optional[str]:
     return STATUS_ALIASES.get(normalized.lower(), normalized)
 
 
+ISO_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
 def parse_iso_day(day_str: Optional[str]) -> Optional[datetime]:
-    if not day_str:
+    # Sanalar "YYYY-MM-DD" satr sifatida saqlanadi - bu format leksikografik tartibda ham
+    # sana tartibiga mos, shuning uchun $gte/$lt oraliqlari indeks bilan ishlaydi
+    if not isinstance(day_str, str) or not ISO_DAY_RE.match(day_str):
         return None
     try:
-        return datetime.strptime(day_str, "%Y-%m-%d")
+        return datetime.fromisoformat(day_str)
     except ValueError:
         return None
 
 
+def normalize_iso_day(value) -> Optional[str]:
+    """
+    Sana qiymatini "YYYY-MM-DD" ko'rinishiga keltirish (datetime, ISO timestamp yoki satr)
+    """
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if not isinstance(value, str):
+        return None
+    day = value.strip()[:10]
+    return day if parse_iso_day(day) else None
+
+
+def month_range(month: str) -> dict:
+    """
+    "YYYY-MM" oyi uchun $gte/$lt oraliq (regex prefiks o'rniga)
+    """
+    start = datetime.strptime(month, "%Y-%m")
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return {"$gte": start.strftime("%Y-%m-%d"), "$lt": next_month.strftime("%Y-%m-%d")}
+
+
+def month_days(month: str) -> tuple:
+    """
+    "YYYY-MM" oyining birinchi va oxirgi kuni (ikkalasi ham oraliqqa kiradi)
+    """
+    start = datetime.strptime(month, "%Y-%m")
+    last = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d")
+
+
 def calculate_nights(check_in_date: Optional[str], check_out_date: Optional[str]) -> Optional[int]:
     check_in = parse_iso_day(check_in_date)
     check_out = parse_iso_day(check_out_date)
@@ -268,180 +877,2024 @@ def calculate_nights(check_in_date: Optional[str], check_out_date: Optional[str]
         return None
     return max((check_out - check_in).days, 0)
 
-# Auth functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+DASHBOARD_SNAPSHOT = os.environ.get('DASHBOARD_SNAPSHOT', 'false').strip().lower() in {'1', 'true', 'yes'}
+DASHBOARD_SNAPSHOT_TTL_SECONDS = float(os.environ.get('DASHBOARD_SNAPSHOT_TTL_SECONDS', '60'))
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
 
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+class DashboardSnapshot:
+    """
+    Dashboard statistikasi xotirada - mutatsiyalarda qo'shimcha (delta) yangilanadi.
+    TTL tugaganda yoki kun almashganda Mongo dan qayta hisoblanadi.
+    """
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"username": username}, {"_id": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        user["permissions"] = normalize_permissions(user.get("permissions"), user.get("role"))
-        if isinstance(user.get('created_at'), str):
-            user['created_at'] = datetime.fromisoformat(user['created_at'])
-        return User(**user)
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    def __init__(self, enabled: bool, ttl_seconds: float):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.stats = None
+        self.day = None
+        self.loaded_at = None
 
-async def get_admin_user(current_user: User = Depends(get_current_user)):
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    return current_user
+    def get(self, day: str) -> Optional[dict]:
+        if not self.enabled or self.stats is None or self.day != day:
+            return None
+        if time.monotonic() - self.loaded_at > self.ttl_seconds:
+            return None
+        return self.stats
 
-# Initialize demo data - YANGILANGAN
-async def initialize_demo_data():
-    users_count = await db.users.count_documents({})
-    if users_count == 0:
-        admin_user = {
-            "id": str(uuid.uuid4()),
-            "username": "admin",
-            "password": get_password_hash("admin123"),
-            "role": "admin",
-            "permissions": get_default_permissions_for_role("admin"),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        reception_user = {
-            "id": str(uuid.uuid4()),
-            "username": "reception",
-            "password": get_password_hash("reception123"),
-            "role": "receptionist",
-            "permissions": get_default_permissions_for_role("receptionist"),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.users.insert_many([admin_user, reception_user])
-        
-    rooms_count = await db.rooms.count_documents({})
-    if rooms_count == 0:
-        rooms = [
-            {"id": str(uuid.uuid4()), "room_number": "101", "room_type": "1 kishilik", "capacity": 1, "price_per_night": 150000, "status": "Available", "description": "Bir kishilik xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "102", "room_type": "1 kishilik", "capacity": 1, "price_per_night": 150000, "status": "Available", "description": "Bir kishilik xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "201", "room_type": "2 kishilik", "capacity": 2, "price_per_night": 250000, "status": "Available", "description": "Ikki kishilik xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "202", "room_type": "2 kishilik", "capacity": 2, "price_per_night": 250000, "status": "Available", "description": "Ikki kishilik xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "301", "room_type": "3 kishilik", "capacity": 3, "price_per_night": 350000, "status": "Available", "description": "Uch kishilik xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "302", "room_type": "4 kishilik", "capacity": 4, "price_per_night": 450000, "status": "Available", "description": "To'rt kishilik xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "401", "room_type": "5 kishilik", "capacity": 5, "price_per_night": 550000, "status": "Available", "description": "Besh kishilik xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "501", "room_type": "VIP", "capacity": 2, "price_per_night": 750000, "status": "Available", "description": "VIP xona", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "room_number": "502", "room_type": "Lux", "capacity": 3, "price_per_night": 1000000, "status": "Available", "description": "Lux xona", "created_at": datetime.now(timezone.utc).isoformat()},
-        ]
-        await db.rooms.insert_many(rooms)
-        
-    guests_count = await db.guests.count_documents({})
-    if guests_count == 0:
-        guests = [
-            {"id": str(uuid.uuid4()), "full_name": "Alisher Karimov", "phone": "+998901234567", "passport_id": "AB1234567", "created_at": datetime.now(timezone.utc).isoformat()},
-            {"id": str(uuid.uuid4()), "full_name": "Malika Rahimova", "phone": "+998907654321", "passport_id": "AB7654321", "created_at": datetime.now(timezone.utc).isoformat()},
-        ]
-        await db.guests.insert_many(guests)
+    def set(self, day: str, stats: dict):
+        if not self.enabled:
+            return
+        self.stats = stats
+        self.day = day
+        self.loaded_at = time.monotonic()
 
-@app.on_event("startup")
-async def startup_event():
-    await initialize_demo_data()
+    def invalidate(self):
+        self.stats = None
 
-# Auth routes
-@api_router.post("/auth/login", response_model=LoginResponse)
-async def login(login_data: LoginRequest):
-    user = await db.users.find_one({"username": login_data.username}, {"_id": 0})
-    if not user or not verify_password(login_data.password, user["password"]):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    user["permissions"] = normalize_permissions(user.get("permissions"), user.get("role"))
-    if isinstance(user.get('created_at'), str):
-        user['created_at'] = datetime.fromisoformat(user['created_at'])
-    
-    access_token = create_access_token(data={"sub": user["username"]})
-    user_data = {k: v for k, v in user.items() if k != "password"}
-    return {"token": access_token, "user": user_data}
+    def room_status_changed(self, old_status: Optional[str], new_status: Optional[str]):
+        if self.stats is None or old_status == new_status:
+            return
+        counts = self.stats["room_status_counts"]
+        if old_status is not None:
+            counts[old_status] = max(counts.get(old_status, 0) - 1, 0)
+        if new_status is not None:
+            counts[new_status] = counts.get(new_status, 0) + 1
 
-@api_router.get("/auth/me", response_model=User)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+    def upcoming_changed(self, delta: int):
+        if self.stats is not None:
+            self.stats["upcoming_reservations"] = max(self.stats["upcoming_reservations"] + delta, 0)
 
-# User routes
-@api_router.post("/users", response_model=User)
-async def create_user(user_data: UserCreate, current_user: User = Depends(get_admin_user)):
-    existing = await db.users.find_one({"username": user_data.username})
-    if existing:
-        raise HTTPException(status_code=400, detail="Username already exists")
-    
-    permissions = normalize_permissions(user_data.permissions, user_data.role)
-    user = User(username=user_data.username, role=user_data.role, permissions=permissions)
-    doc = user.model_dump()
-    doc["password"] = get_password_hash(user_data.password)
-    doc["created_at"] = doc["created_at"].isoformat()
-    await db.users.insert_one(doc)
-    return user
+    def income_added(self, day: str, amount: float):
+        if self.stats is not None and self.day == day:
+            self.stats["today_income"] += amount
 
-@api_router.get("/users", response_model=List[User])
-async def get_users(current_user: User = Depends(get_admin_user)):
-    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    for user in users:
-        user["permissions"] = normalize_permissions(user.get("permissions"), user.get("role"))
-        if isinstance(user.get('created_at'), str):
-            user['created_at'] = datetime.fromisoformat(user['created_at'])
-    return users
 
-# Room routes
-@api_router.get("/rooms", response_model=List[Room])
-async def get_rooms(status: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    query = {}
-    if status:
-        query["status"] = status
-    rooms = await db.rooms.find(query, {"_id": 0}).to_list(1000)
-    for room in rooms:
-        if isinstance(room.get('created_at'), str):
-            room['created_at'] = datetime.fromisoformat(room['created_at'])
-    return rooms
+dashboard_snapshot = DashboardSnapshot(DASHBOARD_SNAPSHOT, DASHBOARD_SNAPSHOT_TTL_SECONDS)
 
-@api_router.post("/rooms", response_model=Room)
-async def create_room(room_data: RoomCreate, current_user: User = Depends(get_admin_user)):
-    existing = await db.rooms.find_one({"room_number": room_data.room_number})
-    if existing:
-        raise HTTPException(status_code=400, detail="Room number already exists")
-    
-    room = Room(**room_data.model_dump())
-    doc = room.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    await db.rooms.insert_one(doc)
-    return room
 
-@api_router.put("/rooms/{room_id}", response_model=Room)
-async def update_room(room_id: str, room_data: RoomUpdate, current_user: User = Depends(get_admin_user)):
-    update_data = {k: v for k, v in room_data.model_dump().items() if v is not None}
-    if not update_data:
-        raise HTTPException(status_code=400, detail="No data to update")
-    
-    result = await db.rooms.update_one({"id": room_id}, {"$set": update_data})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Room not found")
-    
-    room = await db.rooms.find_one({"id": room_id}, {"_id": 0})
-    if isinstance(room.get('created_at'), str):
-        room['created_at'] = datetime.fromisoformat(room['created_at'])
-    return Room(**room)
+# ============== Jonli hodisalar: xonalar, bronlar, chiqimlar (SSE) ==============
+#
+# EVENTS_SOURCE:
+# - local: mutatsiya endpointlari hodisalarni shu jarayondagi brokerga yozadi (bitta worker uchun)
+# - changestream: hodisalar Mongo change stream dan olinadi (replica set kerak, ko'p worker uchun)
+# - auto: replica set bo'lsa changestream, aks holda local
+EVENTS_SOURCE = os.environ.get('EVENTS_SOURCE', 'local').strip().lower()
+EVENT_HISTORY_SIZE = int(os.environ.get('EVENT_HISTORY_SIZE', '1000'))
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', '500'))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', '15'))
 
-@api_router.delete("/rooms/{room_id}")
-async def delete_room(room_id: str, current_user: User = Depends(get_admin_user)):
-    result = await db.rooms.delete_one({"id": room_id})
-    if result.deleted_count == 0:
+# hodisa turi -> mijozga yuboriladigan maydonlar
+EVENT_FIELDS = {
+    "room": ("id", "room_number", "room_type", "status"),
+    "booking": ("id", "room_id", "status", "check_in_date", "check_out_date"),
+    "expense": ("id", "date", "category", "amount"),
+}
+EVENT_COLLECTIONS = {"rooms": "room", "bookings": "booking", "expenses": "expense"}
+EVENT_TYPE_COLLECTIONS = {event_type: collection for collection, event_type in EVENT_COLLECTIONS.items()}
+
+
+class EventSubscription:
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+
+class EventBroker:
+    """
+    Jarayon ichidagi pub/sub. Oxirgi hodisalar Last-Event-ID bo'yicha qayta yuborish uchun saqlanadi.
+    Navbati to'lgan (sekin) mijoz uziladi va "reset" oladi - to'liq qayta yuklashi kerak.
+    """
+
+    def __init__(self, history_size: int, queue_size: int):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.history = deque(maxlen=history_size)
+        self.queue_size = queue_size
+        self.subscribers = set()
+
+    def publish(self, event_type: str, data: dict):
+        self.seq += 1
+        event = {
+            "id": f"{self.epoch}-{self.seq}",
+            "seq": self.seq,
+            "type": event_type,
+            "data": data,
+            "ts": datetime.now(timezone.utc).isoformat(),
+        }
+        self.history.append(event)
+        for subscription in list(self.subscribers):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self.subscribers.discard(subscription)
+
+    def subscribe(self, last_event_id: Optional[str] = None):
+        """
+        (obuna, qayta yuboriladigan hodisalar, reset kerakmi)
+        """
+        subscription = EventSubscription(self.queue_size)
+        self.subscribers.add(subscription)
+        if not last_event_id:
+            return subscription, [], False
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return subscription, [], True
+        seq = int(seq)
+        oldest = self.history[0]["seq"] if self.history else self.seq + 1
+        if seq < oldest - 1:
+            return subscription, [], True
+        return subscription, [event for event in self.history if event["seq"] > seq], False
+
+    def unsubscribe(self, subscription: EventSubscription):
+        self.subscribers.discard(subscription)
+
+
+event_broker = EventBroker(EVENT_HISTORY_SIZE, EVENT_QUEUE_SIZE)
+events_from_change_stream = False
+
+
+# VERSION_STORE (ETag versiyalari):
+# - local: jarayon xotirasida, Mongo ga so'rovsiz (bitta worker uchun)
+# - mongo: collection_versions kolleksiyasida - barcha workerlar bir xil versiyani ko'radi
+# Berilmasa: WEB_CONCURRENCY > 1 (uvicorn/gunicorn --workers standarti) bo'lsa mongo, aks holda local.
+# CLI skriptlar (import, generatsiya, migratsiya, rollup) har doim Mongo dagi versiyani oshiradi;
+# local rejim ularni VERSION_SYNC_SECONDS ichida ko'radi.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+VERSION_STORE = os.environ.get('VERSION_STORE', 'mongo' if WEB_CONCURRENCY > 1 else 'local').strip().lower()
+VERSION_SYNC_SECONDS = float(os.environ.get('VERSION_SYNC_SECONDS', '5'))
+VERSION_EPOCH_ID = "_epoch"
+
+
+async def bump_stored_versions(*collections: str):
+    """
+    Mongo dagi kolleksiya versiyalarini oshirish (boshqa workerlar va CLI yozuvlari uchun)
+    """
+    now = datetime.now(timezone.utc)
+    await db.collection_versions.bulk_write([
+        UpdateOne({"_id": collection}, {"$inc": {"v": 1}, "$set": {"changed_at": now}}, upsert=True)
+        for collection in collections
+    ], ordered=False)
+
+
+class CollectionVersions:
+    """
+    Kolleksiyalar versiyasi (har bir yozuvda +1) - ETag shundan olinadi.
+    local: o'z yozuvlari xotirada, Mongo dagi (CLI) versiyalar har sync_seconds da qo'shiladi.
+    shared: yozuvlar Mongo da $inc, har bir shartli GET versiyalarni bitta _id so'rovi bilan o'qiydi.
+    """
+
+    def __init__(self, shared: bool, sync_seconds: float):
+        self.shared = shared
+        self.sync_seconds = 0 if shared else sync_seconds
+        self.epoch = uuid.uuid4().hex[:8]
+        self.versions = {}
+        self.stored = {}
+        self.changed_at = {}
+        self.synced_at = float("-inf")
+
+    async def configure(self):
+        """
+        shared rejimda epoch ham umumiy - aks holda har worker o'z ETag ini beradi
+        """
+        if not self.shared:
+            return
+        try:
+            doc = await db.collection_versions.find_one_and_update(
+                {"_id": VERSION_EPOCH_ID},
+                {"$setOnInsert": {"epoch": self.epoch}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Boshqa worker bir vaqtda yaratdi
+            doc = await db.collection_versions.find_one({"_id": VERSION_EPOCH_ID})
+        self.epoch = doc["epoch"]
+
+    async def bump(self, *collections: str):
+        now = time.time()
+        for collection in collections:
+            self.changed_at[collection] = now
+            if not self.shared:
+                self.versions[collection] = self.versions.get(collection, 0) + 1
+        if self.shared:
+            await bump_stored_versions(*collections)
+
+    async def sync(self, collections: tuple):
+        if time.monotonic() - self.synced_at < self.sync_seconds:
+            return
+        names = list(collections) if self.shared else VERSIONED_COLLECTIONS
+        docs = await db.collection_versions.find({"_id": {"$in": names}}).to_list(None)
+        self.synced_at = time.monotonic()
+        for doc in docs:
+            self.stored[doc["_id"]] = doc.get("v", 0)
+            if doc.get("changed_at"):
+                changed_at = doc["changed_at"].timestamp()
+                self.changed_at[doc["_id"]] = max(self.changed_at.get(doc["_id"], float("-inf")), changed_at)
+
+    def changed_within(self, collections: tuple, seconds: float) -> bool:
+        cutoff = time.time() - seconds
+        return any(self.changed_at.get(collection, float("-inf")) > cutoff for collection in collections)
+
+    def etag(self, collections: tuple, day: str) -> str:
+        versions = ".".join(
+            str(self.versions.get(collection, 0) + self.stored.get(collection, 0)) for collection in collections
+        )
+        return f'W/"{self.epoch}.{day}.{versions}"'
+
+
+collection_versions = CollectionVersions(VERSION_STORE == "mongo", VERSION_SYNC_SECONDS)
+VERSIONED_COLLECTIONS = ["users", "rooms", "guests", "bookings", "expenses"]
+
+
+class NotModified(Exception):
+    def __init__(self, etag: str):
+        self.etag = etag
+
+
+def conditional_get(*collections: str):
+    """
+    ETag dependency: If-None-Match mos kelsa - 304, endpoint va Mongo ga murojaatsiz.
+    Endpointda auth parametridan keyin qo'yiladi (304 ham faqat ruxsati borlarga).
+    """
+    async def dependency(request: Request) -> Optional[str]:
+        await collection_versions.sync(collections)
+        # Secondary dan o'qilganda: yozuvdan keyin staleness oynasida javob eski bo'lishi mumkin -
+        # unga yangi versiya ETag i berilmaydi (aks holda eski natija 304 bilan keshda qoladi)
+        if (
+            ANALYTICS_STALENESS_BOUND
+            and read_db() is analytics_db
+            and collection_versions.changed_within(collections, ANALYTICS_STALENESS_BOUND)
+        ):
+            return None
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        etag = collection_versions.etag(collections, today)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in candidates or etag.removeprefix("W/") in candidates:
+                raise NotModified(etag)
+        request.state.etag = etag
+        return etag
+    return dependency
+
+
+class ETagMiddleware:
+    """
+    conditional_get qo'ygan ETag ni 200 javoblarga qo'shish (ASGI darajasida - javob tanasiga tegmaydi)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                etag = scope.get("state", {}).get("etag")
+                if etag:
+                    headers = MutableHeaders(scope=message)
+                    headers["ETag"] = etag
+                    headers["Cache-Control"] = "no-cache"
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+async def publish_change(event_type: str, action: str, doc: dict, **extra):
+    """
+    Mutatsiya endpointlaridan hodisa (change stream rejimida - u o'zi yuboradi)
+    """
+    await collection_versions.bump(EVENT_TYPE_COLLECTIONS[event_type])
+    if events_from_change_stream:
+        return
+    data = {"action": action}
+    data.update({field: doc[field] for field in EVENT_FIELDS[event_type] if field in doc})
+    data.update(extra)
+    event_broker.publish(event_type, data)
+
+
+async def watch_change_stream():
+    """
+    Yozuvlarni kolleksiya versiyalariga va (rooms/bookings/expenses) brokerga uzatish (replica set kerak)
+    """
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": VERSIONED_COLLECTIONS},
+        "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+    }}]
+    actions = {"insert": "created", "update": "updated", "replace": "updated", "delete": "deleted"}
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    description = change.get("updateDescription") or {}
+                    changed = set(description.get("updatedFields") or {}) | set(description.get("removedFields") or [])
+                    # Ichki maydonlar (rooms.stays) o'zgarishi javoblarga ta'sir qilmaydi
+                    if change["operationType"] == "update" and changed and all(f.startswith("stays") for f in changed):
+                        continue
+                    # shared rejimda versiyani yozgan worker o'zi oshirgan
+                    if not collection_versions.shared:
+                        await collection_versions.bump(change["ns"]["coll"])
+                    event_type = EVENT_COLLECTIONS.get(change["ns"]["coll"])
+                    if event_type is None:
+                        continue
+                    doc = change.get("fullDocument") or {}
+                    data = {"action": actions[change["operationType"]]}
+                    data.update({field: doc[field] for field in EVENT_FIELDS[event_type] if field in doc})
+                    if not doc:
+                        data["_id"] = str(change["documentKey"]["_id"])
+                    event_broker.publish(event_type, data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logging.getLogger(__name__).warning("Change stream interrupted, reconnecting: %s", exc)
+            await asyncio.sleep(1)
+
+
+async def configure_event_source() -> Optional[asyncio.Task]:
+    global events_from_change_stream
+    if EVENTS_SOURCE not in {"changestream", "auto"}:
+        return None
+    hello = await client.admin.command("hello")
+    if not hello.get("setName"):
+        if EVENTS_SOURCE == "changestream":
+            logging.getLogger(__name__).warning("EVENTS_SOURCE=changestream needs a replica set; using local events")
+        return None
+    events_from_change_stream = True
+    return asyncio.create_task(watch_change_stream())
+
+
+def format_sse(event: dict) -> str:
+    data = json.dumps(event["data"], ensure_ascii=False, separators=(",", ":"), default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+
+async def set_room_status(room_id: str, new_status: str, expected_status: Optional[str] = None) -> Optional[str]:
+    """
+    Xona holatini o'zgartirish. Oldingi holatni qaytaradi (xona topilmasa - None).
+    """
+    query = {"id": room_id}
+    if expected_status:
+        query["status"] = expected_status
+    room = await db.rooms.find_one_and_update(
+        query,
+        {"$set": {"status": new_status}},
+        projection={"_id": 0, "status": 1, "room_type": 1, "room_number": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if room is None:
+        return None
+    dashboard_snapshot.room_status_changed(room.get("status"), new_status)
+    if room.get("status") != new_status:
+        await publish_change("room", "status", {**room, "id": room_id, "status": new_status}, previous_status=room.get("status"))
+    return room
+
+
+# ============== Rollups: kunlik va oylik yig'ma hisobotlar ==============
+#
+# rollups kolleksiyasi: {"granularity": "day"|"month", "period": "2025-01-15"|"2025-01", ...}
+# - income, check_ins, occupied_nights, room_types: checked_in_at kuni bo'yicha
+# - check_outs: checked_out_at kuni bo'yicha
+# - expenses, expense_count, expenses_by_category: chiqim sanasi bo'yicha
+ROLLUP_MEASURES = ["income", "check_ins", "check_outs", "occupied_nights", "expenses", "expense_count"]
+# Meta hujjat: state "building" | "built" - startupda qayta qurishni bitta worker egallaydi
+ROLLUP_META = {"granularity": "meta", "period": "built"}
+ROLLUP_REBUILD_WAIT_SECONDS = float(os.environ.get('ROLLUP_REBUILD_WAIT_SECONDS', '600'))
+
+
+def encode_rollup_key(key: Optional[str]) -> str:
+    # Mongo maydon nomida "." va "$" bo'lishi mumkin emas
+    return str(key or "Boshqa").replace(".", "\uff0e").replace("$", "\uff04")
+
+
+async def apply_rollup_delta(day: Optional[str], inc: dict):
+    """
+    Kunlik va oylik rollup hujjatlariga $inc (bitta bulk_write)
+    """
+    if not parse_iso_day(day) or not inc:
+        return
+    await db.rollups.bulk_write([
+        UpdateOne({"granularity": "day", "period": day}, {"$inc": inc}, upsert=True),
+        UpdateOne({"granularity": "month", "period": day[:7]}, {"$inc": inc}, upsert=True),
+    ], ordered=False)
+
+
+def checkin_rollup_delta(booking: dict, room_type: Optional[str], sign: int = 1) -> dict:
+    delta = {
+        "income": sign * float(booking.get("total_price") or 0),
+        "check_ins": sign,
+        "occupied_nights": sign * (calculate_nights(booking.get("check_in_date"), booking.get("check_out_date")) or 0),
+    }
+    if room_type:
+        delta[f"room_types.{encode_rollup_key(room_type)}"] = sign
+    return delta
+
+
+def expense_rollup_delta(expense: dict, sign: int = 1) -> dict:
+    amount = sign * float(expense.get("amount") or 0)
+    return {
+        "expenses": amount,
+        "expense_count": sign,
+        f"expenses_by_category.{encode_rollup_key(expense.get('category'))}": amount,
+    }
+
+
+def empty_rollup(granularity: str, period: str) -> dict:
+    doc = {"granularity": granularity, "period": period, "room_types": {}, "expenses_by_category": {}}
+    doc.update({measure: 0 for measure in ROLLUP_MEASURES})
+    return doc
+
+
+async def rebuild_rollups() -> int:
+    """
+    Rollup kolleksiyasini bookings va expenses tarixidan qayta qurish.
+    Yozuvlar bilan bir vaqtda ishlatilmasligi kerak (texnik oyna).
+    """
+    check_ins = await db.bookings.aggregate([
+        {"$match": {"checked_in_at": {"$type": "string"}}},
+        {"$lookup": {"from": "rooms", "localField": "room_id", "foreignField": "id", "as": "room"}},
+        {"$group": {
+            "_id": {"day": {"$substrCP": ["$checked_in_at", 0, 10]}, "room_type": {"$arrayElemAt": ["$room.room_type", 0]}},
+            "income": {"$sum": "$total_price"},
+            "check_ins": {"$sum": 1},
+            "occupied_nights": {"$sum": _nights_expr(0)},
+        }},
+    ], allowDiskUse=True).to_list(None)
+    check_outs = await db.bookings.aggregate([
+        {"$match": {"checked_out_at": {"$type": "string"}}},
+        {"$group": {"_id": {"$substrCP": ["$checked_out_at", 0, 10]}, "check_outs": {"$sum": 1}}},
+    ], allowDiskUse=True).to_list(None)
+    expenses = await db.expenses.aggregate([
+        {"$group": {
+            "_id": {"day": {"$substrCP": ["$date", 0, 10]}, "category": "$category"},
+            "expenses": {"$sum": "$amount"},
+            "expense_count": {"$sum": 1},
+        }},
+    ], allowDiskUse=True).to_list(None)
+
+    docs = {}
+
+    def add(day: str, measures: dict, room_type: Optional[str] = None, category: Optional[str] = None):
+        if not parse_iso_day(day):
+            return
+        for granularity, period in (("day", day), ("month", day[:7])):
+            doc = docs.setdefault((granularity, period), empty_rollup(granularity, period))
+            for measure, value in measures.items():
+                doc[measure] += value or 0
+            if room_type:
+                key = encode_rollup_key(room_type)
+                doc["room_types"][key] = doc["room_types"].get(key, 0) + measures["check_ins"]
+            if category is not None:
+                key = encode_rollup_key(category)
+                doc["expenses_by_category"][key] = doc["expenses_by_category"].get(key, 0) + measures["expenses"]
+
+    for row in check_ins:
+        add(row["_id"]["day"], {k: row[k] for k in ("income", "check_ins", "occupied_nights")}, room_type=row["_id"].get("room_type"))
+    for row in check_outs:
+        add(row["_id"], {"check_outs": row["check_outs"]})
+    for row in expenses:
+        add(row["_id"]["day"], {k: row[k] for k in ("expenses", "expense_count")}, category=row["_id"].get("category"))
+
+    await db.rollups.update_one(
+        ROLLUP_META, {"$set": {"state": "building", "started_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    await db.rollups.delete_many({"granularity": {"$ne": "meta"}})
+    if docs:
+        await db.rollups.insert_many(list(docs.values()))
+    await db.rollups.update_one(
+        ROLLUP_META,
+        {"$set": {"state": "built", "built_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    return len(docs)
+
+
+async def ensure_rollups_built():
+    """
+    Startupda: rollups hali qurilmagan bo'lsa - meta hujjatni atomar egallagan bitta worker quradi,
+    qolganlari "built" bo'lguncha kutadi (so'rov qabul qilmaydi, ya'ni $inc deltalar yo'qolmaydi).
+    """
+    try:
+        claim = await db.rollups.update_one(
+            ROLLUP_META,
+            {"$setOnInsert": {"state": "building", "started_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        claimed = claim.upserted_id is not None
+    except DuplicateKeyError:
+        claimed = False  # boshqa worker bir vaqtda egalladi
+    if claimed:
+        count = await rebuild_rollups()
+        logging.getLogger(__name__).info("Rollups built: %s documents", count)
+        return
+
+    deadline = time.monotonic() + ROLLUP_REBUILD_WAIT_SECONDS
+    while True:
+        meta = await db.rollups.find_one(ROLLUP_META, {"_id": 0, "state": 1})
+        # state yo'q - eski versiyada qurilgan
+        if meta is None or meta.get("state", "built") == "built":
+            return
+        if time.monotonic() > deadline:
+            logging.getLogger(__name__).warning(
+                "Rollups are still being built by another process; if it died, run rebuild_rollups.py"
+            )
+            return
+        await asyncio.sleep(1)
+
+
+async def enrich_bookings(bookings: List[dict], rooms_by_id: Optional[dict] = None, database=None) -> List[dict]:
+    """
+    Bronlarga guest_names va room_number qo'shish - butun sahifa uchun 2 ta so'rov
+    """
+    database = database if database is not None else read_db()
+    guest_ids = {gid for booking in bookings for gid in booking.get("guest_ids") or [] if gid}
+    room_ids = {booking.get("room_id") for booking in bookings if booking.get("room_id")}
+
+    guest_names_by_id = {}
+    if guest_ids:
+        guests = await database.guests.find(
+            {"id": {"$in": list(guest_ids)}},
+            {"_id": 0, "id": 1, "full_name": 1},
+        ).to_list(len(guest_ids))
+        guest_names_by_id = {g["id"]: g.get("full_name") for g in guests}
+
+    room_numbers_by_id = {
+        room_id: room.get("room_number") for room_id, room in (rooms_by_id or {}).items()
+    }
+    missing_room_ids = room_ids - set(room_numbers_by_id)
+    if missing_room_ids:
+        rooms = await database.rooms.find(
+            {"id": {"$in": list(missing_room_ids)}},
+            {"_id": 0, "id": 1, "room_number": 1},
+        ).to_list(len(missing_room_ids))
+        room_numbers_by_id.update({r["id"]: r.get("room_number") for r in rooms})
+
+    for booking in bookings:
+        booking["guest_names"] = [
+            guest_names_by_id[gid] for gid in booking.get("guest_ids") or [] if gid in guest_names_by_id
+        ]
+        booking["room_number"] = room_numbers_by_id.get(booking.get("room_id")) or "Unknown"
+    return bookings
+
+# Xonani band qiladigan bron holatlari
+ACTIVE_BOOKING_STATUSES = ["Confirmed", "Checked In"]
+
+
+async def find_conflicting_booking(
+    room_id: str,
+    check_in_date: str,
+    check_out_date: str,
+    exclude_booking_id: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    [check_in, check_out) oralig'i bilan kesishadigan faol bronni topish.
+    room_status_stay indeksi bo'yicha faqat shu xonaning tugamagan bronlari ko'riladi.
+    """
+    query = {
+        "room_id": room_id,
+        "status": {"$in": ACTIVE_BOOKING_STATUSES},
+        "check_out_date": {"$gt": check_in_date},
+        "check_in_date": {"$lt": check_out_date},
+    }
+    if exclude_booking_id:
+        query["id"] = {"$ne": exclude_booking_id}
+    return await db.bookings.find_one(
+        query, {"_id": 0, "id": 1, "check_in_date": 1, "check_out_date": 1, "status": 1}
+    )
+
+
+def booking_conflict_detail(conflict: dict) -> str:
+    return (
+        f"Room is already booked from {conflict['check_in_date']} "
+        f"to {conflict['check_out_date']} ({conflict['status']})"
+    )
+
+
+# ============== Xona bandligi: rooms.stays (compare-and-set) ==============
+#
+# Har bir xona hujjatida faol bronlar oraliqlari: stays = [{booking_id, check_in_date, check_out_date}].
+# Bron faqat rooms.find_one_and_update filtri kesishish yo'qligini tasdiqlasa qo'shiladi -
+# bitta hujjatdagi atomar compare-and-set: global qulf ham, tranzaksiya ham kerak emas,
+# raqobat faqat bitta xona ichida. Tugagan va bekor qilingan bronlar ro'yxatdan chiqariladi.
+ROOM_PROJECTION = {"_id": 0, "stays": 0}
+
+
+def stay_free_filter(check_in_date: str, check_out_date: str, exclude_booking_id: Optional[str] = None) -> dict:
+    overlap = {"check_in_date": {"$lt": check_out_date}, "check_out_date": {"$gt": check_in_date}}
+    if exclude_booking_id:
+        overlap["booking_id"] = {"$ne": exclude_booking_id}
+    return {"stays": {"$not": {"$elemMatch": overlap}}}
+
+
+def room_stay(booking_id: str, check_in_date: str, check_out_date: str) -> dict:
+    return {"booking_id": booking_id, "check_in_date": check_in_date, "check_out_date": check_out_date}
+
+
+async def reserve_room_stay(room_id: str, booking_id: str, check_in_date: str, check_out_date: str) -> bool:
+    """
+    Xonaga stay qo'shish. False - xona topilmadi yoki oraliq band.
+    """
+    result = await db.rooms.update_one(
+        {"id": room_id, **stay_free_filter(check_in_date, check_out_date)},
+        {"$push": {"stays": room_stay(booking_id, check_in_date, check_out_date)}},
+    )
+    return result.matched_count > 0
+
+
+async def move_room_stay(room_id: str, booking_id: str, check_in_date: str, check_out_date: str) -> bool:
+    """
+    Bronning stay oralig'ini o'zgartirish (o'zi bilan kesishish hisobga olinmaydi)
+    """
+    result = await db.rooms.update_one(
+        {"id": room_id, "stays.booking_id": booking_id, **stay_free_filter(check_in_date, check_out_date, booking_id)},
+        {"$set": {"stays.$[stay].check_in_date": check_in_date, "stays.$[stay].check_out_date": check_out_date}},
+        array_filters=[{"stay.booking_id": booking_id}],
+    )
+    return result.matched_count > 0
+
+
+async def release_room_stay(room_id: str, booking_id: str):
+    await db.rooms.update_one({"id": room_id}, {"$pull": {"stays": {"booking_id": booking_id}}})
+
+
+async def sync_room_stay(room_id: str, booking_id: str):
+    """
+    Bron yangilanishi bajarilmaganda stays yozuvini bronning joriy holatiga qaytarish
+    """
+    booking = await db.bookings.find_one(
+        {"id": booking_id}, {"_id": 0, "status": 1, "check_in_date": 1, "check_out_date": 1}
+    )
+    if not booking or booking["status"] not in ACTIVE_BOOKING_STATUSES:
+        await release_room_stay(room_id, booking_id)
+        return
+    stay = room_stay(booking_id, booking["check_in_date"], booking["check_out_date"])
+    result = await db.rooms.update_one({"id": room_id, "stays.booking_id": booking_id}, {"$set": {"stays.$": stay}})
+    if not result.matched_count:
+        await db.rooms.update_one({"id": room_id}, {"$push": {"stays": stay}})
+
+
+async def room_unavailable_error(room_id: str, check_in_date: str, check_out_date: str, exclude_booking_id: Optional[str] = None) -> HTTPException:
+    conflict = await find_conflicting_booking(room_id, check_in_date, check_out_date, exclude_booking_id)
+    if conflict:
+        return HTTPException(status_code=400, detail=booking_conflict_detail(conflict))
+    # Raqobatdosh bron stays ga yozilgan, lekin bookings ga hali qo'shilmagan
+    return HTTPException(status_code=400, detail="Room is already booked for these dates")
+
+
+async def booking_transition_error(booking_id: str, detail: str) -> HTTPException:
+    """
+    Shartli yangilash bajarilmadi: bron yo'q (404) yoki holati mos emas (400)
+    """
+    if await db.bookings.find_one({"id": booking_id}, {"_id": 1}) is None:
+        return HTTPException(status_code=404, detail="Booking not found")
+    return HTTPException(status_code=400, detail=detail)
+
+
+async def backfill_room_stays() -> int:
+    """
+    stays maydoni yo'q xonalar uchun faol bronlardan ro'yxat tuzish
+    """
+    rooms = await db.rooms.find({"stays": {"$exists": False}}, {"_id": 0, "id": 1}).to_list(None)
+    if not rooms:
+        return 0
+    stays = {room["id"]: [] for room in rooms}
+    bookings = await db.bookings.find(
+        {"room_id": {"$in": list(stays)}, "status": {"$in": ACTIVE_BOOKING_STATUSES}},
+        {"_id": 0, "id": 1, "room_id": 1, "check_in_date": 1, "check_out_date": 1},
+    ).to_list(None)
+    for booking in bookings:
+        stays[booking["room_id"]].append(
+            room_stay(booking["id"], booking["check_in_date"], booking["check_out_date"])
+        )
+    await db.rooms.bulk_write([
+        UpdateOne({"id": room_id, "stays": {"$exists": False}}, {"$set": {"stays": room_stays}})
+        for room_id, room_stays in stays.items()
+    ], ordered=False)
+    return len(stays)
+
+ARCHIVE_SORT_KEYS = {
+    "check_in_date": "check_in_date",
+    "check_out_date": "check_out_date",
+    "created_at": "created_at",
+    "total_amount": "total_price",
+    "total_price": "total_price",
+    "summa": "total_price",
+    "nights": "nights",
+    "room_number": "room_number",
+    "guest_name": "guest_name",
+    "status": "status",
+}
+# Bron hujjatidagi maydonlar - $unwind dan oldin indeks bilan saralash mumkin
+ARCHIVE_BOOKING_SORT_KEYS = {"check_in_date", "check_out_date", "created_at", "total_price", "status"}
+ARCHIVE_SEARCH_FIELDS = ["guest_name", "guest_phone", "room_number", "status", "check_in_date", "check_out_date"]
+
+
+def _parse_day_expr(field: str) -> dict:
+    return {"$dateFromString": {"dateString": field, "format": "%Y-%m-%d", "onError": None, "onNull": None}}
+
+
+def _nights_expr(default):
+    """
+    check_in_date va check_out_date orasidagi tunlar (sana o'qilmasa - default)
+    """
+    return {"$let": {
+        "vars": {"ci": _parse_day_expr("$check_in_date"), "co": _parse_day_expr("$check_out_date")},
+        "in": {"$cond": [
+            {"$and": ["$$ci", "$$co"]},
+            {"$max": [{"$toInt": {"$divide": [{"$subtract": ["$$co", "$$ci"]}, 86400000]}}, 0]},
+            default,
+        ]},
+    }}
+
+
+def build_archive_pipeline(
+    booking_query: dict,
+    guest_id: Optional[str],
+    q: Optional[str],
+    sort_by: str,
+    sort_dir: str,
+    skip: int = 0,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    """
+    Mehmonlar arxivi uchun aggregation: $unwind guest_ids -> $lookup -> $sort -> $facet.
+    limit berilmasa - sahifalashsiz, barcha qatorlar (eksport uchun).
+    """
+    sort_key = ARCHIVE_SORT_KEYS.get(sort_by, "check_in_date")
+    direction = -1 if str(sort_dir).lower() != "asc" else 1
+    # Teng qiymatlar uchun noyob tiebreaker - aks holda $skip/$limit sahifalari qatorlarni takrorlaydi/tushiradi
+    row_sort_stage = {"$sort": {sort_key: direction, "booking_id": direction, "guest_id": direction}}
+    search = q.strip() if q else None
+
+    row_stages = [
+        {"$project": {
+            "_id": 0,
+            "booking_id": "$id",
+            "guest_id": "$guest_ids",
+            "room_id": 1,
+            "check_in_date": 1,
+            "check_out_date": 1,
+            "nights": _nights_expr(None),
+            "status": 1,
+            "total_price": {"$toDouble": {"$ifNull": ["$total_price", 0]}},
+            "guest_share_price": {"$divide": [
+                {"$toDouble": {"$ifNull": ["$total_price", 0]}}, "$guest_count",
+            ]},
+            "checked_in_at": {"$ifNull": ["$checked_in_at", None]},
+            "checked_out_at": {"$ifNull": ["$checked_out_at", None]},
+            "created_at": {"$ifNull": ["$created_at", None]},
+        }},
+    ]
+    lookup_stages = [
+        {"$lookup": {"from": "guests", "localField": "guest_id", "foreignField": "id", "as": "guest"}},
+        {"$lookup": {"from": "rooms", "localField": "room_id", "foreignField": "id", "as": "room"}},
+        {"$addFields": {
+            "guest_name": {"$ifNull": [{"$arrayElemAt": ["$guest.full_name", 0]}, "Unknown"]},
+            "guest_phone": {"$ifNull": [{"$arrayElemAt": ["$guest.phone", 0]}, None]},
+            "guest_passport_id": {"$ifNull": [
+                {"$arrayElemAt": ["$guest.passport_id", 0]},
+                {"$ifNull": [{"$arrayElemAt": ["$guest.id_number", 0]}, None]},
+            ]},
+            "room_number": {"$ifNull": [{"$arrayElemAt": ["$room.room_number", 0]}, "Unknown"]},
+        }},
+        {"$project": {"guest": 0, "room": 0}},
+    ]
+
+    pipeline = [{"$match": booking_query}]
+    if sort_key in ARCHIVE_BOOKING_SORT_KEYS:
+        # $unwind tartibni saqlaydi (bron ichida - guest_ids tartibi), shuning uchun saralash indeksdan foydalanadi
+        pipeline.append({"$sort": {sort_key: direction, "id": direction}})
+    pipeline += [
+        {"$addFields": {"guest_count": {"$size": {"$ifNull": ["$guest_ids", []]}}}},
+        {"$unwind": "$guest_ids"},
+    ]
+    if guest_id:
+        pipeline.append({"$match": {"guest_ids": guest_id}})
+    pipeline += row_stages
+
+    # Qidiruv yoki mehmon/xona bo'yicha saralash uchun join sahifalashdan oldin kerak
+    join_first = bool(search) or sort_key in {"guest_name", "room_number"}
+    if join_first:
+        pipeline += lookup_stages
+    if search:
+        pattern = {"$regex": re.escape(search), "$options": "i"}
+        pipeline.append({"$match": {"$or": [{field: pattern} for field in ARCHIVE_SEARCH_FIELDS]}})
+    if sort_key not in ARCHIVE_BOOKING_SORT_KEYS:
+        pipeline.append(row_sort_stage)
+
+    if limit is None:
+        if not join_first:
+            pipeline += lookup_stages
+        return pipeline
+
+    page_stages = [{"$skip": skip}, {"$limit": limit}]
+    if not join_first:
+        page_stages += lookup_stages
+    pipeline.append({"$facet": {"items": page_stages, "total": [{"$count": "count"}]}})
+    return pipeline
+
+
+def build_archive_booking_query(
+    status: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    guest_id: Optional[str],
+) -> dict:
+    booking_query = {}
+    normalized_status = normalize_booking_status(status)
+    if normalized_status and normalized_status.lower() != "all":
+        booking_query["status"] = normalized_status
+
+    if date_from and date_to:
+        booking_query["check_in_date"] = {"$gte": date_from, "$lte": date_to}
+    elif date_from:
+        booking_query["check_in_date"] = {"$gte": date_from}
+    elif date_to:
+        booking_query["check_in_date"] = {"$lte": date_to}
+
+    if guest_id:
+        booking_query["guest_ids"] = guest_id
+    return booking_query
+
+
+def build_expense_query(date_from: Optional[str], date_to: Optional[str], category: Optional[str]) -> dict:
+    query = {}
+    
+    if category and category != "all":
+        query["category"] = category
+    
+    if date_from and date_to:
+        query["date"] = {"$gte": date_from, "$lte": date_to}
+    elif date_from:
+        query["date"] = {"$gte": date_from}
+    elif date_to:
+        query["date"] = {"$lte": date_to}
+    return query
+
+
+BOOKING_SORT_FIELDS = {
+    "created_at",
+    "check_in_date",
+    "check_out_date",
+    "total_price",
+    "status",
+}
+
+def encode_page_cursor(sort_by: str, sort_direction: int, doc: dict) -> str:
+    """
+    Keyset sahifalash uchun shaffof bo'lmagan kursor: (saralash maydoni qiymati, id)
+    """
+    value = doc.get(sort_by)
+    payload = {"s": sort_by, "d": sort_direction, "id": doc.get("id")}
+    if isinstance(value, datetime):
+        payload.update({"t": "dt", "v": value.isoformat()})
+    else:
+        payload["v"] = value
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_page_cursor(cursor: str, sort_by: str, sort_direction: int):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value = payload["v"]
+        if payload.get("t") == "dt":
+            value = datetime.fromisoformat(value)
+        last_id = payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if payload.get("s") != sort_by or payload.get("d") != sort_direction:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort parameters")
+    return value, last_id
+
+
+def keyset_filter(sort_by: str, sort_direction: int, value, last_id: str) -> dict:
+    """
+    (sort_by, id) juftligi bo'yicha kursordan keyingi hujjatlar.
+    Mongo da null qiymatlar o'sish tartibida birinchi, kamayish tartibida oxirida keladi.
+    $lt/$gt faqat bir BSON turi ichida solishtiradi: turlar tartibi null < string < date,
+    shuning uchun eski string created_at yozuvlari datetime kursordan keyin alohida qo'shiladi.
+    """
+    after = "$gt" if sort_direction == 1 else "$lt"
+    if value is None:
+        same_value = {sort_by: None, "id": {after: last_id}}
+        return {"$or": [same_value, {sort_by: {"$ne": None}}]} if sort_direction == 1 else same_value
+    conditions = [{sort_by: {after: value}}, {sort_by: value, "id": {after: last_id}}]
+    if sort_direction == -1:
+        if isinstance(value, datetime):
+            conditions.append({sort_by: {"$type": "string"}})
+        conditions.append({sort_by: None})
+    elif isinstance(value, str):
+        conditions.append({sort_by: {"$type": "date"}})
+    return {"$or": conditions}
+
+
+async def find_page(
+    collection,
+    query: dict,
+    sort_by: str,
+    sort_direction: int,
+    page: int,
+    limit: int,
+    after: Optional[str] = None,
+    projection: Optional[dict] = None,
+):
+    """
+    Sahifa va keyingi sahifa kursorini qaytaradi. after berilsa - skip o'rniga keyset.
+    """
+    if after:
+        value, last_id = decode_page_cursor(after, sort_by, sort_direction)
+        keyset = keyset_filter(sort_by, sort_direction, value, last_id)
+        query = {"$and": [query, keyset]} if query else keyset
+    cursor = collection.find(query, projection or {"_id": 0}).sort([(sort_by, sort_direction), ("id", sort_direction)])
+    if not after:
+        cursor = cursor.skip((page - 1) * limit)
+    docs = await cursor.limit(limit).to_list(limit)
+    next_cursor = encode_page_cursor(sort_by, sort_direction, docs[-1]) if len(docs) == limit else None
+    return docs, next_cursor
+
+# ============== Hisobot dvigateli: spec -> bitta aggregation pipeline ==============
+#
+# Har bir o'lchov (measure) o'z faktiga tegishli: kolleksiya + sana maydoni. Spec dagi har bir
+# fakt uchun kichik pipeline quriladi, qolgan faktlar $unionWith bilan birinchisiga qo'shiladi
+# va umumiy $group kesimlar (dimensions) bo'yicha yig'adi.
+# Filtrsiz, faqat day/month kesimli spec lar rollups kolleksiyasidan o'qiladi.
+# Reja (pipeline shabloni) sana/filtr qiymatlarisiz keshlanadi - qiymatlar ReportParam
+# o'rniga har so'rovda qo'yiladi.
+REPORT_FACTS = {
+    "check_in": ("bookings", "checked_in_at"),
+    "check_out": ("bookings", "checked_out_at"),
+    "booking": ("bookings", "check_in_date"),
+    "expense": ("expenses", "date"),
+}
+# o'lchov -> (fakt, qiymat ifodasi, rollup maydoni yoki None)
+REPORT_MEASURES = {
+    "revenue": ("check_in", {"$ifNull": ["$total_price", 0]}, "income"),
+    "check_ins": ("check_in", {"$literal": 1}, "check_ins"),
+    "nights": ("check_in", _nights_expr(0), "occupied_nights"),
+    "guests": ("check_in", {"$size": {"$ifNull": ["$guest_ids", []]}}, None),
+    "check_outs": ("check_out", {"$literal": 1}, "check_outs"),
+    "bookings": ("booking", {"$literal": 1}, None),
+    "expenses": ("expense", {"$ifNull": ["$amount", 0]}, "expenses"),
+    "expense_count": ("expense", {"$literal": 1}, "expense_count"),
+}
+# kesim -> faqat shu kolleksiya faktlarida mavjud (None - hammasida)
+REPORT_DIMENSIONS = {
+    "day": None,
+    "month": None,
+    "room_type": "bookings",
+    "room": "bookings",
+    "status": "bookings",
+    "category": "expenses",
+}
+ROLLUP_DIMENSIONS = {"day", "month"}
+# rollup dagi xarita maydonlari: kesim -> (maydon, shu xaritada saqlanadigan o'lchov)
+ROLLUP_MAP_DIMENSIONS = {
+    "room_type": ("room_types", "check_ins"),
+    "category": ("expenses_by_category", "expenses"),
+}
+
+
+class ReportParam(NamedTuple):
+    name: str
+
+
+class ReportPlan(NamedTuple):
+    collection: str
+    pipeline: list
+    source: str                   # "rollups" | "raw"
+    granularity: Optional[str]    # rollups uchun: "day" kesimi bo'lsa - "day", aks holda oraliqqa qarab
+
+
+def _report_dimension_expr(dimension: str, date_field: str):
+    if dimension == "day":
+        return {"$substrCP": [f"${date_field}", 0, 10]}
+    if dimension == "month":
+        return {"$substrCP": [f"${date_field}", 0, 7]}
+    if dimension == "room_type":
+        return {"$ifNull": [{"$arrayElemAt": ["$room.room_type", 0]}, "Unknown"]}
+    if dimension == "room":
+        return {"$ifNull": [{"$arrayElemAt": ["$room.room_number", 0]}, "Unknown"]}
+    if dimension == "category":
+        return {"$ifNull": ["$category", "Boshqa"]}
+    return f"${dimension}"
+
+
+def _rollup_map_dimension(measures: tuple, dimensions: tuple) -> Optional[str]:
+    """
+    Rollup dan javob berish mumkin bo'lsa - ishlatiladigan xarita kesimi ("" - kerak emas), aks holda None
+    """
+    map_dims = [d for d in dimensions if d not in ROLLUP_DIMENSIONS]
+    if not map_dims:
+        return "" if all(REPORT_MEASURES[m][2] for m in measures) else None
+    if len(map_dims) > 1 or map_dims[0] not in ROLLUP_MAP_DIMENSIONS:
+        return None
+    _, map_measure = ROLLUP_MAP_DIMENSIONS[map_dims[0]]
+    return map_dims[0] if set(measures) == {map_measure} else None
+
+
+def _decode_rollup_key_expr(expr) -> dict:
+    # encode_rollup_key ning teskarisi
+    decoded = {"$replaceAll": {"input": expr, "find": "\uff0e", "replacement": "."}}
+    return {"$replaceAll": {"input": decoded, "find": "\uff04", "replacement": {"$literal": "$"}}}
+
+
+def _compile_report_fact(fact: str, measures: tuple, dimensions: tuple, filter_dims: tuple) -> List[dict]:
+    collection, date_field = REPORT_FACTS[fact]
+    used_dims = list(dict.fromkeys(dimensions + filter_dims))
+    for dimension in used_dims:
+        required = REPORT_DIMENSIONS[dimension]
+        if required and required != collection:
+            raise ValueError(f"Dimension '{dimension}' is not available for {collection} measures")
+
+    stages = [{"$match": {date_field: {
+        "$type": "string", "$gte": ReportParam("date_from"), "$lte": ReportParam("date_to"),
+    }}}]
+    if {"room_type", "room"} & set(used_dims):
+        stages.append({"$lookup": {"from": "rooms", "localField": "room_id", "foreignField": "id", "as": "room"}})
+
+    projection = {"_id": 0}
+    for dimension in used_dims:
+        projection[f"d_{dimension}"] = _report_dimension_expr(dimension, date_field)
+    for measure in measures:
+        measure_fact, expr, _ = REPORT_MEASURES[measure]
+        projection[f"m_{measure}"] = expr if measure_fact == fact else {"$literal": 0}
+    stages.append({"$project": projection})
+
+    if filter_dims:
+        stages.append({"$match": {f"d_{d}": {"$in": ReportParam(f"filter.{d}")} for d in filter_dims}})
+    return stages
+
+
+@lru_cache(maxsize=256)
+def compile_report_plan(
+    measures: tuple,
+    dimensions: tuple,
+    filter_dims: tuple,
+    sort_by: Optional[str],
+    sort_direction: int,
+    has_limit: bool,
+    use_rollups: bool,
+) -> ReportPlan:
+    """
+    Spec tuzilmasini aggregation pipeline shabloniga kompilyatsiya qilish.
+    Noto'g'ri spec uchun ValueError.
+    """
+    if not measures:
+        raise ValueError("At least one measure is required")
+    for measure in measures:
+        if measure not in REPORT_MEASURES:
+            raise ValueError(f"Unknown measure '{measure}'")
+    for dimension in dimensions + filter_dims:
+        if dimension not in REPORT_DIMENSIONS:
+            raise ValueError(f"Unknown dimension '{dimension}'")
+    if len(set(measures)) != len(measures) or len(set(dimensions)) != len(dimensions):
+        raise ValueError("Duplicate measure or dimension")
+
+    granularity = None
+    map_dimension = _rollup_map_dimension(measures, dimensions) if use_rollups and not filter_dims else None
+    if map_dimension is not None:
+        collection, source = "rollups", "rollups"
+        granularity = "day" if "day" in dimensions else None
+        pipeline = [
+            {"$match": {"granularity": ReportParam("granularity"), "period": {
+                "$type": "string", "$gte": ReportParam("period_from"), "$lte": ReportParam("period_to"),
+            }}},
+        ]
+        projection = {"_id": 0}
+        if "day" in dimensions:
+            projection["d_day"] = "$period"
+        if "month" in dimensions:
+            projection["d_month"] = {"$substrCP": ["$period", 0, 7]}
+        if map_dimension:
+            # {room_types: {"VIP": 3}} -> har bir kalit alohida qator (nol qiymatlar - xom faktlarda yo'q)
+            field, map_measure = ROLLUP_MAP_DIMENSIONS[map_dimension]
+            pipeline += [
+                {"$project": {"period": 1, "entry": {"$objectToArray": {"$ifNull": [f"${field}", {}]}}}},
+                {"$unwind": "$entry"},
+                {"$match": {"entry.v": {"$ne": 0}}},
+            ]
+            projection[f"d_{map_dimension}"] = _decode_rollup_key_expr("$entry.k")
+            projection[f"m_{map_measure}"] = "$entry.v"
+        else:
+            projection.update({f"m_{m}": {"$ifNull": [f"${REPORT_MEASURES[m][2]}", 0]} for m in measures})
+        pipeline.append({"$project": projection})
+    else:
+        source = "raw"
+        facts = list(dict.fromkeys(REPORT_MEASURES[m][0] for m in measures))
+        collection = REPORT_FACTS[facts[0]][0]
+        pipeline = _compile_report_fact(facts[0], measures, dimensions, filter_dims)
+        for fact in facts[1:]:
+            pipeline.append({"$unionWith": {
+                "coll": REPORT_FACTS[fact][0],
+                "pipeline": _compile_report_fact(fact, measures, dimensions, filter_dims),
+            }})
+
+    group = {"_id": {d: f"$d_{d}" for d in dimensions} if dimensions else None}
+    group.update({m: {"$sum": f"$m_{m}"} for m in measures})
+    pipeline.append({"$group": group})
+
+    sort = {}
+    if sort_by:
+        if sort_by in measures:
+            sort[sort_by] = sort_direction
+        elif sort_by in dimensions:
+            sort[f"_id.{sort_by}"] = sort_direction
+        else:
+            raise ValueError(f"Cannot sort by '{sort_by}': not a measure or dimension of this report")
+    for dimension in dimensions:
+        sort.setdefault(f"_id.{dimension}", 1)
+    if sort:
+        pipeline.append({"$sort": sort})
+    if has_limit:
+        pipeline.append({"$limit": ReportParam("limit")})
+
+    output = {"_id": 0}
+    output.update({d: f"$_id.{d}" for d in dimensions})
+    output.update({m: 1 for m in measures})
+    pipeline.append({"$project": output})
+    return ReportPlan(collection, pipeline, source, granularity)
+
+
+_UNBOUND = object()
+
+
+def bind_report_params(node, params: dict):
+    """
+    Shablondagi ReportParam larni qiymatlar bilan almashtirish (shablon o'zgarmaydi).
+    Qiymati berilmagan parametr kaliti bilan birga tushib qoladi.
+    """
+    if isinstance(node, ReportParam):
+        return params.get(node.name, _UNBOUND)
+    if isinstance(node, dict):
+        bound = {}
+        for key, value in node.items():
+            value = bind_report_params(value, params)
+            if value is not _UNBOUND:
+                bound[key] = value
+        return bound
+    if isinstance(node, list):
+        return [bind_report_params(value, params) for value in node]
+    return node
+
+
+def _is_month_aligned(date_from: Optional[str], date_to: Optional[str]) -> bool:
+    if date_from and not date_from.endswith("-01"):
+        return False
+    if date_to and (parse_iso_day(date_to) + timedelta(days=1)).day != 1:
+        return False
+    return True
+
+
+async def run_report(query: ReportQuery) -> List[dict]:
+    for value in (query.date_from, query.date_to):
+        if value is not None and not parse_iso_day(value):
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    try:
+        plan = compile_report_plan(
+            tuple(query.measures),
+            tuple(query.dimensions),
+            tuple(sorted(query.filters)),
+            query.sort_by,
+            -1 if str(query.sort_dir).lower() == "desc" else 1,
+            query.limit is not None,
+            query.use_rollups,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    params = {"date_from": query.date_from, "date_to": query.date_to, "limit": query.limit}
+    params.update({f"filter.{d}": list(values) for d, values in query.filters.items()})
+    if plan.source == "rollups":
+        granularity = plan.granularity or ("month" if _is_month_aligned(query.date_from, query.date_to) else "day")
+        period_length = 7 if granularity == "month" else 10
+        params.update({
+            "granularity": granularity,
+            "period_from": query.date_from[:period_length] if query.date_from else None,
+            "period_to": query.date_to[:period_length] if query.date_to else None,
+        })
+    pipeline = bind_report_params(plan.pipeline, {k: v for k, v in params.items() if v is not None})
+    return await read_db()[plan.collection].aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+# ============== Mehmon qidiruvi: normallashtirilgan kalitlar ==============
+#
+# Har bir mehmon hujjatida search_keys massivi (multikey indeks):
+# - ism tokenlari (kichik harf, kirill -> lotin, apostroflarsiz) va ularning prefikslari
+# - telefon: faqat raqamlar, to'liq va mahalliy (oxirgi 9 raqam) prefikslari
+# - passport_id / id_number: katta harf, faqat harf-raqam, prefikslari
+# - to'liq qiymatlar "=" belgisi bilan alohida (aniq moslik nomzodlari birinchi olinadi)
+# search_keys_v - kalitlar sxemasi versiyasi, o'zgarsa startup backfill qayta hisoblaydi
+SEARCH_MIN_PREFIX = 2
+SEARCH_MIN_DIGITS_PREFIX = 3
+SEARCH_MAX_PREFIX = 16
+SEARCH_MAX_CANDIDATES = 1000
+SEARCH_EXACT_MARK = "="
+SEARCH_KEYS_VERSION = 2
+GUEST_SEARCH_PROJECTION = {"_id": 0, "search_keys": 0, "search_keys_v": 0}
+
+UZ_CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "j",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "x", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+}
+APOSTROPHES_RE = re.compile(r"[\'`\u2018\u2019\u02bb\u02bc]")
+NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_name(value: Optional[str]) -> str:
+    """
+    "Ғулом Тошкентов" va "G'ulom Toshkentov" -> "gulom toshkentov"
+    """
+    text = "".join(UZ_CYRILLIC_TO_LATIN.get(ch, ch) for ch in (value or "").lower())
+    text = APOSTROPHES_RE.sub("", text)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return NON_ALNUM_RE.sub(" ", text).strip()
+
+
+def normalize_document_id(value: Optional[str]) -> str:
+    return re.sub(r"[^0-9A-Z]", "", (value or "").upper())
+
+
+def _prefixes(token: str, min_length: int) -> List[str]:
+    return [token[:i] for i in range(min_length, min(len(token), SEARCH_MAX_PREFIX) + 1)]
+
+
+def _exact_values(guest: dict) -> set:
+    exact = set(normalize_name(guest.get("full_name")).split())
+    phone = re.sub(r"\D", "", guest.get("phone") or "")
+    if phone:
+        exact.update({phone, phone[-9:]})
+    exact.update(normalize_document_id(guest.get(field)) for field in ("passport_id", "id_number"))
+    exact.discard("")
+    exact.discard(None)
+    return exact
+
+
+def build_guest_search_keys(guest: dict) -> List[str]:
+    keys = set()
+    for token in normalize_name(guest.get("full_name")).split():
+        keys.add(token)
+        keys.update(_prefixes(token, SEARCH_MIN_PREFIX))
+    phone = re.sub(r"\D", "", guest.get("phone") or "")
+    if phone:
+        keys.add(phone)
+        keys.update(_prefixes(phone, SEARCH_MIN_DIGITS_PREFIX))
+        keys.update(_prefixes(phone[-9:], SEARCH_MIN_DIGITS_PREFIX))
+    for field in ("passport_id", "id_number"):
+        document_id = normalize_document_id(guest.get(field))
+        if document_id:
+            keys.add(document_id)
+            keys.update(_prefixes(document_id, SEARCH_MIN_PREFIX))
+    keys.update(SEARCH_EXACT_MARK + value for value in _exact_values(guest))
+    return sorted(keys)
+
+
+def guest_search_fields(guest: dict) -> dict:
+    """
+    Mehmon hujjatiga yoziladigan qidiruv maydonlari
+    """
+    return {"search_keys": build_guest_search_keys(guest), "search_keys_v": SEARCH_KEYS_VERSION}
+
+
+def build_search_terms(q: str) -> List[str]:
+    """
+    Qidiruv so'rovini search_keys bilan bir xil ko'rinishdagi terminlarga aylantirish
+    """
+    # "AB 1234567" - passport seriyasi va raqami alohida yozilgan
+    q = re.sub(r"^([A-Za-z]{2})\s+(\d{5,})$", r"\1\2", q)
+    if re.fullmatch(r"[\d\s+\-()]+", q):
+        digits = re.sub(r"\D", "", q)
+        return [digits[:SEARCH_MAX_PREFIX]] if len(digits) >= SEARCH_MIN_DIGITS_PREFIX else []
+    terms = []
+    for raw in q.split():
+        if re.search(r"\d", raw) and re.search(r"[^\W\d_]", raw):
+            term = normalize_document_id(raw)
+        elif raw.strip("+-()").isdigit():
+            term = re.sub(r"\D", "", raw)
+        else:
+            terms.extend(t[:SEARCH_MAX_PREFIX] for t in normalize_name(raw).split() if len(t) >= SEARCH_MIN_PREFIX)
+            continue
+        if len(term) >= SEARCH_MIN_PREFIX:
+            terms.append(term[:SEARCH_MAX_PREFIX])
+    # Eng uzun (eng tanlab oluvchi) termin birinchi - indeks shu bo'yicha skanerlanadi
+    return sorted(set(terms), key=len, reverse=True)
+
+
+def score_guest(guest: dict, terms: List[str], q: str) -> float:
+    exact = _exact_values(guest)
+    score = sum(3 if term in exact else 1 for term in terms)
+    if normalize_name(guest.get("full_name")).startswith(normalize_name(q)):
+        score += 2
+    return score
+
+
+async def search_guests(q: str, limit: int, projection: Optional[dict] = None) -> List[dict]:
+    """
+    Indeks bo'yicha nomzodlarni topib, reyting bo'yicha saralash.
+    Avval barcha terminlari aniq mos keladigan mehmonlar olinadi, keyin limitgacha
+    prefiks mosliklari bilan to'ldiriladi - limit eng yaxshi natijalarni kesib qo'ymaydi.
+    Faqat prefiks mosliklari ichida reyting SEARCH_MAX_CANDIDATES doirasida qo'llanadi.
+    """
+    terms = build_search_terms(q.strip())
+    if not terms:
+        return []
+    projection = projection or GUEST_SEARCH_PROJECTION
+    candidates = await db.guests.find(
+        {"search_keys": {"$all": [SEARCH_EXACT_MARK + term for term in terms]}}, projection
+    ).limit(SEARCH_MAX_CANDIDATES).to_list(SEARCH_MAX_CANDIDATES)
+    if len(candidates) < SEARCH_MAX_CANDIDATES:
+        remaining = SEARCH_MAX_CANDIDATES - len(candidates)
+        candidates += await db.guests.find(
+            {"search_keys": {"$all": terms}, "id": {"$nin": [g["id"] for g in candidates]}}, projection
+        ).limit(remaining).to_list(remaining)
+    for guest in candidates:
+        guest["score"] = score_guest(guest, terms, q)
+    candidates.sort(key=lambda g: (-g["score"], g.get("full_name") or ""))
+    return candidates[:limit]
+
+
+async def backfill_guest_search_keys(batch_size: int = 1000) -> int:
+    """
+    search_keys yo'q yoki eski versiyadagi mehmonlar uchun kalitlarni hisoblash
+    """
+    updated = 0
+    while True:
+        guests = await db.guests.find(
+            {"search_keys_v": {"$ne": SEARCH_KEYS_VERSION}},
+            {"_id": 1, "full_name": 1, "phone": 1, "passport_id": 1, "id_number": 1},
+        ).limit(batch_size).to_list(batch_size)
+        if not guests:
+            return updated
+        await db.guests.bulk_write([
+            UpdateOne({"_id": g["_id"]}, {"$set": guest_search_fields(g)}) for g in guests
+        ], ordered=False)
+        updated += len(guests)
+
+# ============== Mehmonlar importi: CSV / JSON / NDJSON ==============
+#
+# Qatorlar oqim bilan o'qiladi, GUEST_IMPORT_BATCH_SIZE lik paketlarda GuestCreate bo'yicha
+# tekshiriladi, mavjud mehmonlar bilan dublikatlar bitta search_keys so'rovi bilan topiladi
+# va qolganlari tartibsiz (unordered) insert_many bilan yoziladi.
+GUEST_IMPORT_FORMATS = {"csv", "json", "ndjson"}
+GUEST_IMPORT_BATCH_SIZE = 1000
+GUEST_IMPORT_CHUNK_SIZE = 64 * 1024
+
+
+def guest_identity_keys(guest: dict) -> set:
+    """
+    Dublikatni aniqlash kalitlari: hujjat raqamlari (passport_id / id_number) va telefon (oxirgi 9 raqam)
+    """
+    keys = set()
+    for field in ("passport_id", "id_number"):
+        document_id = normalize_document_id(guest.get(field))
+        if len(document_id) >= 5:
+            keys.add(("doc", document_id))
+    phone = re.sub(r"\D", "", guest.get("phone") or "")
+    if len(phone) >= 7:
+        keys.add(("phone", phone[-9:]))
+    return keys
+
+
+async def find_existing_identity_keys(keys: set) -> set:
+    """
+    Bazadagi mehmonlar bilan kesishadigan kalitlar (search_keys indeksi orqali)
+    """
+    if not keys:
+        return set()
+    terms = list({value[:SEARCH_MAX_PREFIX] for _, value in keys})
+    candidates = await db.guests.find(
+        {"search_keys": {"$in": terms}},
+        {"_id": 0, "passport_id": 1, "id_number": 1, "phone": 1},
+    ).to_list(None)
+    existing = set()
+    for candidate in candidates:
+        existing |= guest_identity_keys(candidate) & keys
+    return existing
+
+
+def _import_row(raw) -> dict:
+    if not isinstance(raw, dict):
+        raise ValueError("Row must be an object")
+    # CSV dagi bo'sh katakchalar - qiymat yo'q
+    return {
+        key.strip(): value.strip() if isinstance(value, str) else value
+        for key, value in raw.items()
+        if key and value not in (None, "")
+    }
+
+
+async def iter_import_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple]:
+    """
+    Baytlar oqimidan (qator raqami, yozuv) juftliklari. Qator raqami 1 dan, CSV sarlavhasi hisobga olinmaydi.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    if fmt == "json":
+        # JSON massivni qismlab o'qib bo'lmaydi - katta fayllar uchun ndjson yoki csv
+        text = ""
+        async for chunk in chunks:
+            text += decoder.decode(chunk)
+        text += decoder.decode(b"", final=True)
+        rows = json.loads(text or "[]")
+        if not isinstance(rows, list):
+            raise ValueError("JSON import must be an array of objects")
+        for number, row in enumerate(rows, start=1):
+            yield number, row
+        return
+
+    header = None
+    number = 0
+    pending = ""
+    record = ""
+
+    def parse(line: str, final: bool = False):
+        nonlocal header, number, record
+        record += line
+        # Qo'shtirnoq ichidagi yangi qator - yozuv hali tugamagan
+        if fmt == "csv" and not final and record.count('"') % 2:
+            return None
+        text, record = record, ""
+        if not text.strip():
+            return None
+        if fmt == "ndjson":
+            number += 1
+            try:
+                return number, json.loads(text)
+            except ValueError as exc:
+                return number, exc
+        values = next(csv.reader(io.StringIO(text)))
+        if header is None:
+            header = [column.strip() for column in values]
+            return None
+        number += 1
+        return number, dict(zip(header, values))
+
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            parsed = parse(line + "\n")
+            if parsed:
+                yield parsed
+    parsed = parse(pending + decoder.decode(b"", final=True), final=True)
+    if parsed:
+        yield parsed
+
+
+class GuestImporter:
+    """
+    Mehmonlarni paketlab import qilish va har bir rad etilgan qator uchun hisobot
+    """
+
+    def __init__(self, batch_size: int = GUEST_IMPORT_BATCH_SIZE, dry_run: bool = False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.batch = []
+        self.seen_keys = set()
+        self.rows = 0
+        self.inserted = 0
+        self.errors = []
+
+    def reject(self, row: int, reason: str, detail: str):
+        self.errors.append({"row": row, "reason": reason, "detail": detail})
+
+    async def add(self, row: int, raw):
+        self.rows += 1
+        self.batch.append((row, raw))
+        if len(self.batch) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        batch, self.batch = self.batch, []
+        valid = []
+        for row, raw in batch:
+            if isinstance(raw, Exception):
+                self.reject(row, "invalid", f"Malformed row: {raw}")
+                continue
+            try:
+                guest = Guest(**GuestCreate.model_validate(_import_row(raw)).model_dump())
+            except (ValidationError, ValueError) as exc:
+                if isinstance(exc, ValidationError):
+                    detail = "; ".join(
+                        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+                    )
+                else:
+                    detail = str(exc)
+                self.reject(row, "invalid", detail)
+                continue
+            doc = guest.model_dump()
+            keys = guest_identity_keys(doc)
+            if keys & self.seen_keys:
+                self.reject(row, "duplicate", "Duplicate of an earlier row in this file")
+                continue
+            self.seen_keys |= keys
+            valid.append((row, doc, keys))
+
+        existing = await find_existing_identity_keys(set().union(*(keys for _, _, keys in valid)))
+        docs = []
+        for row, doc, keys in valid:
+            matched = keys & existing
+            if matched:
+                kind, value = sorted(matched)[0]
+                self.reject(row, "duplicate", f"Guest with this {'document id' if kind == 'doc' else 'phone'} already exists ({value})")
+                continue
+            doc.update(guest_search_fields(doc))
+            docs.append((row, doc))
+
+        if not docs or self.dry_run:
+            self.inserted += len(docs)
+            return
+        try:
+            await db.guests.insert_many([doc for _, doc in docs], ordered=False)
+            inserted = len(docs)
+        except BulkWriteError as exc:
+            write_errors = exc.details.get("writeErrors", [])
+            for error in write_errors:
+                self.reject(docs[error["index"]][0], "error", error.get("errmsg", "Insert failed"))
+            inserted = len(docs) - len(write_errors)
+        self.inserted += inserted
+        # Versiya yozuvdan keyin - oraliqda kelgan so'rov eski ro'yxatni yangi ETag bilan olmasin
+        if inserted:
+            await collection_versions.bump("guests")
+
+    async def run(self, rows: AsyncIterator[tuple]) -> dict:
+        async for row, raw in rows:
+            await self.add(row, raw)
+        await self.flush()
+        return self.report()
+
+    def report(self) -> dict:
+        self.errors.sort(key=lambda error: error["row"])
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "rejected": len(self.errors),
+            "dry_run": self.dry_run,
+            "errors": self.errors,
+        }
+
+
+@lru_cache(maxsize=None)
+def _model_row_fields(model) -> tuple:
+    fields = []
+    for name, field in model.model_fields.items():
+        default = None if field.default_factory is not None or field.is_required() else field.default
+        fields.append((name, default))
+    return tuple(fields)
+
+
+def model_rows(model, docs: List[dict]) -> List[dict]:
+    """
+    Mongo hujjatlarini model maydonlariga keltirish - pydantic validatsiyasiz.
+    Hujjatlar shu modellar orqali yozilgani uchun ro'yxatlarda qayta tekshirilmaydi.
+    """
+    fields = _model_row_fields(model)
+    return [{name: doc.get(name, default) for name, default in fields} for doc in docs]
+
+
+def list_response(model, docs: List[dict], headers: Optional[dict] = None) -> FastJSONResponse:
+    return FastJSONResponse(model_rows(model, docs), headers=headers)
+
+# Auth functions
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+async def verify_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, get_password_hash, password)
+
+def get_hash_rounds(hashed_password: str) -> Optional[int]:
+    # bcrypt format: $2b$12$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def measure_bcrypt_rounds(target_ms: float, min_rounds: int = 10, max_rounds: int = 15) -> int:
+    """
+    target_ms dan oshmaydigan eng katta bcrypt cost ni o'lchash (har +1 round vaqtni 2 baravar oshiradi)
+    """
+    start = time.perf_counter()
+    bcrypt.hashpw(b"bcrypt-cost-benchmark", bcrypt.gensalt(min_rounds))
+    elapsed_ms = max((time.perf_counter() - start) * 1000, 0.001)
+    rounds = min_rounds + int(math.floor(math.log2(target_ms / elapsed_ms))) if target_ms > elapsed_ms else min_rounds
+    return max(min_rounds, min(rounds, max_rounds))
+
+async def configure_password_hashing():
+    global bcrypt_rounds
+    if BCRYPT_TARGET_MS <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    rounds = await loop.run_in_executor(password_executor, measure_bcrypt_rounds, BCRYPT_TARGET_MS)
+    pwd_context.update(bcrypt__rounds=rounds)
+    bcrypt_rounds = rounds
+    logging.getLogger(__name__).info("bcrypt cost set to %s for target %sms", rounds, BCRYPT_TARGET_MS)
+
+def create_access_token(data: dict):
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def create_user_token(user: dict) -> str:
+    created_at = user.get("created_at")
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    return create_access_token(data={
+        "sub": user["username"],
+        "uid": user.get("id"),
+        "role": user.get("role"),
+        "permissions": normalize_permissions(user.get("permissions"), user.get("role")),
+        "ver": user.get("token_version", 0),
+        "created_at": created_at,
+    })
+
+
+class TokenVersionTable:
+    """
+    username -> token_version jadvali (jarayon ichida, vaqti-vaqti bilan yangilanadi).
+    Jadvalda yo'q yoki tokendagidan eski versiya boshqa worker dagi yozuv bo'lishi mumkin -
+    bunday holda foydalanuvchi Mongo dan qayta o'qiladi (current_version).
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.versions = {}
+        self.loaded_at = None
+        self.lock = asyncio.Lock()
+
+    async def refresh(self):
+        users = await db.users.find({}, {"_id": 0, "username": 1, "token_version": 1}).to_list(None)
+        self.versions = {u["username"]: u.get("token_version", 0) for u in users}
+        self.loaded_at = time.monotonic()
+
+    async def get(self, username: str) -> Optional[int]:
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_seconds:
+            async with self.lock:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_seconds:
+                    await self.refresh()
+        return self.versions.get(username)
+
+    def set(self, username: str, version: int):
+        self.versions[username] = version
+
+    async def current_version(self, username: str, token_version: int) -> Optional[int]:
+        """
+        Token tekshiruvi uchun versiya: jadvalda yo'q yoki token versiyasi yangiroq bo'lsa -
+        shu foydalanuvchi bazadan o'qiladi (versiyalar faqat o'sadi, eski token bazasiz rad etiladi)
+        """
+        version = await self.get(username)
+        if version is not None and token_version <= version:
+            return version
+        user = await db.users.find_one({"username": username}, {"_id": 0, "token_version": 1})
+        if user is None:
+            self.versions.pop(username, None)
+            return None
+        version = user.get("token_version", 0)
+        self.set(username, version)
+        return version
+
+
+token_versions = TokenVersionTable(TOKEN_VERSION_REFRESH_SECONDS)
+
+
+async def revoke_user_tokens(username: str) -> Optional[int]:
+    """
+    Foydalanuvchining barcha tokenlarini bekor qilish (token_version += 1)
+    """
+    user = await db.users.find_one_and_update(
+        {"username": username},
+        {"$inc": {"token_version": 1}},
+        projection={"_id": 0, "token_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if user is None:
+        return None
+    token_versions.set(username, user["token_version"])
+    await collection_versions.bump("users")
+    return user["token_version"]
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await user_from_token(credentials.credentials)
+
+async def get_stream_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    token: Optional[str] = None,
+):
+    """
+    EventSource sarlavha yubora olmaydi - token ?token= parametri orqali ham qabul qilinadi
+    """
+    token = credentials.credentials if credentials else token
+    if not token:
+        raise HTTPException(status_code=403, detail="Not authenticated")
+    return await user_from_token(token)
+
+async def user_from_token(token: str) -> User:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if AUTH_STATELESS and "ver" in payload:
+            current_version = await token_versions.current_version(username, payload["ver"])
+            if current_version is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            if payload["ver"] != current_version:
+                raise HTTPException(status_code=401, detail="Token revoked")
+            created_at = payload.get("created_at")
+            return User(
+                id=payload.get("uid"),
+                username=username,
+                role=payload.get("role"),
+                permissions=payload.get("permissions") or [],
+                created_at=datetime.fromisoformat(created_at) if created_at else datetime.now(timezone.utc),
+            )
+        user = await db.users.find_one({"username": username}, {"_id": 0})
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        user["permissions"] = normalize_permissions(user.get("permissions"), user.get("role"))
+        if isinstance(user.get('created_at'), str):
+            user['created_at'] = datetime.fromisoformat(user['created_at'])
+        return User(**user)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+# Initialize demo data - YANGILANGAN
+async def initialize_demo_data():
+    now = datetime.now(timezone.utc)
+    users_count = await db.users.count_documents({})
+    if users_count == 0:
+        admin_user = {
+            "id": str(uuid.uuid4()),
+            "username": "admin",
+            "password": await get_password_hash_async("admin123"),
+            "role": "admin",
+            "permissions": get_default_permissions_for_role("admin"),
+            "created_at": now
+        }
+        reception_user = {
+            "id": str(uuid.uuid4()),
+            "username": "reception",
+            "password": await get_password_hash_async("reception123"),
+            "role": "receptionist",
+            "permissions": get_default_permissions_for_role("receptionist"),
+            "created_at": now
+        }
+        await db.users.insert_many([admin_user, reception_user])
+        
+    rooms_count = await db.rooms.count_documents({})
+    if rooms_count == 0:
+        rooms = [
+            {"id": str(uuid.uuid4()), "room_number": "101", "room_type": "1 kishilik", "capacity": 1, "price_per_night": 150000, "status": "Available", "description": "Bir kishilik xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "102", "room_type": "1 kishilik", "capacity": 1, "price_per_night": 150000, "status": "Available", "description": "Bir kishilik xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "201", "room_type": "2 kishilik", "capacity": 2, "price_per_night": 250000, "status": "Available", "description": "Ikki kishilik xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "202", "room_type": "2 kishilik", "capacity": 2, "price_per_night": 250000, "status": "Available", "description": "Ikki kishilik xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "301", "room_type": "3 kishilik", "capacity": 3, "price_per_night": 350000, "status": "Available", "description": "Uch kishilik xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "302", "room_type": "4 kishilik", "capacity": 4, "price_per_night": 450000, "status": "Available", "description": "To'rt kishilik xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "401", "room_type": "5 kishilik", "capacity": 5, "price_per_night": 550000, "status": "Available", "description": "Besh kishilik xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "501", "room_type": "VIP", "capacity": 2, "price_per_night": 750000, "status": "Available", "description": "VIP xona", "created_at": now},
+            {"id": str(uuid.uuid4()), "room_number": "502", "room_type": "Lux", "capacity": 3, "price_per_night": 1000000, "status": "Available", "description": "Lux xona", "created_at": now},
+        ]
+        await db.rooms.insert_many(rooms)
+        
+    guests_count = await db.guests.count_documents({})
+    if guests_count == 0:
+        guests = [
+            {"id": str(uuid.uuid4()), "full_name": "Alisher Karimov", "phone": "+998901234567", "passport_id": "AB1234567", "created_at": now},
+            {"id": str(uuid.uuid4()), "full_name": "Malika Rahimova", "phone": "+998907654321", "passport_id": "AB7654321", "created_at": now},
+        ]
+        await db.guests.insert_many(guests)
+
+# Indekslar - har bir kolleksiya uchun e'lon qilingan
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "rooms": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("room_number", ASCENDING)], name="room_number_unique", unique=True),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "guests": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Keyset sahifalash: har bir saralash maydoni + id
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("full_name", ASCENDING), ("id", ASCENDING)], name="full_name_id"),
+        IndexModel([("phone", ASCENDING), ("id", ASCENDING)], name="phone_id"),
+        IndexModel([("passport_id", ASCENDING), ("id", ASCENDING)], name="passport_id_id"),
+        IndexModel([("id_number", ASCENDING), ("id", ASCENDING)], name="id_number_id"),
+        IndexModel([("search_keys", ASCENDING)], name="search_keys"),
+        IndexModel([("search_keys_v", ASCENDING)], name="search_keys_v"),
+    ],
+    "bookings": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+        IndexModel([("status", ASCENDING), ("check_in_date", DESCENDING)], name="status_check_in_date"),
+        IndexModel([("status", ASCENDING), ("id", ASCENDING)], name="status_id"),
+        IndexModel([("check_in_date", DESCENDING), ("id", DESCENDING)], name="check_in_date_id"),
+        IndexModel([("check_out_date", DESCENDING), ("id", DESCENDING)], name="check_out_date_id"),
+        IndexModel([("total_price", DESCENDING), ("id", DESCENDING)], name="total_price_id"),
+        IndexModel([("check_out_date", ASCENDING), ("check_in_date", ASCENDING)], name="stay_window"),
+        IndexModel([("checked_in_at", ASCENDING)], name="checked_in_at"),
+        IndexModel([("checked_out_at", ASCENDING)], name="checked_out_at"),
+        IndexModel([("guest_ids", ASCENDING), ("check_in_date", DESCENDING)], name="guest_ids_check_in_date"),
+        IndexModel(
+            [("room_id", ASCENDING), ("status", ASCENDING), ("check_out_date", ASCENDING), ("check_in_date", ASCENDING)],
+            name="room_status_stay",
+        ),
+    ],
+    "rollups": [
+        IndexModel([("granularity", ASCENDING), ("period", ASCENDING)], name="granularity_period", unique=True),
+    ],
+    "expenses": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("date", DESCENDING)], name="date"),
+        IndexModel([("category", ASCENDING), ("date", DESCENDING)], name="category_date"),
+    ],
+}
+
+# Yangi indekslar bilan almashtirilgan (endi e'lon qilinmagan) indekslar
+RETIRED_INDEXES = {
+    "guests": ["full_name", "phone", "passport_id", "id_number"],
+    "bookings": ["status_created_at", "check_in_date", "check_out_date"],
+}
+
+
+async def ensure_indexes():
+    """
+    E'lon qilingan indekslarni yaratish (idempotent)
+    """
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+            # Faqat almashtirilgan indekslar o'chiriladi - qo'lda qo'shilganlarga tegilmaydi
+            for name in RETIRED_INDEXES.get(collection_name, []):
+                try:
+                    await db[collection_name].drop_index(name)
+                except OperationFailure as exc:
+                    if exc.code != 27:  # IndexNotFound
+                        raise
+        except OperationFailure as exc:
+            # Masalan: eski ma'lumotlarda dublikat room_number bo'lsa - server baribir ishga tushadi
+            logging.getLogger(__name__).warning(
+                "Index creation failed for %s: %s", collection_name, exc
+            )
+
+@app.on_event("startup")
+async def startup_event():
+    await configure_password_hashing()
+    await ensure_indexes()
+    await collection_versions.configure()
+    await initialize_demo_data()
+    updated = await backfill_guest_search_keys()
+    if updated:
+        logging.getLogger(__name__).info("Guest search keys built for %s guests", updated)
+    updated = await backfill_room_stays()
+    if updated:
+        logging.getLogger(__name__).info("Room stays built for %s rooms", updated)
+    await ensure_rollups_built()
+    app.state.change_stream_task = await configure_event_source()
+
+# Auth routes
+@api_router.post("/auth/login", response_model=LoginResponse)
+async def login(login_data: LoginRequest):
+    user = await db.users.find_one({"username": login_data.username}, {"_id": 0})
+    if not user or not await verify_password_async(login_data.password, user["password"]):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # bcrypt cost o'zgargan bo'lsa - parolni yangi cost bilan qayta hash qilish
+    if get_hash_rounds(user["password"]) != bcrypt_rounds:
+        new_hash = await get_password_hash_async(login_data.password)
+        await db.users.update_one(
+            {"username": user["username"], "password": user["password"]},
+            {"$set": {"password": new_hash}},
+        )
+    
+    user["permissions"] = normalize_permissions(user.get("permissions"), user.get("role"))
+    if isinstance(user.get('created_at'), str):
+        user['created_at'] = datetime.fromisoformat(user['created_at'])
+    
+    access_token = create_user_token(user)
+    user_data = {k: v for k, v in user.items() if k != "password"}
+    return {"token": access_token, "user": user_data}
+
+@api_router.get("/auth/me", response_model=User)
+async def get_me(current_user: User = Depends(get_current_user)):
+    return current_user
+
+# User routes
+@api_router.post("/users", response_model=User)
+async def create_user(user_data: UserCreate, current_user: User = Depends(get_admin_user)):
+    existing = await db.users.find_one({"username": user_data.username})
+    if existing:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    
+    permissions = normalize_permissions(user_data.permissions, user_data.role)
+    user = User(username=user_data.username, role=user_data.role, permissions=permissions)
+    doc = user.model_dump()
+    doc["password"] = await get_password_hash_async(user_data.password)
+    doc["token_version"] = 0
+    await db.users.insert_one(doc)
+    token_versions.set(user.username, 0)
+    await collection_versions.bump("users")
+    return user
+
+@api_router.get("/users", response_model=List[User])
+async def get_users(current_user: User = Depends(get_admin_user), etag: str = Depends(conditional_get("users"))):
+    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
+    for user in users:
+        user["permissions"] = normalize_permissions(user.get("permissions"), user.get("role"))
+    return list_response(User, users)
+
+@api_router.post("/users/{user_id}/revoke-tokens")
+async def revoke_tokens(user_id: str, current_user: User = Depends(get_admin_user)):
+    """
+    Foydalanuvchining barcha faol tokenlarini bekor qilish
+    """
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "username": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    version = await revoke_user_tokens(user["username"])
+    return {"message": "Tokens revoked", "token_version": version}
+
+# Room routes
+@api_router.get("/rooms", response_model=List[Room])
+async def get_rooms(
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("rooms")),
+):
+    query = {}
+    if status:
+        query["status"] = status
+    rooms = await db.rooms.find(query, ROOM_PROJECTION).to_list(1000)
+    return list_response(Room, rooms)
+
+@api_router.post("/rooms", response_model=Room)
+async def create_room(room_data: RoomCreate, current_user: User = Depends(get_admin_user)):
+    existing = await db.rooms.find_one({"room_number": room_data.room_number})
+    if existing:
+        raise HTTPException(status_code=400, detail="Room number already exists")
+    
+    room = Room(**room_data.model_dump())
+    doc = room.model_dump()
+    doc["stays"] = []
+    await db.rooms.insert_one(doc)
+    dashboard_snapshot.room_status_changed(None, room.status)
+    await publish_change("room", "created", doc)
+    return room
+
+@api_router.put("/rooms/{room_id}", response_model=Room)
+async def update_room(room_id: str, room_data: RoomUpdate, current_user: User = Depends(get_admin_user)):
+    update_data = {k: v for k, v in room_data.model_dump().items() if v is not None}
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No data to update")
+    
+    result = await db.rooms.update_one({"id": room_id}, {"$set": update_data})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if "status" in update_data:
+        dashboard_snapshot.invalidate()
+    
+    room = await db.rooms.find_one({"id": room_id}, ROOM_PROJECTION)
+    await publish_change("room", "updated", room)
+    if isinstance(room.get('created_at'), str):
+        room['created_at'] = datetime.fromisoformat(room['created_at'])
+    return Room(**room)
+
+@api_router.delete("/rooms/{room_id}")
+async def delete_room(room_id: str, current_user: User = Depends(get_admin_user)):
+    room = await db.rooms.find_one_and_delete({"id": room_id}, projection={"_id": 0, "status": 1})
+    if room is None:
         raise HTTPException(status_code=404, detail="Room not found")
+    dashboard_snapshot.room_status_changed(room.get("status"), None)
+    await publish_change("room", "deleted", {"id": room_id})
     return {"message": "Room deleted"}
 
 # YANGI: Xonani tozalash holatiga o'tkazish
@@ -450,11 +2903,8 @@ async def mark_room_cleaning(room_id: str, current_user: User = Depends(get_curr
     """
     Xonani tozalash holatiga o'tkazish
     """
-    room = await db.rooms.find_one({"id": room_id}, {"_id": 0})
-    if not room:
+    if await set_room_status(room_id, "Cleaning") is None:
         raise HTTPException(status_code=404, detail="Room not found")
-    
-    await db.rooms.update_one({"id": room_id}, {"$set": {"status": "Cleaning"}})
     return {"message": "Room marked for cleaning"}
 
 # YANGI: Tozalash tugadi, xona bo'sh
@@ -463,11 +2913,8 @@ async def mark_room_available(room_id: str, current_user: User = Depends(get_cur
     """
     Tozalash tugadi - xona bo'sh
     """
-    room = await db.rooms.find_one({"id": room_id}, {"_id": 0})
-    if not room:
+    if await set_room_status(room_id, "Available") is None:
         raise HTTPException(status_code=404, detail="Room not found")
-    
-    await db.rooms.update_one({"id": room_id}, {"$set": {"status": "Available"}})
     return {"message": "Room is now available"}
 
 # Guest routes
@@ -478,33 +2925,49 @@ async def get_guests(
     sort_dir: Optional[str] = "desc",
     page: int = 1,
     limit: int = 100,
+    after: Optional[str] = None,
     current_user: User = Depends(get_current_user),
 ):
-    query = {}
-    if search:
-        query["$or"] = [
-            {"full_name": {"$regex": search, "$options": "i"}},
-            {"phone": {"$regex": search, "$options": "i"}},
-            {"passport_id": {"$regex": search, "$options": "i"}},
-        ]
+    page = max(page, 1)
+    limit = min(max(limit, 1), 1000)
+
+    if search and search.strip():
+        # Qidiruvda natijalar reyting bo'yicha (sort_by e'tiborga olinmaydi)
+        guests = await search_guests(search, limit=page * limit)
+        return list_response(Guest, guests[(page - 1) * limit:])
 
+    query = {}
     allowed_sort_fields = {"created_at", "full_name", "phone", "passport_id", "id_number"}
     actual_sort_by = sort_by if sort_by in allowed_sort_fields else "created_at"
     sort_direction = -1 if str(sort_dir).lower() != "asc" else 1
 
-    page = max(page, 1)
-    limit = min(max(limit, 1), 1000)
-    skip = (page - 1) * limit
+    guests, next_cursor = await find_page(
+        db.guests, query, actual_sort_by, sort_direction, page, limit, after, projection=GUEST_SEARCH_PROJECTION
+    )
+    return list_response(Guest, guests, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
 
-    cursor = db.guests.find(query, {"_id": 0}).sort(actual_sort_by, sort_direction).skip(skip).limit(limit)
-    guests = await cursor.to_list(limit)
-    for guest in guests:
-        if isinstance(guest.get('created_at'), str):
-            guest['created_at'] = datetime.fromisoformat(guest['created_at'])
-    return guests
+
+@api_router.get("/guests/search")
+async def search_guests_endpoint(
+    q: str,
+    limit: int = 20,
+    typeahead: bool = False,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Mehmon qidiruvi: ism (lotin/kirill), telefon, passport/ID raqami bo'yicha reyting bilan.
+    typeahead=true - faqat ro'yxat uchun kerakli maydonlar.
+    """
+    limit = min(max(limit, 1), 100)
+    projection = (
+        {"_id": 0, "id": 1, "full_name": 1, "phone": 1, "passport_id": 1, "id_number": 1}
+        if typeahead
+        else GUEST_SEARCH_PROJECTION
+    )
+    return await search_guests(q, limit=limit, projection=projection)
 
 
-@api_router.get("/guests/archive")
+@analytics_router.get("/guests/archive")
 async def get_guests_archive(
     q: Optional[str] = None,
     guest_id: Optional[str] = None,
@@ -512,134 +2975,42 @@ async def get_guests_archive(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     sort_by: str = "check_in_date",
-    sort_dir: str = "desc",
-    page: int = 1,
-    limit: int = 200,
-    current_user: User = Depends(get_current_user),
-):
-    """
-    Mehmonlar arxivi: har bir bron yozuvi guest bo'yicha flatten qilinadi.
-    """
-    page = max(page, 1)
-    limit = min(max(limit, 1), 1000)
-
-    booking_query = {}
-    normalized_status = normalize_booking_status(status)
-    if normalized_status and normalized_status.lower() != "all":
-        booking_query["status"] = normalized_status
-
-    if date_from and date_to:
-        booking_query["check_in_date"] = {"$gte": date_from, "$lte": date_to}
-    elif date_from:
-        booking_query["check_in_date"] = {"$gte": date_from}
-    elif date_to:
-        booking_query["check_in_date"] = {"$lte": date_to}
-
-    if guest_id:
-        booking_query["guest_ids"] = guest_id
-
-    bookings = await db.bookings.find(booking_query, {"_id": 0}).to_list(10000)
-
-    room_ids = {b.get("room_id") for b in bookings if b.get("room_id")}
-    guest_ids = set()
-    for booking in bookings:
-        for gid in booking.get("guest_ids", []):
-            if gid:
-                guest_ids.add(gid)
-
-    rooms = await db.rooms.find({"id": {"$in": list(room_ids)}} if room_ids else {}, {"_id": 0, "id": 1, "room_number": 1}).to_list(5000)
-    guests = await db.guests.find({"id": {"$in": list(guest_ids)}} if guest_ids else {}, {"_id": 0, "id": 1, "full_name": 1, "phone": 1, "passport_id": 1, "id_number": 1}).to_list(5000)
-    room_map = {r["id"]: r for r in rooms}
-    guest_map = {g["id"]: g for g in guests}
-
-    items = []
-    q_lower = q.strip().lower() if q else None
-    for booking in bookings:
-        booking_guest_ids = booking.get("guest_ids") or []
-        if not booking_guest_ids:
-            continue
-
-        room = room_map.get(booking.get("room_id"), {})
-        room_number = room.get("room_number", "Unknown")
-        nights = calculate_nights(booking.get("check_in_date"), booking.get("check_out_date"))
-        total_price = float(booking.get("total_price", 0) or 0)
-        share_price = total_price / len(booking_guest_ids) if booking_guest_ids else total_price
-
-        for gid in booking_guest_ids:
-            if guest_id and gid != guest_id:
-                continue
-
-            guest_doc = guest_map.get(gid, {})
-            item = {
-                "booking_id": booking.get("id"),
-                "guest_id": gid,
-                "guest_name": guest_doc.get("full_name", "Unknown"),
-                "guest_phone": guest_doc.get("phone"),
-                "guest_passport_id": guest_doc.get("passport_id") or guest_doc.get("id_number"),
-                "room_id": booking.get("room_id"),
-                "room_number": room_number,
-                "check_in_date": booking.get("check_in_date"),
-                "check_out_date": booking.get("check_out_date"),
-                "nights": nights,
-                "status": booking.get("status"),
-                "total_price": total_price,
-                "guest_share_price": share_price,
-                "checked_in_at": booking.get("checked_in_at"),
-                "checked_out_at": booking.get("checked_out_at"),
-                "created_at": booking.get("created_at"),
-            }
-
-            if q_lower:
-                haystack = " ".join([
-                    str(item.get("guest_name", "")),
-                    str(item.get("guest_phone", "")),
-                    str(item.get("room_number", "")),
-                    str(item.get("status", "")),
-                    str(item.get("check_in_date", "")),
-                    str(item.get("check_out_date", "")),
-                ]).lower()
-                if q_lower not in haystack:
-                    continue
-
-            items.append(item)
-
-    sort_key_map = {
-        "check_in_date": "check_in_date",
-        "check_out_date": "check_out_date",
-        "created_at": "created_at",
-        "total_amount": "total_price",
-        "total_price": "total_price",
-        "summa": "total_price",
-        "nights": "nights",
-        "room_number": "room_number",
-        "guest_name": "guest_name",
-        "status": "status",
-    }
-    actual_sort_key = sort_key_map.get(sort_by, "check_in_date")
-    reverse = str(sort_dir).lower() != "asc"
-
-    def sort_value(x):
-        val = x.get(actual_sort_key)
-        if val is None:
-            return ""
-        return val
+    sort_dir: str = "desc",
+    page: int = 1,
+    limit: int = 200,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Mehmonlar arxivi: har bir bron yozuvi guest bo'yicha flatten qilinadi.
+    """
+    page = max(page, 1)
+    limit = min(max(limit, 1), 1000)
 
-    items.sort(key=sort_value, reverse=reverse)
+    booking_query = build_archive_booking_query(status, date_from, date_to, guest_id)
 
-    total = len(items)
-    start = (page - 1) * limit
-    end = start + limit
+    pipeline = build_archive_pipeline(
+        booking_query,
+        guest_id=guest_id,
+        q=q,
+        sort_by=sort_by,
+        sort_dir=sort_dir,
+        skip=(page - 1) * limit,
+        limit=limit,
+    )
+    result = await read_db().bookings.aggregate(pipeline, allowDiskUse=True).to_list(1)
+    facet = result[0] if result else {}
+    total = facet.get("total") or []
 
     return {
-        "items": items[start:end],
-        "total": total,
+        "items": facet.get("items", []),
+        "total": total[0]["count"] if total else 0,
         "page": page,
         "limit": limit,
     }
 
 @api_router.get("/guests/{guest_id}", response_model=Guest)
 async def get_guest(guest_id: str, current_user: User = Depends(get_current_user)):
-    guest = await db.guests.find_one({"id": guest_id}, {"_id": 0})
+    guest = await db.guests.find_one({"id": guest_id}, GUEST_SEARCH_PROJECTION)
     if not guest:
         raise HTTPException(status_code=404, detail="Guest not found")
     if isinstance(guest.get('created_at'), str):
@@ -685,21 +3056,54 @@ async def get_guest_history(
 async def create_guest(guest_data: GuestCreate, current_user: User = Depends(get_current_user)):
     guest = Guest(**guest_data.model_dump())
     doc = guest.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
+    doc.update(guest_search_fields(doc))
     await db.guests.insert_one(doc)
+    await collection_versions.bump("guests")
     return guest
 
+@api_router.post("/guests/import")
+async def import_guests(
+    file: UploadFile = File(...),
+    import_format: Optional[str] = Query(None, alias="format"),
+    dry_run: bool = False,
+    current_user: User = Depends(get_admin_user),
+):
+    """
+    Mehmonlarni fayldan import qilish (CSV / JSON / NDJSON).
+    Format berilmasa - fayl kengaytmasidan. dry_run - faqat tekshirish, yozuvsiz.
+    """
+    fmt = (import_format or Path(file.filename or "").suffix.lstrip(".")).lower()
+    fmt = "ndjson" if fmt == "jsonl" else fmt
+    if fmt not in GUEST_IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported format. Use one of: {', '.join(sorted(GUEST_IMPORT_FORMATS))}"
+        )
+    
+    async def chunks():
+        while chunk := await file.read(GUEST_IMPORT_CHUNK_SIZE):
+            yield chunk
+    
+    try:
+        return await GuestImporter(dry_run=dry_run).run(iter_import_rows(chunks(), fmt))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid import file: {exc}")
+
 @api_router.put("/guests/{guest_id}", response_model=Guest)
 async def update_guest(guest_id: str, guest_data: GuestUpdate, current_user: User = Depends(get_current_user)):
     update_data = {k: v for k, v in guest_data.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
-    result = await db.guests.update_one({"id": guest_id}, {"$set": update_data})
-    if result.matched_count == 0:
+    guest = await db.guests.find_one_and_update(
+        {"id": guest_id}, {"$set": update_data}, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if guest is None:
         raise HTTPException(status_code=404, detail="Guest not found")
     
-    guest = await db.guests.find_one({"id": guest_id}, {"_id": 0})
+    search_fields = guest_search_fields(guest)
+    if search_fields != {field: guest.get(field) for field in search_fields}:
+        await db.guests.update_one({"id": guest_id}, {"$set": search_fields})
+    await collection_versions.bump("guests")
     if isinstance(guest.get('created_at'), str):
         guest['created_at'] = datetime.fromisoformat(guest['created_at'])
     return Guest(**guest)
@@ -712,61 +3116,34 @@ async def get_bookings(
     sort_dir: Optional[str] = "desc",
     page: int = 1,
     limit: int = 200,
+    after: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     query = {}
     if status:
         query["status"] = status
 
-    allowed_sort_fields = {
-        "created_at",
-        "check_in_date",
-        "check_out_date",
-        "total_price",
-        "status",
-    }
-    actual_sort_by = sort_by if sort_by in allowed_sort_fields else "created_at"
+    actual_sort_by = sort_by if sort_by in BOOKING_SORT_FIELDS else "created_at"
     sort_direction = -1 if str(sort_dir).lower() != "asc" else 1
 
     page = max(page, 1)
     limit = min(max(limit, 1), 1000)
-    skip = (page - 1) * limit
 
-    cursor = (
-        db.bookings.find(query, {"_id": 0})
-        .sort(actual_sort_by, sort_direction)
-        .skip(skip)
-        .limit(limit)
-    )
-    bookings = await cursor.to_list(limit)
-    for booking in bookings:
-        if isinstance(booking.get('created_at'), str):
-            booking['created_at'] = datetime.fromisoformat(booking['created_at'])
-        
-        # Mehmonlar ismlari
-        guest_names = []
-        for guest_id in booking.get("guest_ids", []):
-            guest = await db.guests.find_one({"id": guest_id}, {"_id": 0})
-            if guest:
-                guest_names.append(guest["full_name"])
-        booking["guest_names"] = guest_names
-        
-        room = await db.rooms.find_one({"id": booking["room_id"]}, {"_id": 0})
-        booking["room_number"] = room["room_number"] if room else "Unknown"
-    return bookings
+    bookings, next_cursor = await find_page(db.bookings, query, actual_sort_by, sort_direction, page, limit, after)
+    
+    # Mehmonlar ismlari va xona raqamlari
+    await enrich_bookings(bookings)
+    return list_response(Booking, bookings, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
 
 @api_router.post("/bookings", response_model=Booking)
 async def create_booking(booking_data: BookingCreate, current_user: User = Depends(get_current_user)):
     """
     Yangi bron yaratish - Ko'p mehmonlar bilan
     """
-    room = await db.rooms.find_one({"id": booking_data.room_id}, {"_id": 0})
+    room = await db.rooms.find_one({"id": booking_data.room_id}, ROOM_PROJECTION)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    if room["status"] not in ["Available"]:
-        raise HTTPException(status_code=400, detail="Room is not available")
-    
     # Mehmonlar sonini tekshirish
     if len(booking_data.guest_ids) > room["capacity"]:
         raise HTTPException(
@@ -774,10 +3151,10 @@ async def create_booking(booking_data: BookingCreate, current_user: User = Depen
             detail=f"Xona sig'imi: {room['capacity']} kishi. Siz {len(booking_data.guest_ids)} mehmon tanladingiz."
         )
     
-    try:
-        check_in = datetime.strptime(booking_data.check_in_date, "%Y-%m-%d")
-        check_out = datetime.strptime(booking_data.check_out_date, "%Y-%m-%d")
-    except ValueError:
+    # Faqat kanonik "YYYY-MM-DD": stays va hisobotlar sanalarni satr sifatida solishtiradi
+    check_in = parse_iso_day(booking_data.check_in_date)
+    check_out = parse_iso_day(booking_data.check_out_date)
+    if not check_in or not check_out:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
     nights = (check_out - check_in).days
@@ -789,53 +3166,191 @@ async def create_booking(booking_data: BookingCreate, current_user: User = Depen
     booking = Booking(
         guest_ids=booking_data.guest_ids,
         room_id=booking_data.room_id,
-        check_in_date=booking_data.check_in_date,
-        check_out_date=booking_data.check_out_date,
+        check_in_date=check_in.strftime("%Y-%m-%d"),
+        check_out_date=check_out.strftime("%Y-%m-%d"),
         total_price=total_price,
         status="Confirmed",
         checked_in_at=None,
         checked_out_at=None
     )
+    
+    # Sanalar kesishishi xona hujjatida atomar tekshiriladi (xona holati emas)
+    if not await reserve_room_stay(room["id"], booking.id, booking.check_in_date, booking.check_out_date):
+        raise await room_unavailable_error(room["id"], booking.check_in_date, booking.check_out_date)
+    
     doc = booking.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
-    await db.bookings.insert_one(doc)
+    try:
+        await db.bookings.insert_one(doc)
+    except Exception:
+        await release_room_stay(room["id"], booking.id)
+        raise
+    dashboard_snapshot.upcoming_changed(1)
+    await publish_change("booking", "created", doc)
     
-    await db.rooms.update_one({"id": booking_data.room_id}, {"$set": {"status": "Reserved"}})
+    # Oldindan bron xona holatini o'zgartirmaydi - faqat bugungi yoki o'tgan sana uchun
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if booking.check_in_date <= today:
+        await set_room_status(booking_data.room_id, "Reserved", expected_status="Available")
     
     # Mehmonlar ismlari
-    guest_names = []
-    for guest_id in booking_data.guest_ids:
-        guest = await db.guests.find_one({"id": guest_id}, {"_id": 0})
-        if guest:
-            guest_names.append(guest["full_name"])
-    
     booking_dict = booking.model_dump()
-    booking_dict["guest_names"] = guest_names
-    booking_dict["room_number"] = room["room_number"]
+    await enrich_bookings([booking_dict], rooms_by_id={room["id"]: room})
     return Booking(**booking_dict)
 
+@api_router.post("/bookings/bulk")
+async def create_bookings_bulk(bulk_data: BulkBookingCreate, current_user: User = Depends(get_current_user)):
+    """
+    Guruh bronlari: ko'p xonaga bitta so'rovda bron.
+    Har bir element uchun alohida natija - muvaffaqiyatsizlari qolganlarini to'xtatmaydi.
+    """
+    items = bulk_data.bookings
+    results = [None] * len(items)
+    
+    room_ids = {item.room_id for item in items}
+    guest_ids = {gid for item in items for gid in item.guest_ids}
+    rooms = await db.rooms.find({"id": {"$in": list(room_ids)}}, ROOM_PROJECTION).to_list(len(room_ids))
+    rooms_by_id = {room["id"]: room for room in rooms}
+    found_guests = await db.guests.find(
+        {"id": {"$in": list(guest_ids)}}, {"_id": 0, "id": 1}
+    ).to_list(len(guest_ids)) if guest_ids else []
+    found_guest_ids = {guest["id"] for guest in found_guests}
+    
+    def fail(index: int, detail: str):
+        results[index] = {"index": index, "status": "error", "detail": detail}
+    
+    # 1) Har bir elementni tekshirish (xona, sig'im, mehmonlar, sanalar)
+    pending = []
+    for index, item in enumerate(items):
+        room = rooms_by_id.get(item.room_id)
+        if not room:
+            fail(index, "Room not found")
+            continue
+        if len(item.guest_ids) > room["capacity"]:
+            fail(index, f"Xona sig'imi: {room['capacity']} kishi. Siz {len(item.guest_ids)} mehmon tanladingiz.")
+            continue
+        missing = [gid for gid in item.guest_ids if gid not in found_guest_ids]
+        if missing:
+            fail(index, f"Guest not found: {', '.join(missing)}")
+            continue
+        nights = calculate_nights(item.check_in_date, item.check_out_date)
+        if nights is None:
+            fail(index, "Invalid date format. Use YYYY-MM-DD")
+            continue
+        if nights <= 0:
+            fail(index, "Check-out date must be after check-in date")
+            continue
+        booking = Booking(
+            guest_ids=item.guest_ids,
+            room_id=item.room_id,
+            check_in_date=item.check_in_date,
+            check_out_date=item.check_out_date,
+            total_price=room["price_per_night"] * nights,
+            status="Confirmed",
+            checked_in_at=None,
+            checked_out_at=None
+        )
+        pending.append((index, booking))
+    
+    # 2) Barcha xonalarga stay larni bitta bulk_write da qo'shish (har biri kesishishsiz sharti bilan).
+    # Har bir update alohida atomar - so'rov ichida kesishgan elementlardan faqat bittasi o'tadi.
+    stays_by_room = {}
+    if pending:
+        await db.rooms.bulk_write([
+            UpdateOne(
+                {"id": booking.room_id, **stay_free_filter(booking.check_in_date, booking.check_out_date)},
+                {"$push": {"stays": room_stay(booking.id, booking.check_in_date, booking.check_out_date)}},
+            )
+            for _, booking in pending
+        ], ordered=False)
+        stays_by_room = {
+            room["id"]: room.get("stays") or []
+            for room in await db.rooms.find(
+                {"id": {"$in": list({booking.room_id for _, booking in pending})}},
+                {"_id": 0, "id": 1, "stays": 1},
+            ).to_list(None)
+        }
+    
+    reserved = []
+    for index, booking in pending:
+        stays = stays_by_room.get(booking.room_id, [])
+        if any(stay["booking_id"] == booking.id for stay in stays):
+            reserved.append((index, booking))
+            continue
+        conflict = next((
+            stay for stay in stays
+            if stay["check_in_date"] < booking.check_out_date and stay["check_out_date"] > booking.check_in_date
+        ), None)
+        fail(index, (
+            f"Room is already booked from {conflict['check_in_date']} to {conflict['check_out_date']}"
+            if conflict else "Room is already booked for these dates"
+        ))
+    
+    # 3) Bronlarni bitta insert_many bilan yozish; yozilmaganlarning stay lari qaytariladi
+    failed_inserts = set()
+    if reserved:
+        try:
+            await db.bookings.insert_many([booking.model_dump() for _, booking in reserved], ordered=False)
+        except BulkWriteError as exc:
+            failed_inserts = {error["index"] for error in exc.details.get("writeErrors", [])}
+            await db.rooms.bulk_write([
+                UpdateOne({"id": reserved[i][1].room_id}, {"$pull": {"stays": {"booking_id": reserved[i][1].id}}})
+                for i in failed_inserts
+            ], ordered=False)
+    
+    created = []
+    for position, (index, booking) in enumerate(reserved):
+        if position in failed_inserts:
+            fail(index, "Failed to save booking")
+        else:
+            created.append((index, booking.model_dump()))
+    
+    if created:
+        dashboard_snapshot.upcoming_changed(len(created))
+        for _, doc in created:
+            await publish_change("booking", "created", doc)
+        # Oldindan bron xona holatini o'zgartirmaydi - faqat bugungi yoki o'tgan sana uchun
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        arriving_room_ids = {doc["room_id"] for _, doc in created if doc["check_in_date"] <= today}
+        await asyncio.gather(*(
+            set_room_status(room_id, "Reserved", expected_status="Available") for room_id in arriving_room_ids
+        ))
+        
+        docs = [doc for _, doc in created]
+        await enrich_bookings(docs, rooms_by_id=rooms_by_id)
+        for (index, _), row in zip(created, model_rows(Booking, docs)):
+            results[index] = {"index": index, "status": "created", "booking": row}
+    
+    return {
+        "created": len(created),
+        "failed": len(items) - len(created),
+        "results": results,
+    }
+
 @api_router.post("/bookings/{booking_id}/checkin")
 async def checkin_booking(booking_id: str, current_user: User = Depends(get_current_user)):
     """
     Check-in: Confirmed -> Checked In
     """
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
-    
-    if booking["status"] != "Confirmed":
-        raise HTTPException(status_code=400, detail="Booking must be Confirmed to check-in")
-    
     now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    await db.bookings.update_one(
-        {"id": booking_id}, 
+    booking = await db.bookings.find_one_and_update(
+        {"id": booking_id, "status": "Confirmed"},
         {"$set": {
             "status": "Checked In",
             "checked_in_at": now
-        }}
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE,
     )
-    await db.rooms.update_one({"id": booking["room_id"]}, {"$set": {"status": "Occupied"}})
+    if booking is None:
+        raise await booking_transition_error(booking_id, "Booking must be Confirmed to check-in")
+    
+    dashboard_snapshot.upcoming_changed(-1)
+    dashboard_snapshot.income_added(now, booking["total_price"])
+    room = await set_room_status(booking["room_id"], "Occupied")
+    await apply_rollup_delta(now, checkin_rollup_delta(booking, room.get("room_type") if room else None))
+    # ETag versiyasi oxirgi yozuvdan keyin - aks holda hisobot eski rollup ni yangi ETag bilan beradi
+    await publish_change("booking", "status", {**booking, "status": "Checked In"}, previous_status="Confirmed")
     
     return {"message": "Check-in successful"}
 
@@ -845,24 +3360,25 @@ async def checkout_booking(booking_id: str, current_user: User = Depends(get_cur
     Check-out: Checked In -> Checked Out
     Xona: Occupied -> Cleaning (YANGI!)
     """
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
-    
-    if booking["status"] != "Checked In":
-        raise HTTPException(status_code=400, detail="Booking must be Checked In to check-out")
-    
     now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    await db.bookings.update_one(
-        {"id": booking_id}, 
+    booking = await db.bookings.find_one_and_update(
+        {"id": booking_id, "status": "Checked In"},
         {"$set": {
             "status": "Checked Out",
             "checked_out_at": now
-        }}
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE,
     )
+    if booking is None:
+        raise await booking_transition_error(booking_id, "Booking must be Checked In to check-out")
+    
+    await release_room_stay(booking["room_id"], booking_id)
     # YANGI: Check-out qilganda xona tozalash holatiga o'tadi
-    await db.rooms.update_one({"id": booking["room_id"]}, {"$set": {"status": "Cleaning"}})
+    await set_room_status(booking["room_id"], "Cleaning")
+    await apply_rollup_delta(now, {"check_outs": 1})
+    await publish_change("booking", "status", {**booking, "status": "Checked Out"}, previous_status="Checked In")
     
     return {"message": "Check-out successful. Room marked for cleaning", "total_price": booking["total_price"]}
 
@@ -875,26 +3391,33 @@ async def update_booking(booking_id: str, booking_data: BookingUpdate, current_u
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    if booking["status"] not in ["Confirmed", "Checked In"]:
+    if booking["status"] not in ACTIVE_BOOKING_STATUSES:
         raise HTTPException(status_code=400, detail="Cannot update completed or cancelled booking")
     
     new_check_in = booking_data.check_in_date or booking["check_in_date"]
     new_check_out = booking_data.check_out_date or booking["check_out_date"]
     
-    try:
-        check_in = datetime.strptime(new_check_in, "%Y-%m-%d")
-        check_out = datetime.strptime(new_check_out, "%Y-%m-%d")
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format")
+    check_in = parse_iso_day(new_check_in)
+    check_out = parse_iso_day(new_check_out)
+    if not check_in or not check_out:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    new_check_in, new_check_out = check_in.strftime("%Y-%m-%d"), check_out.strftime("%Y-%m-%d")
     
     nights = (check_out - check_in).days
     if nights <= 0:
         raise HTTPException(status_code=400, detail="Invalid date range")
     
-    room = await db.rooms.find_one({"id": booking["room_id"]}, {"_id": 0})
+    room = await db.rooms.find_one({"id": booking["room_id"]}, ROOM_PROJECTION)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
+    # stays da hali yo'q bron (masalan, backfill dan oldin yaratilgan) - qo'shiladi
+    if not (
+        await move_room_stay(room["id"], booking_id, new_check_in, new_check_out)
+        or await reserve_room_stay(room["id"], booking_id, new_check_in, new_check_out)
+    ):
+        raise await room_unavailable_error(room["id"], new_check_in, new_check_out, exclude_booking_id=booking_id)
+    
     new_total_price = room["price_per_night"] * nights
     
     update_data = {
@@ -903,21 +3426,38 @@ async def update_booking(booking_id: str, booking_data: BookingUpdate, current_u
         "total_price": new_total_price
     }
     
-    await db.bookings.update_one({"id": booking_id}, {"$set": update_data})
+    # O'qilgan holat va sanalar o'zgarmagan bo'lsagina yoziladi
+    updated_booking = await db.bookings.find_one_and_update(
+        {
+            "id": booking_id,
+            "status": booking["status"],
+            "check_in_date": booking["check_in_date"],
+            "check_out_date": booking["check_out_date"],
+        },
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated_booking is None:
+        await sync_room_stay(room["id"], booking_id)
+        raise HTTPException(status_code=409, detail="Booking was modified concurrently, please retry")
+    
+    if booking["status"] == "Checked In":
+        # Bugungi daromad o'zgargan bo'lishi mumkin
+        dashboard_snapshot.invalidate()
+        old_delta = checkin_rollup_delta(booking, None)
+        new_delta = checkin_rollup_delta({**booking, **update_data}, None)
+        await apply_rollup_delta(booking.get("checked_in_at"), {
+            "income": new_delta["income"] - old_delta["income"],
+            "occupied_nights": new_delta["occupied_nights"] - old_delta["occupied_nights"],
+        })
+    await publish_change("booking", "updated", updated_booking)
     
-    updated_booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
     if isinstance(updated_booking.get('created_at'), str):
         updated_booking['created_at'] = datetime.fromisoformat(updated_booking['created_at'])
     
     # Mehmonlar ismlari
-    guest_names = []
-    for guest_id in updated_booking.get("guest_ids", []):
-        guest = await db.guests.find_one({"id": guest_id}, {"_id": 0})
-        if guest:
-            guest_names.append(guest["full_name"])
-    
-    updated_booking["guest_names"] = guest_names
-    updated_booking["room_number"] = room["room_number"]
+    await enrich_bookings([updated_booking], rooms_by_id={room["id"]: room})
     
     return Booking(**updated_booking)
 
@@ -926,126 +3466,289 @@ async def delete_booking(booking_id: str, current_user: User = Depends(get_curre
     """
     Bronni bekor qilish
     """
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    # Oldingi holat atomar olinadi - parallel bekor qilishlar hisoblagichlarni ikki marta o'zgartirmaydi
+    booking = await db.bookings.find_one_and_update(
+        {"id": booking_id},
+        {"$set": {"status": "Cancelled"}},
+        projection={"_id": 0, "room_id": 1, "status": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    if booking["status"] == "Confirmed":
-        await db.rooms.update_one({"id": booking["room_id"]}, {"$set": {"status": "Available"}})
+    if booking["status"] in ACTIVE_BOOKING_STATUSES:
+        await release_room_stay(booking["room_id"], booking_id)
     
-    await db.bookings.update_one({"id": booking_id}, {"$set": {"status": "Cancelled"}})
+    if booking["status"] == "Confirmed":
+        dashboard_snapshot.upcoming_changed(-1)
+        # Xonada bugun uchun boshqa bron bo'lmasa - bo'sh
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%Y-%m-%d")
+        if not await find_conflicting_booking(booking["room_id"], today, tomorrow):
+            await set_room_status(booking["room_id"], "Available", expected_status="Reserved")
+    if booking["status"] != "Cancelled":
+        await publish_change(
+            "booking", "status", {**booking, "id": booking_id, "status": "Cancelled"}, previous_status=booking["status"]
+        )
     
     return {"message": "Booking cancelled successfully"}
 
+# Kalendar: sana oralig'i bo'yicha xonalar bandligi
+CALENDAR_MAX_DAYS = 370
+
+
+@api_router.get("/calendar")
+async def get_calendar(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    include_cancelled: bool = False,
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("rooms", "bookings", "guests")),
+):
+    """
+    Har bir xona uchun [from, to) oralig'iga tushadigan bronlar (kesilgan holda)
+    """
+    today = datetime.now(timezone.utc)
+    if not date_from:
+        date_from = today.strftime("%Y-%m-01")
+    start = parse_iso_day(date_from)
+    if not start:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if not date_to:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        date_to = next_month.strftime("%Y-%m-%d")
+    end = parse_iso_day(date_to)
+    if not end:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if (end - start).days > CALENDAR_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range cannot exceed {CALENDAR_MAX_DAYS} days")
+
+    rooms = await db.rooms.find({}, ROOM_PROJECTION).sort("room_number", 1).to_list(None)
+
+    # Oraliq bilan kesishish: check_in < to va check_out > from
+    booking_query = {"check_out_date": {"$gt": date_from}, "check_in_date": {"$lt": date_to}}
+    if not include_cancelled:
+        booking_query["status"] = {"$ne": "Cancelled"}
+    bookings = await db.bookings.find(
+        booking_query,
+        {
+            "_id": 0, "id": 1, "room_id": 1, "guest_ids": 1, "status": 1,
+            "check_in_date": 1, "check_out_date": 1, "total_price": 1,
+            "checked_in_at": 1, "checked_out_at": 1,
+        },
+    ).sort("check_in_date", 1).to_list(None)
+    await enrich_bookings(bookings, rooms_by_id={room["id"]: room for room in rooms})
+
+    intervals_by_room = {}
+    for booking in bookings:
+        booking["start"] = max(booking["check_in_date"], date_from)
+        booking["end"] = min(booking["check_out_date"], date_to)
+        booking["nights"] = calculate_nights(booking["check_in_date"], booking["check_out_date"])
+        intervals_by_room.setdefault(booking.get("room_id"), []).append(booking)
+
+    return {
+        "from": date_from,
+        "to": date_to,
+        "rooms": [
+            {
+                "room_id": room["id"],
+                "room_number": room.get("room_number"),
+                "room_type": room.get("room_type"),
+                "capacity": room.get("capacity"),
+                "price_per_night": room.get("price_per_night"),
+                "status": room.get("status"),
+                "bookings": intervals_by_room.get(room["id"], []),
+            }
+            for room in rooms
+        ],
+    }
+
 # Dashboard route - YANGILANGAN
+async def compute_dashboard_stats(today: str) -> dict:
+    """
+    Dashboard statistikasi: xona holatlari bitta $group, bugungi daromad server tomonda $sum
+    """
+    room_counts_task = db.rooms.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    income_task = db.bookings.aggregate([
+        {"$match": {"$or": [
+            {"checked_in_at": today},
+            # Eski yozuvlar: checked_in_at saqlanmagan
+            {"check_in_date": today, "status": "Checked In", "checked_in_at": None},
+        ]}},
+        {"$group": {"_id": None, "total": {"$sum": "$total_price"}}},
+    ]).to_list(1)
+    upcoming_task = db.bookings.count_documents({"status": "Confirmed"})
+    room_counts, income, upcoming_reservations = await asyncio.gather(
+        room_counts_task, income_task, upcoming_task
+    )
+    return {
+        "room_status_counts": {row["_id"]: row["count"] for row in room_counts},
+        "today_income": income[0]["total"] if income else 0,
+        "upcoming_reservations": upcoming_reservations,
+    }
+
+
 @api_router.get("/dashboard/stats", response_model=DashboardStats)
-async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    total_rooms = await db.rooms.count_documents({})
-    available_rooms = await db.rooms.count_documents({"status": "Available"})
-    occupied_rooms = await db.rooms.count_documents({"status": "Occupied"})
-    cleaning_rooms = await db.rooms.count_documents({"status": "Cleaning"})  # YANGI
-    
+async def get_dashboard_stats(
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("rooms", "bookings")),
+):
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    today_checkins = await db.bookings.find({"checked_in_at": today}, {"_id": 0}).to_list(1000)
-    legacy_checkins = await db.bookings.find({
-        "check_in_date": today,
-        "status": "Checked In",
-        "$or": [
-            {"checked_in_at": None},
-            {"checked_in_at": {"$exists": False}}
-        ]
-    }, {"_id": 0}).to_list(1000)
+    stats = dashboard_snapshot.get(today)
+    if stats is None:
+        stats = await compute_dashboard_stats(today)
+        dashboard_snapshot.set(today, stats)
     
-    all_today_checkins = today_checkins + legacy_checkins
-    today_income = sum(booking["total_price"] for booking in all_today_checkins)
+    counts = stats["room_status_counts"]
+    return DashboardStats(
+        total_rooms=sum(counts.values()),
+        available_rooms=counts.get("Available", 0),
+        occupied_rooms=counts.get("Occupied", 0),
+        cleaning_rooms=counts.get("Cleaning", 0),
+        today_income=stats["today_income"],
+        upcoming_reservations=stats["upcoming_reservations"]
+    )
+
+# Metrikalar (Prometheus matn formati)
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    # METRICS_TOKEN berilsa - scraper shu token bilan keladi (foydalanuvchi JWT si emas)
+    if METRICS_TOKEN and (credentials is None or not hmac.compare_digest(credentials.credentials, METRICS_TOKEN)):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Mongo profiler: eng qimmat so'rov shakllari
+@api_router.get("/admin/mongo-profile")
+async def get_mongo_profile(
+    limit: int = Query(20, ge=1, le=500),
+    sort_by: str = "total_ms",
+    current_user: User = Depends(get_admin_user),
+):
+    return mongo_profiler.report(limit, sort_by)
+
+@api_router.delete("/admin/mongo-profile")
+async def reset_mongo_profile(current_user: User = Depends(get_admin_user)):
+    mongo_profiler.reset()
+    return {"message": "Mongo profile reset"}
+
+# Jonli hodisalar (Server-Sent Events)
+@api_router.get("/events")
+async def stream_events(request: Request, current_user: User = Depends(get_stream_user)):
+    """
+    Xona, bron va chiqim o'zgarishlari oqimi. Qayta ulanishda Last-Event-ID bo'yicha
+    o'tkazib yuborilgan hodisalar yuboriladi; tarix yetmasa - "reset" (to'liq qayta yuklash).
+    """
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    subscription, replay, reset = event_broker.subscribe(last_event_id)
+    reset_event = {"id": f"{event_broker.epoch}-{event_broker.seq}", "type": "reset", "data": {}}
     
-    upcoming_reservations = await db.bookings.count_documents({"status": "Confirmed"})
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if reset:
+                yield format_sse(reset_event)
+            for event in replay:
+                yield format_sse(event)
+            while not await request.is_disconnected():
+                if subscription.overflowed and subscription.queue.empty():
+                    yield format_sse({**reset_event, "id": f"{event_broker.epoch}-{event_broker.seq}"})
+                    return
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            event_broker.unsubscribe(subscription)
     
-    return DashboardStats(
-        total_rooms=total_rooms,
-        available_rooms=available_rooms,
-        occupied_rooms=occupied_rooms,
-        cleaning_rooms=cleaning_rooms,
-        today_income=today_income,
-        upcoming_reservations=upcoming_reservations
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 # Reports routes
-@api_router.get("/reports/daily", response_model=DailyReport)
-async def get_daily_report(date: Optional[str] = None, current_user: User = Depends(get_current_user)):
+@analytics_router.post("/reports/query")
+async def query_report(query: ReportQuery, current_user: User = Depends(get_current_user)):
+    """
+    Ixtiyoriy hisobot: o'lchovlar x kesimlar, bitta aggregation so'rovi
+    """
+    return await run_report(query)
+
+@analytics_router.get("/reports/daily", response_model=DailyReport)
+async def get_daily_report(
+    date: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("bookings")),
+):
     target_date = date if date else datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    check_ins = await db.bookings.count_documents({"checked_in_at": target_date})
-    check_outs = await db.bookings.count_documents({"checked_out_at": target_date})
-    
-    bookings = await db.bookings.find({"checked_in_at": target_date}, {"_id": 0}).to_list(1000)
-    total_revenue = sum(booking["total_price"] for booking in bookings)
-    
-    guests_today = check_ins
+    rows = await run_report(ReportQuery(
+        measures=["check_ins", "check_outs", "revenue"], date_from=target_date, date_to=target_date
+    ))
+    totals = rows[0] if rows else {}
+    check_ins = totals.get("check_ins", 0)
     
     return DailyReport(
         date=target_date,
-        guests_today=guests_today,
+        guests_today=check_ins,
         check_ins=check_ins,
-        check_outs=check_outs,
-        total_revenue=total_revenue
+        check_outs=totals.get("check_outs", 0),
+        total_revenue=totals.get("revenue", 0)
     )
 
-@api_router.get("/reports/monthly", response_model=MonthlyReport)
-async def get_monthly_report(month: Optional[str] = None, current_user: User = Depends(get_current_user)):
+@analytics_router.get("/reports/monthly", response_model=MonthlyReport)
+async def get_monthly_report(
+    month: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("rooms", "bookings")),
+):
     target_month = month if month else datetime.now(timezone.utc).strftime("%Y-%m")
+    try:
+        date_from, date_to = month_days(target_month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid month format. Use YYYY-MM")
     
-    bookings = await db.bookings.find(
-        {"checked_in_at": {"$regex": f"^{target_month}"}}, 
-        {"_id": 0}
-    ).to_list(1000)
-    
-    total_guests = len(bookings)
-    total_income = sum(booking["total_price"] for booking in bookings)
-    
-    total_occupied_days = 0
-    for booking in bookings:
-        try:
-            check_in = datetime.strptime(booking["check_in_date"], "%Y-%m-%d")
-            check_out = datetime.strptime(booking["check_out_date"], "%Y-%m-%d")
-            total_occupied_days += (check_out - check_in).days
-        except:
-            pass
-    
-    room_type_counts = {}
-    for booking in bookings:
-        room = await db.rooms.find_one({"id": booking["room_id"]}, {"_id": 0})
-        if room:
-            room_type = room["room_type"]
-            room_type_counts[room_type] = room_type_counts.get(room_type, 0) + 1
-    
-    most_used_room_type = max(room_type_counts, key=room_type_counts.get) if room_type_counts else "N/A"
+    totals_rows, room_type_rows = await asyncio.gather(
+        run_report(ReportQuery(measures=["check_ins", "nights", "revenue"], date_from=date_from, date_to=date_to)),
+        run_report(ReportQuery(
+            measures=["check_ins"], dimensions=["room_type"], date_from=date_from, date_to=date_to,
+            sort_by="check_ins", sort_dir="desc", limit=1,
+        )),
+    )
+    totals = totals_rows[0] if totals_rows else {}
     
     return MonthlyReport(
         month=target_month,
-        total_guests=total_guests,
-        total_occupied_days=total_occupied_days,
-        total_income=total_income,
-        most_used_room_type=most_used_room_type
+        total_guests=totals.get("check_ins", 0),
+        total_occupied_days=totals.get("nights", 0),
+        total_income=totals.get("revenue", 0),
+        most_used_room_type=room_type_rows[0]["room_type"] if room_type_rows else "N/A"
     )
 
-@api_router.get("/reports/revenue")
-async def get_revenue_data(year: int = datetime.now().year, current_user: User = Depends(get_current_user)):
+@analytics_router.get("/reports/revenue")
+async def get_revenue_data(
+    year: int = datetime.now().year,
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("bookings")),
+):
+    rows = await run_report(ReportQuery(
+        measures=["revenue"], dimensions=["month"], date_from=f"{year}-01-01", date_to=f"{year}-12-31"
+    ))
+    income_by_month = {row["month"]: row["revenue"] for row in rows}
+    
     monthly_data = []
     for month in range(1, 13):
         month_str = f"{year}-{month:02d}"
-        
-        bookings = await db.bookings.find(
-            {"checked_in_at": {"$regex": f"^{month_str}"}}, 
-            {"_id": 0}
-        ).to_list(1000)
-        
-        total_income = sum(booking["total_price"] for booking in bookings)
-        
         monthly_data.append({
             "month": datetime(year, month, 1).strftime("%B"),
-            "revenue": total_income
+            "revenue": income_by_month.get(month_str, 0)
         })
     return monthly_data
 
@@ -1055,7 +3758,14 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Mongo-Ops"],
 )
+app.add_middleware(ETagMiddleware)
+
+
+@app.exception_handler(NotModified)
+async def not_modified_handler(request: Request, exc: NotModified):
+    return Response(status_code=304, headers={"ETag": exc.etag, "Cache-Control": "no-cache"})
 
 logging.basicConfig(
     level=logging.INFO,
@@ -1065,7 +3775,11 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if getattr(app.state, "change_stream_task", None):
+        app.state.change_stream_task.cancel()
     client.close()
+    analytics_client.close()
+    password_executor.shutdown(wait=False)
 
 
 # ============== YANGI: Chiqimlar (Expenses) Routes ==============
@@ -1080,17 +3794,7 @@ async def get_expenses(
     """
     Barcha chiqimlarni olish (filter bilan)
     """
-    query = {}
-    
-    if category and category != "all":
-        query["category"] = category
-    
-    if date_from and date_to:
-        query["date"] = {"$gte": date_from, "$lte": date_to}
-    elif date_from:
-        query["date"] = {"$gte": date_from}
-    elif date_to:
-        query["date"] = {"$lte": date_to}
+    query = build_expense_query(date_from, date_to, category)
     
     expenses = await db.expenses.find(query, {"_id": 0}).sort("date", -1).to_list(5000)
     
@@ -1118,6 +3822,8 @@ async def create_expense(
     Yangi chiqim qo'shish
     """
     expense_date = expense_data.date or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not parse_iso_day(expense_date):
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
     expense = Expense(
         title=expense_data.title,
@@ -1129,8 +3835,9 @@ async def create_expense(
     )
     
     doc = expense.model_dump()
-    doc["created_at"] = doc["created_at"].isoformat()
     await db.expenses.insert_one(doc)
+    await apply_rollup_delta(expense.date, expense_rollup_delta(doc))
+    await publish_change("expense", "created", doc)
     
     # Return the Pydantic model (without MongoDB's _id/ObjectId) to avoid JSON serialization errors.
     return expense
@@ -1147,12 +3854,20 @@ async def update_expense(
     update_data = {k: v for k, v in expense_data.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
+    if "date" in update_data and not parse_iso_day(update_data["date"]):
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
-    result = await db.expenses.update_one({"id": expense_id}, {"$set": update_data})
-    if result.matched_count == 0:
+    old_expense = await db.expenses.find_one_and_update(
+        {"id": expense_id}, {"$set": update_data}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if old_expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
     
-    expense = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
+    expense = {**old_expense, **update_data}
+    if {"amount", "category", "date"} & set(update_data):
+        await apply_rollup_delta(old_expense.get("date"), expense_rollup_delta(old_expense, sign=-1))
+        await apply_rollup_delta(expense.get("date"), expense_rollup_delta(expense))
+    await publish_change("expense", "updated", expense)
     if isinstance(expense.get('created_at'), str):
         expense['created_at'] = datetime.fromisoformat(expense['created_at'])
     return expense
@@ -1162,46 +3877,37 @@ async def delete_expense(expense_id: str, current_user: User = Depends(get_curre
     """
     Chiqimni o'chirish
     """
-    result = await db.expenses.delete_one({"id": expense_id})
-    if result.deleted_count == 0:
+    expense = await db.expenses.find_one_and_delete({"id": expense_id}, projection={"_id": 0})
+    if expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
+    await apply_rollup_delta(expense.get("date"), expense_rollup_delta(expense, sign=-1))
+    await publish_change("expense", "deleted", expense)
     return {"message": "Expense deleted successfully"}
 
-@api_router.get("/expenses/summary/stats")
+@analytics_router.get("/expenses/summary/stats")
 async def get_expense_summary(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("bookings", "expenses")),
 ):
     """
     Chiqimlar va daromadlar umumiy statistikasi
     """
-    expense_query = {}
-    booking_query = {}
-    
-    if date_from and date_to:
-        expense_query["date"] = {"$gte": date_from, "$lte": date_to}
-        booking_query["checked_in_at"] = {"$gte": date_from, "$lte": date_to}
-    elif date_from:
-        expense_query["date"] = {"$gte": date_from}
-        booking_query["checked_in_at"] = {"$gte": date_from}
-    elif date_to:
-        expense_query["date"] = {"$lte": date_to}
-        booking_query["checked_in_at"] = {"$lte": date_to}
-    
-    # Chiqimlar
-    expenses = await db.expenses.find(expense_query, {"_id": 0}).to_list(5000)
-    total_expenses = sum(e["amount"] for e in expenses)
+    totals_rows, category_rows = await asyncio.gather(
+        run_report(ReportQuery(
+            measures=["revenue", "expenses", "expense_count"], date_from=date_from, date_to=date_to
+        )),
+        run_report(ReportQuery(
+            measures=["expenses"], dimensions=["category"], date_from=date_from, date_to=date_to
+        )),
+    )
+    totals = totals_rows[0] if totals_rows else {}
+    total_expenses = totals.get("expenses", 0)
+    total_income = totals.get("revenue", 0)
     
     # Kategoriya bo'yicha
-    expenses_by_category = {}
-    for e in expenses:
-        cat = e.get("category", "Boshqa")
-        expenses_by_category[cat] = expenses_by_category.get(cat, 0) + e["amount"]
-    
-    # Daromad
-    bookings = await db.bookings.find(booking_query, {"_id": 0}).to_list(5000)
-    total_income = sum(b["total_price"] for b in bookings)
+    expenses_by_category = {row["category"]: row["expenses"] for row in category_rows if row["expenses"]}
     
     net_profit = total_income - total_expenses
     
@@ -1210,34 +3916,28 @@ async def get_expense_summary(
         "total_income": total_income,
         "net_profit": net_profit,
         "expenses_by_category": expenses_by_category,
-        "expense_count": len(expenses)
+        "expense_count": totals.get("expense_count", 0)
     }
 
-@api_router.get("/expenses/monthly/chart")
+@analytics_router.get("/expenses/monthly/chart")
 async def get_expenses_monthly_chart(
     year: int = datetime.now().year,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    etag: str = Depends(conditional_get("bookings", "expenses")),
 ):
     """
     Oylik chiqimlar va daromadlar grafik uchun
     """
+    rows = await run_report(ReportQuery(
+        measures=["revenue", "expenses"], dimensions=["month"], date_from=f"{year}-01-01", date_to=f"{year}-12-31"
+    ))
+    totals_by_month = {row["month"]: row for row in rows}
+    
     monthly_data = []
     for month in range(1, 13):
-        month_str = f"{year}-{month:02d}"
-        
-        # Chiqimlar
-        expenses = await db.expenses.find(
-            {"date": {"$regex": f"^{month_str}"}},
-            {"_id": 0}
-        ).to_list(5000)
-        total_expenses = sum(e["amount"] for e in expenses)
-        
-        # Daromad
-        bookings = await db.bookings.find(
-            {"checked_in_at": {"$regex": f"^{month_str}"}},
-            {"_id": 0}
-        ).to_list(5000)
-        total_income = sum(b["total_price"] for b in bookings)
+        totals = totals_by_month.get(f"{year}-{month:02d}", {})
+        total_expenses = totals.get("expenses", 0)
+        total_income = totals.get("revenue", 0)
         
         monthly_data.append({
             "month": datetime(year, month, 1).strftime("%B"),
@@ -1249,4 +3949,156 @@ async def get_expenses_monthly_chart(
     
     return monthly_data 
 
+# ============== Eksport: CSV / NDJSON oqim (streaming) ==============
+
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+EXPORT_BATCH_SIZE = 500
+
+BOOKING_EXPORT_COLUMNS = [
+    "id", "room_number", "guest_names", "check_in_date", "check_out_date", "nights",
+    "total_price", "status", "checked_in_at", "checked_out_at", "created_at", "room_id", "guest_ids",
+]
+ARCHIVE_EXPORT_COLUMNS = [
+    "booking_id", "guest_id", "guest_name", "guest_phone", "guest_passport_id", "room_id", "room_number",
+    "check_in_date", "check_out_date", "nights", "status", "total_price", "guest_share_price",
+    "checked_in_at", "checked_out_at", "created_at",
+]
+EXPENSE_EXPORT_COLUMNS = ["id", "date", "title", "category", "amount", "description", "created_by", "created_at"]
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return "; ".join(str(v) for v in value)
+    return "" if value is None else value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def _export_chunks(rows: AsyncIterator[dict], columns: List[str], export_format: str) -> AsyncIterator[str]:
+    """
+    Qatorlarni EXPORT_BATCH_SIZE dan guruhlab matn bo'laklariga aylantirish
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(columns)
+    count = 0
+    async for row in rows:
+        if export_format == "csv":
+            writer.writerow([_export_value(row.get(column)) for column in columns])
+        else:
+            buffer.write(json.dumps({column: row.get(column) for column in columns}, default=_json_default, ensure_ascii=False))
+            buffer.write("\n")
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(rows: AsyncIterator[dict], columns: List[str], export_format: str, name: str) -> StreamingResponse:
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}")
+    filename = f"{name}-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{export_format}"
+    return StreamingResponse(
+        _export_chunks(rows, columns, export_format),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+async def _iter_bookings_export(database, query: dict, sort_by: str, sort_direction: int) -> AsyncIterator[dict]:
+    # database handler ichida olinadi - javob tanasi route kontekstidan tashqarida o'qiladi
+    cursor = database.bookings.find(query, {"_id": 0}).sort(sort_by, sort_direction).batch_size(EXPORT_BATCH_SIZE)
+    batch = []
+    async for booking in cursor:
+        booking["nights"] = calculate_nights(booking.get("check_in_date"), booking.get("check_out_date"))
+        batch.append(booking)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            for row in await enrich_bookings(batch, database=database):
+                yield row
+            batch = []
+    if batch:
+        for row in await enrich_bookings(batch, database=database):
+            yield row
+
+
+@analytics_router.get("/export/bookings")
+async def export_bookings(
+    export_format: str = Query("csv", alias="format"),
+    status: Optional[str] = None,
+    sort_by: Optional[str] = "created_at",
+    sort_dir: Optional[str] = "desc",
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Bronlar eksporti (GET /bookings bilan bir xil filtrlar, sahifalashsiz)
+    """
+    query = {}
+    if status:
+        query["status"] = status
+    actual_sort_by = sort_by if sort_by in BOOKING_SORT_FIELDS else "created_at"
+    sort_direction = -1 if str(sort_dir).lower() != "asc" else 1
+    return export_response(
+        _iter_bookings_export(read_db(), query, actual_sort_by, sort_direction),
+        BOOKING_EXPORT_COLUMNS,
+        export_format,
+        "bookings",
+    )
+
+
+@analytics_router.get("/export/guests/archive")
+async def export_guests_archive(
+    export_format: str = Query("csv", alias="format"),
+    q: Optional[str] = None,
+    guest_id: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    sort_by: str = "check_in_date",
+    sort_dir: str = "desc",
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Mehmonlar arxivi eksporti (GET /guests/archive bilan bir xil filtrlar)
+    """
+    pipeline = build_archive_pipeline(
+        build_archive_booking_query(status, date_from, date_to, guest_id),
+        guest_id=guest_id,
+        q=q,
+        sort_by=sort_by,
+        sort_dir=sort_dir,
+    )
+    cursor = read_db().bookings.aggregate(pipeline, allowDiskUse=True, batchSize=EXPORT_BATCH_SIZE)
+    return export_response(cursor, ARCHIVE_EXPORT_COLUMNS, export_format, "guests-archive")
+
+
+@analytics_router.get("/export/expenses")
+async def export_expenses(
+    export_format: str = Query("csv", alias="format"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    category: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Chiqimlar eksporti (GET /expenses bilan bir xil filtrlar)
+    """
+    cursor = (
+        read_db().expenses.find(build_expense_query(date_from, date_to, category), {"_id": 0})
+        .sort("date", -1)
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    return export_response(cursor, EXPENSE_EXPORT_COLUMNS, export_format, "expenses")
+
+# analytics_router birinchi: /guests/archive /guests/{guest_id} dan oldin tekshirilishi kerak
+app.include_router(analytics_router)
 app.include_router(api_router)
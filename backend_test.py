@@ -1,3 +1,4 @@
+import os
 import requests
 import sys
 from datetime import datetime, timedelta
@@ -492,7 +493,9 @@ class HotelAPITester:
         return self.tests_passed == self.tests_run
 
 def main():
-    tester = HotelAPITester()
+    # Mahalliy server uchun: python backend_test.py http://localhost:8001/api (yoki BACKEND_URL)
+    base_url = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("BACKEND_URL")
+    tester = HotelAPITester(base_url) if base_url else HotelAPITester()
     success = tester.run_all_tests()
     return 0 if success else 1
 
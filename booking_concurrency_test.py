@@ -0,0 +1,214 @@
+"""
+Bronlar uchun parallel yuklama testi: bir vaqtda yuzlab so'rov yuboriladi va
+ikki marta bron qilish / ikki marta check-in bo'lmasligi tekshiriladi.
+
+Ishlatish:
+    python booking_concurrency_test.py --base-url http://localhost:8001/api [--requests 300] [--rooms 5]
+
+Test o'z xonalarini yaratadi (admin kerak), oxirida bronlarni bekor qiladi va xonalarni o'chiradi.
+Faqat test bazasida ishlating: check-in/check-out bugungi hisobotlarga (rollups) yoziladi.
+Xatolik topilsa 1 kodi bilan tugaydi.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+
+class BookingConcurrencyTester:
+    def __init__(self, client: httpx.AsyncClient, rooms: int, requests: int):
+        self.client = client
+        self.room_count = rooms
+        self.request_count = requests
+        self.run_id = uuid.uuid4().hex[:6]
+        self.rooms = []
+        self.guest_id = None
+        self.failures = []
+        # Kelajakdagi oyna - xona holatlari (Reserved) o'zgarmaydi
+        self.window_start = datetime.now(timezone.utc).date() + timedelta(days=365)
+        self.window_days = 14
+
+    def check(self, name: str, success: bool, details: str = ""):
+        if success:
+            print(f"✅ {name}")
+        else:
+            print(f"❌ {name}: {details}")
+            self.failures.append(name)
+
+    def day(self, offset: int) -> str:
+        return (self.window_start + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+    async def fire(self, calls):
+        """
+        So'rovlarni bir vaqtda yuborish (start_gate dan keyin hammasi birga boshlanadi)
+        """
+        start_gate = asyncio.Event()
+
+        async def run(method, url, payload):
+            await start_gate.wait()
+            return await self.client.request(method, url, json=payload)
+
+        tasks = [asyncio.create_task(run(*call)) for call in calls]
+        await asyncio.sleep(0)
+        start_gate.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def login(self, username: str, password: str):
+        response = await self.client.post("/auth/login", json={"username": username, "password": password})
+        response.raise_for_status()
+        self.client.headers["Authorization"] = f"Bearer {response.json()['token']}"
+
+    async def setup(self):
+        for i in range(self.room_count):
+            response = await self.client.post("/rooms", json={
+                "room_number": f"ST-{self.run_id}-{i}",
+                "room_type": "2 kishilik",
+                "capacity": 2,
+                "price_per_night": 100000,
+                "status": "Available",
+                "description": "Concurrency test",
+            })
+            response.raise_for_status()
+            self.rooms.append(response.json())
+        response = await self.client.post("/guests", json={
+            "full_name": f"Stress Test {self.run_id}",
+            "phone": f"+99899{random.randint(1000000, 9999999)}",
+            "id_type": "passport",
+            "passport_id": f"ST{random.randint(1000000, 9999999)}",
+        })
+        response.raise_for_status()
+        self.guest_id = response.json()["id"]
+
+    async def room_bookings(self) -> dict:
+        response = await self.client.get("/calendar", params={"from": self.day(-1), "to": self.day(self.window_days + 5)})
+        response.raise_for_status()
+        room_ids = {room["id"] for room in self.rooms}
+        return {room["room_id"]: room["bookings"] for room in response.json()["rooms"] if room["room_id"] in room_ids}
+
+    def overlapping_pairs(self, bookings_by_room: dict) -> list:
+        pairs = []
+        for bookings in bookings_by_room.values():
+            active = sorted(
+                (b for b in bookings if b["status"] in ("Confirmed", "Checked In")),
+                key=lambda b: b["check_in_date"],
+            )
+            for prev, cur in zip(active, active[1:]):
+                if cur["check_in_date"] < prev["check_out_date"]:
+                    pairs.append((prev["id"], cur["id"]))
+        return pairs
+
+    async def test_parallel_create(self):
+        calls = []
+        for _ in range(self.request_count):
+            start = random.randint(0, self.window_days - 1)
+            nights = random.randint(1, 3)
+            calls.append(("POST", "/bookings", {
+                "guest_ids": [self.guest_id],
+                "room_id": random.choice(self.rooms)["id"],
+                "check_in_date": self.day(start),
+                "check_out_date": self.day(start + nights),
+            }))
+        results = await self.fire(calls)
+        statuses = Counter(r.status_code if isinstance(r, httpx.Response) else type(r).__name__ for r in results)
+        print(f"   create: {dict(statuses)}")
+        self.check(
+            "parallel create: only 200/400 responses",
+            set(statuses) <= {200, 400},
+            str(dict(statuses)),
+        )
+
+        created_ids = {r.json()["id"] for r in results if isinstance(r, httpx.Response) and r.status_code == 200}
+        bookings_by_room = await self.room_bookings()
+        stored_ids = {b["id"] for bookings in bookings_by_room.values() for b in bookings}
+        self.check("parallel create: every 200 is stored", created_ids <= stored_ids, str(created_ids - stored_ids))
+        pairs = self.overlapping_pairs(bookings_by_room)
+        self.check("parallel create: no double bookings", not pairs, f"{len(pairs)} overlapping pairs, e.g. {pairs[:3]}")
+        return bookings_by_room
+
+    async def test_parallel_transitions(self, bookings_by_room: dict, fanout: int = 20):
+        confirmed = [b for bookings in bookings_by_room.values() for b in bookings if b["status"] == "Confirmed"]
+        if len(confirmed) < 2:
+            self.check("parallel transitions: enough bookings", False, "need at least 2 confirmed bookings")
+            return
+        target, cancelled = confirmed[0], confirmed[1]
+
+        results = await self.fire([("POST", f"/bookings/{target['id']}/checkin", None)] * fanout)
+        ok = sum(1 for r in results if isinstance(r, httpx.Response) and r.status_code == 200)
+        self.check("parallel check-in: exactly one succeeds", ok == 1, f"{ok} succeeded")
+
+        results = await self.fire([("POST", f"/bookings/{target['id']}/checkout", None)] * fanout)
+        ok = sum(1 for r in results if isinstance(r, httpx.Response) and r.status_code == 200)
+        self.check("parallel check-out: exactly one succeeds", ok == 1, f"{ok} succeeded")
+
+        results = await self.fire([("DELETE", f"/bookings/{cancelled['id']}", None)] * fanout)
+        ok = sum(1 for r in results if isinstance(r, httpx.Response) and r.status_code == 200)
+        self.check("parallel cancel: all requests answered 200", ok == fanout, f"{ok}/{fanout}")
+
+        # Bo'shagan oraliqlar yana bron qilinadi - faqat bittasi
+        calls = [
+            ("POST", "/bookings", {
+                "guest_ids": [self.guest_id],
+                "room_id": cancelled["room_id"],
+                "check_in_date": cancelled["check_in_date"],
+                "check_out_date": cancelled["check_out_date"],
+            })
+        ] * fanout
+        results = await self.fire(calls)
+        ok = sum(1 for r in results if isinstance(r, httpx.Response) and r.status_code == 200)
+        self.check("rebook cancelled window: exactly one succeeds", ok == 1, f"{ok} succeeded")
+
+    async def test_parallel_updates(self):
+        bookings_by_room = await self.room_bookings()
+        confirmed = [b for bookings in bookings_by_room.values() for b in bookings if b["status"] == "Confirmed"]
+        # Hammasini bitta bo'sh oraliqqa ko'chirishga urinish (oynadan tashqarida)
+        target_from, target_to = self.day(self.window_days + 2), self.day(self.window_days + 4)
+        calls = [
+            ("PUT", f"/bookings/{booking['id']}", {"check_in_date": target_from, "check_out_date": target_to})
+            for booking in confirmed
+        ]
+        await self.fire(calls)
+        pairs = self.overlapping_pairs(await self.room_bookings())
+        self.check("parallel updates: no double bookings", not pairs, f"{len(pairs)} overlapping pairs, e.g. {pairs[:3]}")
+
+    async def cleanup(self):
+        bookings_by_room = await self.room_bookings()
+        ids = [b["id"] for bookings in bookings_by_room.values() for b in bookings if b["status"] != "Cancelled"]
+        await asyncio.gather(*(self.client.delete(f"/bookings/{booking_id}") for booking_id in ids))
+        await asyncio.gather(*(self.client.delete(f"/rooms/{room['id']}") for room in self.rooms))
+
+    async def run(self, username: str, password: str) -> int:
+        await self.login(username, password)
+        await self.setup()
+        try:
+            bookings_by_room = await self.test_parallel_create()
+            await self.test_parallel_transitions(bookings_by_room)
+            await self.test_parallel_updates()
+        finally:
+            await self.cleanup()
+        print(f"\n{len(self.failures)} failed checks")
+        return 1 if self.failures else 0
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Parallel booking stress test")
+    parser.add_argument("--base-url", default="http://localhost:8001/api")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--parallel", type=int, default=200, help="max open connections")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.parallel, max_keepalive_connections=args.parallel)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        tester = BookingConcurrencyTester(client, args.rooms, args.requests)
+        return await tester.run(args.username, args.password)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
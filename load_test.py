@@ -0,0 +1,433 @@
+"""
+Mahalliy yuklama testi: virtual foydalanuvchilar real ssenariylar aralashmasini bajaradi
+(qabulxona, kalendar, buxgalter) va har bir endpoint bo'yicha throughput hamda
+p50/p95/p99 kechikish JSON ko'rinishida chiqariladi.
+
+Ssenariylar:
+- front_desk: dashboard, mehmon qidiruvi, bron -> check-in -> check-out -> xona bo'shatish
+- calendar:   kalendar oylari (ETag bilan, brauzer kabi), xonalar va bronlar ro'yxati
+- accountant: kunlik/oylik/yillik hisobotlar, chiqimlar statistikasi, report query, yangi chiqim
+
+Ishlatish:
+    # server allaqachon ishlayapti (alohida test bazasi bilan!)
+    python load_test.py --base-url http://localhost:8001/api --users 20 --duration 60 --output run.json
+
+    # serverni o'zi ko'taradi: mahalliy mongod kerak (masalan: docker run -p 27017:27017 mongo:7)
+    python load_test.py --start-server --mongo-url mongodb://localhost:27017 --db-name hotel_loadtest
+
+    # oldingi commit natijasi bilan solishtirish (p95 20% dan ko'p o'ssa - 1 kodi)
+    python load_test.py --start-server --baseline run.json --max-regression 20
+
+Bir xil --seed, --users, --duration va --mix bilan ishga tushirilgan natijalarni commitlar
+orasida solishtirish mumkin. Faqat test bazasida ishlating: check-in/check-out va chiqimlar
+hisobotlarga yoziladi.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent
+DEFAULT_MIX = "front_desk=5,calendar=3,accountant=2"
+EXPENSE_CATEGORIES = ["Kommunal", "Oziq-ovqat", "Tozalash", "Ta'mirlash", "Boshqa"]
+SEARCH_TERMS = ["Load", "Test", "+99890", "LT", "Mehmon", "ali", "AB1"]
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.mongo_ops = 0
+        self.mongo_ops_samples = 0
+
+    def summary(self, seconds: float) -> dict:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "statuses": {str(code): n for code, n in sorted(self.statuses.items())},
+            "rps": round(count / seconds, 2) if seconds else 0.0,
+            "mean_ms": round(sum(latencies) / count, 2) if count else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(latencies[-1], 2) if count else 0.0,
+            "mongo_ops_mean": round(self.mongo_ops / self.mongo_ops_samples, 2) if self.mongo_ops_samples else None,
+        }
+
+
+class VirtualUser:
+    def __init__(self, harness: "LoadTestHarness", index: int):
+        self.harness = harness
+        self.client = harness.client
+        self.rng = random.Random(f"{harness.seed}:{index}")
+        self.etags = {}
+        # Har bir foydalanuvchining o'z kelajakdagi oynasi - bronlar bir-biriga kam to'qnashadi
+        self.window_start = harness.window_start + timedelta(days=index * 40)
+        self.next_offset = 0
+
+    async def call(self, name: str, method: str, url: str, *, json_body=None, params=None, etag_key=None):
+        headers = {}
+        if etag_key and etag_key in self.etags:
+            headers["If-None-Match"] = self.etags[etag_key]
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, json=json_body, params=params, headers=headers)
+        except httpx.HTTPError:
+            self.harness.record(name, start, None)
+            return None
+        self.harness.record(name, start, response)
+        if etag_key and response.headers.get("ETag"):
+            self.etags[etag_key] = response.headers["ETag"]
+        return response
+
+    def day(self, offset: int) -> str:
+        return (self.window_start + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+    async def front_desk(self):
+        await self.call("GET /dashboard/stats", "GET", "/dashboard/stats", etag_key="dashboard")
+        await self.call(
+            "GET /guests/search", "GET", "/guests/search",
+            params={"q": self.rng.choice(SEARCH_TERMS), "typeahead": "true"},
+        )
+        room = self.rng.choice(self.harness.rooms)
+        nights = self.rng.randint(1, 3)
+        start = self.next_offset % 35
+        self.next_offset += nights
+        response = await self.call("POST /bookings", "POST", "/bookings", json_body={
+            "guest_ids": [self.rng.choice(self.harness.guest_ids)],
+            "room_id": room["id"],
+            "check_in_date": self.day(start),
+            "check_out_date": self.day(start + nights),
+        })
+        if response is None or response.status_code != 200:
+            return
+        booking_id = response.json()["id"]
+        self.harness.booking_ids.append(booking_id)
+        await self.call("POST /bookings/{id}/checkin", "POST", f"/bookings/{booking_id}/checkin")
+        await self.call("POST /bookings/{id}/checkout", "POST", f"/bookings/{booking_id}/checkout")
+        await self.call("POST /rooms/{id}/mark-available", "POST", f"/rooms/{room['id']}/mark-available")
+
+    async def calendar(self):
+        today = datetime.now(timezone.utc).date().replace(day=1)
+        for _ in range(self.rng.randint(1, 3)):
+            month_start = (today + timedelta(days=32 * self.rng.randint(-2, 3))).replace(day=1)
+            month_end = (month_start + timedelta(days=32)).replace(day=1)
+            await self.call(
+                "GET /calendar", "GET", "/calendar",
+                params={"from": month_start.isoformat(), "to": month_end.isoformat()},
+                etag_key=f"calendar:{month_start}",
+            )
+        await self.call("GET /rooms", "GET", "/rooms", etag_key="rooms")
+        await self.call(
+            "GET /bookings", "GET", "/bookings",
+            params={"status": self.rng.choice(["Confirmed", "Checked In", "Checked Out"]), "limit": 50},
+        )
+
+    async def accountant(self):
+        today = datetime.now(timezone.utc).date()
+        day = today - timedelta(days=self.rng.randint(0, 60))
+        await self.call("GET /reports/daily", "GET", "/reports/daily", params={"date": day.isoformat()},
+                        etag_key=f"daily:{day}")
+        await self.call("GET /reports/monthly", "GET", "/reports/monthly", params={"month": day.strftime("%Y-%m")},
+                        etag_key=f"monthly:{day:%Y-%m}")
+        await self.call("GET /reports/revenue", "GET", "/reports/revenue", params={"year": today.year},
+                        etag_key="revenue")
+        await self.call("GET /expenses/summary/stats", "GET", "/expenses/summary/stats",
+                        params={"date_from": f"{today.year}-01-01", "date_to": today.isoformat()},
+                        etag_key="expense_summary")
+        await self.call("GET /expenses/monthly/chart", "GET", "/expenses/monthly/chart", params={"year": today.year},
+                        etag_key="expense_chart")
+        await self.call("POST /reports/query", "POST", "/reports/query", json_body={
+            "measures": ["revenue", "nights"],
+            "dimensions": [self.rng.choice(["room_type", "room", "month"])],
+            "date_from": f"{today.year}-01-01",
+            "date_to": today.isoformat(),
+        })
+        if self.rng.random() < 0.2:
+            response = await self.call("POST /expenses", "POST", "/expenses", json_body={
+                "title": f"Load test {self.harness.run_id}",
+                "category": self.rng.choice(EXPENSE_CATEGORIES),
+                "amount": self.rng.randint(10, 500) * 1000,
+                "date": day.isoformat(),
+            })
+            if response is not None and response.status_code == 200:
+                self.harness.expense_ids.append(response.json()["id"])
+
+    async def run(self, deadline: float, scenarios: list, weights: list, think_seconds: float):
+        while time.perf_counter() < deadline:
+            await getattr(self, self.rng.choices(scenarios, weights)[0])()
+            if think_seconds:
+                await asyncio.sleep(think_seconds)
+
+
+class LoadTestHarness:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.seed = args.seed
+        self.run_id = uuid.uuid4().hex[:6]
+        self.rooms = []
+        self.guest_ids = []
+        self.booking_ids = []
+        self.expense_ids = []
+        self.stats = {}
+        self.measuring = False
+        self.window_start = datetime.now(timezone.utc).date() + timedelta(days=400)
+
+    def record(self, name: str, start: float, response):
+        if not self.measuring:
+            return
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = EndpointStats()
+        stats.latencies.append((time.perf_counter() - start) * 1000)
+        if response is None:
+            stats.errors += 1
+            stats.statuses["exception"] += 1
+            return
+        stats.statuses[response.status_code] += 1
+        if response.status_code >= 500:
+            stats.errors += 1
+        mongo_ops = response.headers.get("X-Mongo-Ops")
+        if mongo_ops is not None:
+            stats.mongo_ops += int(mongo_ops)
+            stats.mongo_ops_samples += 1
+
+    async def login(self, username: str, password: str):
+        response = await self.client.post("/auth/login", json={"username": username, "password": password})
+        response.raise_for_status()
+        self.client.headers["Authorization"] = f"Bearer {response.json()['token']}"
+
+    async def setup(self, room_count: int, guest_count: int):
+        rng = random.Random(self.seed)
+        for i in range(room_count):
+            response = await self.client.post("/rooms", json={
+                "room_number": f"LT-{self.run_id}-{i}",
+                "room_type": rng.choice(["1 kishilik", "2 kishilik", "Lyuks"]),
+                "capacity": 2,
+                "price_per_night": rng.randint(10, 60) * 10000,
+                "status": "Available",
+                "description": "Load test",
+            })
+            response.raise_for_status()
+            self.rooms.append(response.json())
+        for i in range(guest_count):
+            response = await self.client.post("/guests", json={
+                "full_name": f"Load Test {self.run_id} {i}",
+                "phone": f"+99890{rng.randint(1000000, 9999999)}",
+                "id_type": "passport",
+                "passport_id": f"LT{self.run_id.upper()}{i:04d}",
+            })
+            response.raise_for_status()
+            self.guest_ids.append(response.json()["id"])
+
+    async def cleanup(self):
+        await asyncio.gather(*(self.client.delete(f"/bookings/{booking_id}") for booking_id in self.booking_ids))
+        await asyncio.gather(*(self.client.delete(f"/expenses/{expense_id}") for expense_id in self.expense_ids))
+        await asyncio.gather(*(self.client.delete(f"/rooms/{room['id']}") for room in self.rooms))
+
+    async def run(self, args, scenarios: list, weights: list) -> dict:
+        await self.login(args.username, args.password)
+        await self.setup(args.rooms, args.guests)
+        users = [VirtualUser(self, i) for i in range(args.users)]
+        think_seconds = args.think_ms / 1000
+        try:
+            start = time.perf_counter()
+            deadline = start + args.warmup + args.duration
+            tasks = [asyncio.create_task(user.run(deadline, scenarios, weights, think_seconds)) for user in users]
+            await asyncio.sleep(args.warmup)
+            self.measuring = True
+            measure_start = time.perf_counter()
+            await asyncio.gather(*tasks)
+            self.measuring = False
+            seconds = time.perf_counter() - measure_start
+        finally:
+            await self.cleanup()
+        return self.report(seconds)
+
+    def report(self, seconds: float) -> dict:
+        endpoints = {name: stats.summary(seconds) for name, stats in sorted(self.stats.items())}
+        latencies = sorted(latency for stats in self.stats.values() for latency in stats.latencies)
+        count = len(latencies)
+        return {
+            "totals": {
+                "seconds": round(seconds, 2),
+                "requests": count,
+                "errors": sum(stats.errors for stats in self.stats.values()),
+                "rps": round(count / seconds, 2) if seconds else 0.0,
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+            },
+            "endpoints": endpoints,
+        }
+
+
+def parse_mix(value: str):
+    scenarios, weights = [], []
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("front_desk", "calendar", "accountant"):
+            raise argparse.ArgumentTypeError(f"unknown scenario: {name}")
+        scenarios.append(name)
+        weights.append(float(weight or 1))
+    return scenarios, weights
+
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> int:
+    """
+    Endpoint lar bo'yicha p95 va rps farqi. max_regression > 0 bo'lsa, p95 shuncha foizdan
+    ko'p o'sgan endpoint bor-yo'qligi tekshiriladi (kamida 20 ta so'rov bo'lganlar).
+    """
+    regressions = []
+    print(f"\n{'endpoint':<34} {'p95 base':>9} {'p95 now':>9} {'diff':>8} {'rps base':>9} {'rps now':>9}")
+    for name, now in result["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if base is None:
+            print(f"{name:<34} {'-':>9} {now['p95_ms']:>9.1f} {'new':>8} {'-':>9} {now['rps']:>9.1f}")
+            continue
+        diff = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 if base["p95_ms"] else 0.0
+        print(f"{name:<34} {base['p95_ms']:>9.1f} {now['p95_ms']:>9.1f} {diff:>+7.1f}% {base['rps']:>9.1f} {now['rps']:>9.1f}")
+        if max_regression > 0 and diff > max_regression and min(now["count"], base["count"]) >= 20:
+            regressions.append(name)
+    if regressions:
+        print(f"\n❌ p95 regression above {max_regression}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+async def wait_for_server(base_url: str, timeout: float):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2) as probe:
+        while time.perf_counter() < deadline:
+            try:
+                await probe.get("/auth/me")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.25)
+    raise RuntimeError(f"server at {base_url} did not start within {timeout}s")
+
+
+def start_server(args) -> subprocess.Popen:
+    # WEB_CONCURRENCY > 1 - server ETag versiyalarini workerlar o'rtasida Mongo da saqlaydi
+    env = dict(os.environ, MONGO_URL=args.mongo_url, DB_NAME=args.db_name, WEB_CONCURRENCY=str(args.server_workers))
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "server:app",
+            "--host", "127.0.0.1", "--port", str(args.port),
+            "--workers", str(args.server_workers), "--log-level", "warning",
+        ],
+        cwd=ROOT_DIR / "backend",
+        env=env,
+    )
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Local load test with per-endpoint latency percentiles")
+    parser.add_argument("--base-url", default=None, help="default: http://localhost:8001/api")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds before measuring starts")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between scenario iterations")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"default: {DEFAULT_MIX}")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--guests", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0, help="fail if any p95 grows by more than this %%")
+    parser.add_argument("--start-server", action="store_true", help="run uvicorn from ./backend for the test")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="hotel_loadtest")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--server-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    base_url = args.base_url or (
+        f"http://127.0.0.1:{args.port}/api" if args.start_server else "http://localhost:8001/api"
+    )
+    server = start_server(args) if args.start_server else None
+    try:
+        if server is not None:
+            await wait_for_server(base_url, timeout=30)
+        limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            harness = LoadTestHarness(client, args)
+            result = await harness.run(args, *args.mix)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    scenarios, weights = args.mix
+    result = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "base_url": base_url,
+            **git_revision(),
+            "users": args.users,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "think_ms": args.think_ms,
+            "mix": dict(zip(scenarios, weights)),
+            "rooms": args.rooms,
+            "guests": args.guests,
+            "seed": args.seed,
+            "server_workers": args.server_workers if server is not None else None,
+            "python": platform.python_version(),
+        },
+        **result,
+    }
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+        totals = result["totals"]
+        print(f"{totals['requests']} requests, {totals['rps']} rps, p95 {totals['p95_ms']} ms -> {args.output}")
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        return compare(result, baseline, args.max_regression)
+    return 1 if result["totals"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from server import _import_row, iter_import_rows
+
+
+def read_rows(data: bytes, fmt: str, chunk_size: int = 64 * 1024):
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def collect():
+        return [row async for row in iter_import_rows(chunks(), fmt)]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64 * 1024])
+def test_csv_quoted_fields_across_chunks(chunk_size):
+    data = (
+        'full_name,phone,street\n'
+        '"Karimov, Alisher",+998901234567,"Navoiy ko\'chasi\n12-uy"\n'
+        '"Aziz ""Aka"" Toshev",998911112233,\n'
+    ).encode()
+    assert read_rows(data, "csv", chunk_size) == [
+        (1, {"full_name": "Karimov, Alisher", "phone": "+998901234567", "street": "Navoiy ko'chasi\n12-uy"}),
+        (2, {"full_name": 'Aziz "Aka" Toshev', "phone": "998911112233", "street": ""}),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 64 * 1024])
+def test_csv_bom_and_crlf(chunk_size):
+    data = "\ufefffull_name , phone\r\nАлишер Каримов,901234567\r\n\r\n".encode("utf-8")
+    rows = read_rows(data, "csv", chunk_size)
+    assert rows == [(1, {"full_name": "Алишер Каримов", "phone": "901234567"})]
+
+
+def test_csv_short_row_and_missing_trailing_newline():
+    rows = read_rows(b"full_name,phone,passport_id\nAli Valiyev\nVali Aliyev,901112233,AA1234567", "csv")
+    assert rows == [
+        (1, {"full_name": "Ali Valiyev"}),
+        (2, {"full_name": "Vali Aliyev", "phone": "901112233", "passport_id": "AA1234567"}),
+    ]
+
+
+def test_csv_unterminated_quote_ends_at_eof():
+    rows = read_rows(b'full_name,phone\n"Ali Valiyev,901112233\n', "csv")
+    assert len(rows) == 1
+    number, row = rows[0]
+    assert number == 1
+    assert row["full_name"].startswith("Ali Valiyev,901112233")
+
+
+def test_ndjson_bad_line_is_reported_and_numbering_continues():
+    data = b'{"full_name": "Ali Valiyev"}\n{not json}\n\n["list"]\n{"full_name": "Vali Aliyev"}\n'
+    rows = read_rows(data, "ndjson", chunk_size=5)
+    assert [number for number, _ in rows] == [1, 2, 3, 4]
+    assert rows[0][1] == {"full_name": "Ali Valiyev"}
+    assert isinstance(rows[1][1], ValueError)
+    assert rows[2][1] == ["list"]
+    assert rows[3][1] == {"full_name": "Vali Aliyev"}
+
+
+def test_json_array_with_bom():
+    data = '\ufeff[{"full_name": "Ali Valiyev"}, "bad"]'.encode("utf-8")
+    assert read_rows(data, "json", chunk_size=4) == [(1, {"full_name": "Ali Valiyev"}), (2, "bad")]
+
+
+@pytest.mark.parametrize("data", [b'{"full_name": "Ali Valiyev"}', b"[{"])
+def test_json_rejects_non_array_and_broken_files(data):
+    with pytest.raises(ValueError):
+        read_rows(data, "json")
+
+
+def test_import_row_strips_values_and_drops_empty_cells():
+    assert _import_row({" full_name ": " Ali Valiyev ", "phone": "", "passport_id": None, "": "x"}) == {
+        "full_name": "Ali Valiyev"
+    }
+
+
+@pytest.mark.parametrize("raw", [["Ali Valiyev"], "Ali Valiyev", ValueError("bad json")])
+def test_import_row_rejects_non_objects(raw):
+    with pytest.raises(ValueError):
+        _import_row(raw)
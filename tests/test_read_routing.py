@@ -0,0 +1,107 @@
+import asyncio
+import importlib.util
+import json
+
+import pytest
+from fastapi import APIRouter
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+
+import server
+from server import AnalyticsRoute, MetricsRoute, analytics_db, db, read_db
+
+ANALYTICS_ROUTES = [
+    ("GET", "/api/reports/daily"),
+    ("GET", "/api/reports/monthly"),
+    ("POST", "/api/reports/query"),
+    ("GET", "/api/guests/archive"),
+    ("GET", "/api/export/bookings"),
+    ("GET", "/api/export/guests/archive"),
+]
+PRIMARY_ROUTES = [
+    ("POST", "/api/bookings"),
+    ("PUT", "/api/bookings/{booking_id}"),
+    ("DELETE", "/api/bookings/{booking_id}"),
+    ("POST", "/api/bookings/{booking_id}/checkin"),
+    ("POST", "/api/bookings/{booking_id}/checkout"),
+    ("GET", "/api/guests/{guest_id}"),
+]
+
+
+def find_route(method: str, path: str) -> APIRoute:
+    for route in server.app.routes:
+        if isinstance(route, APIRoute) and route.path == path and method in route.methods:
+            return route
+    raise AssertionError(f"{method} {path} is not registered")
+
+
+def call_probe(route_class) -> str:
+    """
+    Route sinfi handler i ichida read_db() qaysi bazani qaytarishini tekshirish (Mongo ga ulanmasdan)
+    """
+    router = APIRouter(route_class=route_class)
+
+    @router.get("/probe")
+    async def probe():
+        database = read_db()
+        return {"db": "analytics" if database is analytics_db else "primary" if database is db else "other"}
+
+    handler = router.routes[0].get_route_handler()
+    scope = {"type": "http", "method": "GET", "path": "/probe", "headers": [], "query_string": b""}
+    response = asyncio.run(handler(Request(scope)))
+    return json.loads(response.body)["db"]
+
+
+@pytest.mark.parametrize("method, path", ANALYTICS_ROUTES)
+def test_report_and_archive_routes_use_analytics_route(method, path):
+    assert isinstance(find_route(method, path), AnalyticsRoute)
+
+
+@pytest.mark.parametrize("method, path", PRIMARY_ROUTES)
+def test_booking_mutations_and_reception_reads_use_primary_route(method, path):
+    route = find_route(method, path)
+    assert isinstance(route, MetricsRoute)
+    assert not isinstance(route, AnalyticsRoute)
+
+
+def test_analytics_route_handler_reads_from_analytics_db():
+    assert call_probe(AnalyticsRoute) == "analytics"
+    # Handler tugagach kontekst tiklanadi
+    assert read_db() is db
+
+
+def test_metrics_route_handler_reads_from_primary_db():
+    assert call_probe(MetricsRoute) == "primary"
+
+
+def test_read_db_outside_routes_is_primary():
+    assert read_db() is db
+
+
+def load_server(monkeypatch, **env):
+    monkeypatch.delenv("ANALYTICS_MONGO_URL", raising=False)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    spec = importlib.util.spec_from_file_location("server_routing_copy", server.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def seeds(motor_client) -> set:
+    return set(motor_client.delegate.topology_description.server_descriptions())
+
+
+def test_analytics_pool_falls_back_to_primary_without_url(monkeypatch):
+    module = load_server(monkeypatch, MONGO_URL="mongodb://primary.test:27017")
+    assert module.ANALYTICS_MONGO_URL == module.mongo_url
+    assert seeds(module.analytics_client) == seeds(module.client) == {("primary.test", 27017)}
+    assert module.analytics_db.name == module.db.name
+
+
+def test_analytics_pool_uses_its_own_url(monkeypatch):
+    module = load_server(
+        monkeypatch, MONGO_URL="mongodb://primary.test:27017", ANALYTICS_MONGO_URL="mongodb://analytics.test:27018"
+    )
+    assert seeds(module.client) == {("primary.test", 27017)}
+    assert seeds(module.analytics_client) == {("analytics.test", 27018)}
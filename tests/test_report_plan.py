@@ -0,0 +1,99 @@
+import pytest
+
+from server import ReportParam, bind_report_params, compile_report_plan
+
+
+def plan(measures, dimensions=(), filter_dims=(), sort_by=None, sort_direction=1, has_limit=False, use_rollups=True):
+    return compile_report_plan(tuple(measures), tuple(dimensions), tuple(filter_dims), sort_by, sort_direction,
+                               has_limit, use_rollups)
+
+
+def stage_names(pipeline):
+    return [next(iter(stage)) for stage in pipeline]
+
+
+def test_totals_from_rollups():
+    result = plan(["revenue", "check_ins", "expenses"])
+    assert result.source == "rollups"
+    assert result.collection == "rollups"
+    assert result.granularity is None
+    assert stage_names(result.pipeline) == ["$match", "$project", "$group", "$project"]
+    assert result.pipeline[1]["$project"]["m_revenue"] == {"$ifNull": ["$income", 0]}
+
+
+def test_day_dimension_forces_day_granularity():
+    result = plan(["check_outs"], ["day"])
+    assert result.source == "rollups"
+    assert result.granularity == "day"
+    assert result.pipeline[1]["$project"]["d_day"] == "$period"
+
+
+def test_room_type_served_from_rollup_map():
+    result = plan(["check_ins"], ["room_type"], sort_by="check_ins", sort_direction=-1, has_limit=True)
+    assert result.source == "rollups"
+    assert stage_names(result.pipeline) == [
+        "$match", "$project", "$unwind", "$match", "$project", "$group", "$sort", "$limit", "$project",
+    ]
+    assert result.pipeline[1]["$project"]["entry"] == {"$objectToArray": {"$ifNull": ["$room_types", {}]}}
+    assert result.pipeline[4]["$project"]["m_check_ins"] == "$entry.v"
+    assert result.pipeline[6]["$sort"] == {"check_ins": -1, "_id.room_type": 1}
+    assert result.pipeline[7]["$limit"] == ReportParam("limit")
+
+
+def test_category_served_from_rollup_map_with_month():
+    result = plan(["expenses"], ["month", "category"])
+    assert result.source == "rollups"
+    projection = result.pipeline[4]["$project"]
+    assert projection["d_month"] == {"$substrCP": ["$period", 0, 7]}
+    assert projection["m_expenses"] == "$entry.v"
+    assert "$replaceAll" in projection["d_category"]
+
+
+@pytest.mark.parametrize("measures, dimensions, filter_dims, use_rollups", [
+    (["revenue"], ["room_type"], [], True),          # xaritada faqat check_ins bor
+    (["expense_count"], ["category"], [], True),     # xaritada faqat expenses bor
+    (["guests"], [], [], True),                      # rollup maydoni yo'q
+    (["check_ins"], ["room"], [], True),
+    (["check_ins"], [], ["room_type"], True),        # filtrlar faqat xom faktlarda
+    (["check_ins"], [], [], False),
+])
+def test_raw_fallback(measures, dimensions, filter_dims, use_rollups):
+    assert plan(measures, dimensions, filter_dims, use_rollups=use_rollups).source == "raw"
+
+
+def test_raw_plan_unions_facts_and_looks_up_rooms():
+    result = plan(["revenue", "expenses"], ["month"], use_rollups=False)
+    assert result.collection == "bookings"
+    assert stage_names(result.pipeline) == ["$match", "$project", "$unionWith", "$group", "$sort", "$project"]
+    union = result.pipeline[2]["$unionWith"]
+    assert union["coll"] == "expenses"
+    assert union["pipeline"][1]["$project"]["m_revenue"] == {"$literal": 0}
+
+    with_room = plan(["check_ins"], ["room_type"], use_rollups=False)
+    assert "$lookup" in stage_names(with_room.pipeline)
+
+
+def test_filters_bind_as_params():
+    result = plan(["check_ins"], ["status"], ["room_type"])
+    match = result.pipeline[-4]["$match"]
+    assert match == {"d_room_type": {"$in": ReportParam("filter.room_type")}}
+    bound = bind_report_params(result.pipeline, {"filter.room_type": ["VIP"], "date_from": "2025-01-01"})
+    assert bound[0]["$match"]["checked_in_at"] == {"$type": "string", "$gte": "2025-01-01"}
+    assert bound[-4]["$match"] == {"d_room_type": {"$in": ["VIP"]}}
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    ({"measures": []}, "At least one measure"),
+    ({"measures": ["profit"]}, "Unknown measure"),
+    ({"measures": ["revenue"], "dimensions": ["weekday"]}, "Unknown dimension"),
+    ({"measures": ["revenue", "revenue"]}, "Duplicate"),
+    ({"measures": ["expenses"], "dimensions": ["room_type"]}, "not available for expenses"),
+    ({"measures": ["revenue"], "sort_by": "expenses"}, "Cannot sort by"),
+])
+def test_invalid_specs(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        plan(**kwargs)
+
+
+def test_plans_are_cached_templates():
+    assert plan(["revenue"], ["month"]) is plan(["revenue"], ["month"])